@@ -0,0 +1,553 @@
+import gc
+import os
+import sys
+import json
+import time
+import pickle
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import random
+import networkx
+import numpy as np
+from dataclasses import dataclass
+from typing import List, Tuple, Dict, Any, Callable #type: ignore
+
+import city
+import routing
+import contraction
+import restaurants as rest
+import snapshot
+import schedule
+
+
+def random_pairs(nodes: List, n: int, seed: int = 0) -> List[Tuple]:
+    """
+    Picks n random (origin, destination) pairs of nodes, always the same ones for a given seed.
+    Args:
+        nodes: list of nodes to pick from
+        n: number of pairs
+        seed: seed of the random generator
+    Returns:
+    List of pairs of nodes.
+    """
+    rnd = random.Random(seed)
+    return [(rnd.choice(nodes), rnd.choice(nodes)) for _ in range(n)]
+
+
+def bench_find_path(g: city.CityGraph, router: routing.Router, n: int = 100) -> None:
+    """
+    Compares the latency per query of the routing engine with the networkx weighted shortest path,
+    checking that both find paths with the same travel time.
+    Args:
+        g: CityGraph
+        router: Router over the snapshot of g
+        n: number of queries
+    """
+    pairs = random_pairs(list(g.nodes()), n)
+    t = time.perf_counter()
+    expected = [networkx.shortest_path_length(g, o, d, weight="weight") for o, d in pairs]
+    t_nx = (time.perf_counter() - t) / n
+    t = time.perf_counter()
+    got = [routing.travel_time_h(router, o, d) for o, d in pairs]
+    t_astar = (time.perf_counter() - t) / n
+    assert all(abs(a - b) < 1e-9 for a, b in zip(expected, got))
+    print("find_path, " + str(g.number_of_nodes()) + " nodes, " + str(n) + " queries")
+    print("  networkx dijkstra: %.2f ms/query" % (t_nx * 1000))
+    print("  routing A*:        %.2f ms/query" % (t_astar * 1000))
+
+
+def bench_hierarchy(router: routing.Router, hierarchy: contraction.Hierarchy, n: int = 1000) -> None:
+    """
+    Compares the latency per query of the contraction hierarchy (travel time only, and with the path unpacked)
+    with the A* of the routing engine, checking that both find the same travel times.
+    Args:
+        router: Router over the snapshot
+        hierarchy: Hierarchy of the same snapshot
+        n: number of queries
+    """
+    pairs = random_pairs(router.ids, n)
+    t = time.perf_counter()
+    expected = [routing.travel_time_h(router, o, d) for o, d in pairs]
+    t_astar = (time.perf_counter() - t) / n
+    t = time.perf_counter()
+    got = [contraction.travel_time_h(hierarchy, o, d) for o, d in pairs]
+    t_ch = (time.perf_counter() - t) / n
+    t = time.perf_counter()
+    for o, d in pairs:
+        contraction.shortest_path(hierarchy, o, d)
+    t_unpack = (time.perf_counter() - t) / n
+    settled = sum(contraction.upward_search(hierarchy, hierarchy.index[o], hierarchy.index[d])[3] for o, d in pairs)
+    assert all(abs(a - b) < 1e-9 for a, b in zip(expected, got))
+    print("contraction hierarchy, " + str(len(router.ids)) + " nodes, " + str(n) + " queries")
+    print("  routing A*:          %.3f ms/query" % (t_astar * 1000))
+    print("  hierarchy time:      %.3f ms/query" % (t_ch * 1000))
+    print("  hierarchy + unpack:  %.3f ms/query" % (t_unpack * 1000))
+    print("  settled nodes:       %.0f /query" % (settled / n))
+
+
+def bench_timed(router: routing.Router, timed: schedule.TimedRouter, departures: List[float], n: int = 100) -> None:
+    """
+    Compares the latency per query of the time-aware A* at several times of the day with the A* of the routing
+    engine, checking that the time-aware A* finds the same travel times as its single-source search.
+    Args:
+        router: Router over the snapshot
+        timed: TimedRouter over the same snapshot
+        departures: times of day of the departures, in hours since midnight
+        n: number of queries
+    """
+    pairs = random_pairs(router.ids, n)
+    t = time.perf_counter()
+    for o, d in pairs:
+        routing.travel_time_h(router, o, d)
+    print("time-aware routing, " + str(len(router.ids)) + " nodes, " + str(n) + " queries")
+    print("  routing A*:             %.3f ms/query" % ((time.perf_counter() - t) / n * 1000))
+    for depart_h in departures:
+        t = time.perf_counter()
+        got = [schedule.shortest_path_at(timed, o, d, depart_h)[0] for o, d in pairs]
+        t_timed = (time.perf_counter() - t) / n
+        expected = [schedule.travel_times_at(timed, o, [d], depart_h, float("inf"))[0] for o, d in pairs]
+        assert all(abs(a - b) < 1e-9 for a, b in zip(expected, got))
+        print("  time-aware A* at %5.2f h: %.3f ms/query, %.1f min on average"
+              % (depart_h, t_timed * 1000, sum(got) / n * 60))
+
+
+def bench_matrix(router: routing.Router, sizes: List[int], n_destinations: int = 2500, n_pairs: int = 100) -> None:
+    """
+    Compares the time of the travel time matrix from some origins to many destinations with finding the travel time
+    of each pair with the A* of the routing engine, checking that both find the same travel times. The time of the
+    pairwise A* for the whole matrix is estimated from n_pairs of its cells.
+    Args:
+        router: Router over the snapshot
+        sizes: numbers of origins
+        n_destinations: number of destinations
+        n_pairs: number of cells of each matrix checked with the A*
+    """
+    rnd = random.Random(0)
+    destinations = [rnd.choice(router.ids) for _ in range(n_destinations)]
+    print("travel time matrix, " + str(len(router.ids)) + " nodes")
+    for n in sizes:
+        origins = [rnd.choice(router.ids) for _ in range(n)]
+        t = time.perf_counter()
+        matrix = routing.travel_time_matrix(router, origins, destinations)
+        t_matrix = time.perf_counter() - t
+        cells = [(rnd.randrange(n), rnd.randrange(n_destinations)) for _ in range(n_pairs)]
+        t = time.perf_counter()
+        expected = [routing.travel_time_h(router, origins[i], destinations[j]) for i, j in cells]
+        t_pairs = (time.perf_counter() - t) / n_pairs * n * n_destinations
+        assert all(abs(matrix[i, j] - e) < 1e-9 for (i, j), e in zip(cells, expected))
+        print("  %d x %d: matrix %.2f s, pairwise A* %.1f s (estimated)" % (n, n_destinations, t_matrix, t_pairs))
+
+
+def bench_search(restaurants: rest.Restaurants, queries: List[str], sizes: List[int]) -> None:
+    """
+    Compares the latency per query of a linear scan of all the restaurants with the n-gram index, on catalogs made
+    of copies of the given restaurants, checking that the index finds every restaurant the linear scan finds.
+    Args:
+        restaurants: list of restaurants of the database
+        queries: search queries
+        sizes: number of copies of the catalog
+    """
+    print("restaurants.find, " + str(len(queries)) + " queries")
+    for size in sizes:
+        catalog = restaurants * size
+        t = time.perf_counter()
+        index = rest.build_index(catalog)
+        t_build = time.perf_counter() - t
+        t = time.perf_counter()
+        expected = [{i for i in range(len(catalog)) if rest.is_match(q, catalog[i])} for q in queries]
+        t_linear = (time.perf_counter() - t) / len(queries)
+        t = time.perf_counter()
+        for q in queries:
+            rest.find(q, catalog, index)
+        t_index = (time.perf_counter() - t) / len(queries)
+        for q, matches in zip(queries, expected):
+            assert {i for i in rest.candidates(q, index) if rest.is_match(q, catalog[i])} == matches
+        print("  %7d restaurants: linear %.2f ms/query, index %.2f ms/query (built in %.2f s)"
+              % (len(catalog), t_linear * 1000, t_index * 1000, t_build))
+
+
+@dataclass
+class DictEdge:
+    """
+    Edge of metro.py as it was before it was slotted, with a __dict__ per instance, to compare both layouts.
+    """
+    type: str
+    color: str
+    distance: float
+
+
+def bench_memory(g1: city.OsmnxGraph, g2: city.MetroGraph) -> None:
+    """
+    Reports the memory used per node and per edge of the streets of the CityGraph built from the given graphs, both
+    in the current layout and in the one before records were slotted (positions as lists, Edge with a __dict__),
+    and per node and edge of its columnar snapshot.
+    Args:
+        g1: OsmnxGraph
+        g2: MetroGraph
+    """
+    g = city.CityGraph()
+    tracemalloc.start()
+    city.get_osmnx_nodes(g1, g)
+    nodes_bytes = tracemalloc.get_traced_memory()[0]
+    city.get_osmnx_edges(g1, g)
+    edges_bytes = tracemalloc.get_traced_memory()[0] - nodes_bytes
+    tracemalloc.stop()
+    # Only the street nodes and edges are traced, so the bytes are divided by their number, not by the whole graph's.
+    nodes, edges = g.number_of_nodes(), g.number_of_edges()
+    street_edges = [(u, v) for u, v in g1.edges() if u != v]
+    p1 = np.array([g.nodes[u]['pos'] for u, _ in street_edges])
+    p2 = np.array([g.nodes[v]['pos'] for _, v in street_edges])
+    before = city.CityGraph()
+    tracemalloc.start()
+    before.add_nodes_from((node, {'pos': list(pos), 'type': "Street"}) for node, pos in g.nodes(data='pos'))
+    before_nodes_bytes = tracemalloc.get_traced_memory()[0]
+    before.add_edges_from((u, v, {'info': DictEdge(data['info'].type, data['info'].color, data['info'].distance),
+                                  'weight': data['weight']})
+                          for u, v, data in city.weighted_edges([u for u, _ in street_edges],
+                                                                [v for _, v in street_edges], p1, p2, "Street",
+                                                                [city.edge_to_color("Street")] * len(street_edges),
+                                                                "walk"))
+    before_edges_bytes = tracemalloc.get_traced_memory()[0] - before_nodes_bytes
+    tracemalloc.stop()
+    city.get_metro_nodes_and_links(g2, g)
+    city.get_metro_edges(g2, g)
+    s = snapshot.snapshot_from_city_graph(g)
+    node_arrays = s.ids.nbytes + s.pos.nbytes + s.types.nbytes + s.indptr.nbytes
+    edge_arrays = s.indices.nbytes + s.weights.nbytes + s.kinds.nbytes + s.colors.nbytes + s.distances.nbytes
+    print("memory, " + str(nodes) + " street nodes, " + str(edges) + " street edges")
+    print("  CityGraph before: %.0f bytes/node, %.0f bytes/edge" % (before_nodes_bytes / before.number_of_nodes(),
+                                                                 before_edges_bytes / before.number_of_edges()))
+    print("  CityGraph:        %.0f bytes/node, %.0f bytes/edge" % (nodes_bytes / nodes, edges_bytes / edges))
+    print("  snapshot:         %.0f bytes/node, %.0f bytes/edge" % (node_arrays / len(s.ids),
+                                                                 edge_arrays / (len(s.indices) // 2)))
+
+
+def directory_size(dirname: str) -> int:
+    """
+    Total size of the files in a directory.
+    Returns:
+    Int with the size in bytes.
+    """
+    return sum(os.path.getsize(os.path.join(dirname, f)) for f in os.listdir(dirname))
+
+
+def bench_persistence(g1: city.OsmnxGraph) -> None:
+    """
+    Compares the time to save and load the OsmnxGraph as a pickle and in columns (see columnar.py), with all its
+    attributes and with only the coordinates needed to build the CityGraph, and the size on disk of both.
+    Args:
+        g1: OsmnxGraph
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        pickle_file = os.path.join(tmp, "graph.pickle")
+        columns_dir = os.path.join(tmp, "graph")
+        t = time.perf_counter()
+        with open(pickle_file, "wb") as f:
+            pickle.dump(g1, f)
+        t_pickle_save = time.perf_counter() - t
+        t = time.perf_counter()
+        with open(pickle_file, "rb") as f:
+            pickle.load(f)
+        t_pickle_load = time.perf_counter() - t
+        t = time.perf_counter()
+        city.save_osmnx_graph(g1, columns_dir)
+        t_columns_save = time.perf_counter() - t
+        t = time.perf_counter()
+        city.load_osmnx_graph(columns_dir)
+        t_columns_load = time.perf_counter() - t
+        t = time.perf_counter()
+        city.load_osmnx_graph(columns_dir, ["x", "y"])
+        t_columns_xy = time.perf_counter() - t
+        print("persistence, " + str(g1.number_of_nodes()) + " nodes, " + str(g1.number_of_edges()) + " edges")
+        print("  pickle:  save %.3f s, load %.3f s, %.1f MB" % (t_pickle_save, t_pickle_load,
+                                                             os.path.getsize(pickle_file) / 2 ** 20))
+        print("  columns: save %.3f s, load %.3f s (x and y only: %.3f s), %.1f MB"
+              % (t_columns_save, t_columns_load, t_columns_xy, directory_size(columns_dir) / 2 ** 20))
+
+
+def bench_build(g1: city.OsmnxGraph) -> None:
+    """
+    Reports the time of each phase of the construction of the metro graph and the CityGraph.
+    Args:
+        g1: OsmnxGraph
+    """
+    t = time.perf_counter()
+    g2 = city.get_metro_graph()
+    print("build, " + str(g1.number_of_nodes()) + " street nodes")
+    print("  get_metro_graph:           %.3f s" % (time.perf_counter() - t))
+    g = city.CityGraph()
+    # Same conditions as in build_city_graph.
+    gc.disable()
+    for phase, args in [(city.get_osmnx_nodes, (g1, g)), (city.get_osmnx_edges, (g1, g)),
+                        (city.get_metro_nodes_and_links, (g2, g)), (city.get_metro_edges, (g2, g))]:
+        t = time.perf_counter()
+        phase(*args)
+        print("  %-26s %.3f s" % (phase.__name__ + ":", time.perf_counter() - t))
+    gc.enable()
+    t = time.perf_counter()
+    city.build_city_graph(g1, g2)
+    print("  build_city_graph (total):  %.3f s" % (time.perf_counter() - t))
+
+
+# Version of the layout of the results of run_suite, bumped when metrics are renamed so that results of different
+# layouts aren't compared.
+SUITE_VERSION = 1
+
+# Bounding box of the synthetic street graphs (longitude and latitude), that of Barcelona so that the metro
+# stations and accesses of the bundled databases fall on it.
+SYNTHETIC_BOUNDS = (2.07, 2.23, 41.33, 41.46)
+
+
+def synthetic_osmnx_graph(side: int, seed: int = 0) -> city.OsmnxGraph:
+    """
+    Generates a street graph like the ones of osmnx, without downloading anything: a side x side grid of streets
+    over SYNTHETIC_BOUNDS with slightly jittered nodes, each street missing with probability 0.05 and walkable in
+    both directions. The same seed always gives the same graph.
+    Args:
+        side: number of nodes of each side of the grid
+        seed: seed of the random generator
+    Returns:
+    OsmnxGraph with side * side nodes.
+    """
+    rnd = np.random.default_rng(seed)
+    lon0, lon1, lat0, lat1 = SYNTHETIC_BOUNDS
+    jitter = rnd.uniform(-1e-4, 1e-4, (side * side, 2))
+    lon = np.tile(np.linspace(lon0, lon1, side), side) + jitter[:, 0]
+    lat = np.repeat(np.linspace(lat0, lat1, side), side) + jitter[:, 1]
+    ids = np.arange(side * side) + 1000000
+    g1 = city.OsmnxGraph(crs="epsg:4326")
+    g1.add_nodes_from((int(n), {"x": float(x), "y": float(y)}) for n, x, y in zip(ids, lon, lat))
+    grid = np.arange(side * side).reshape(side, side)
+    u = np.concatenate((grid[:, :-1].ravel(), grid[:-1, :].ravel()))
+    v = np.concatenate((grid[:, 1:].ravel(), grid[1:, :].ravel()))
+    kept = rnd.random(len(u)) >= 0.05
+    u, v = u[kept], v[kept]
+    length = haversine_m(lon[u], lat[u], lon[v], lat[v])
+    g1.add_edges_from((int(ids[a]), int(ids[b]), {"length": float(d)}) for a, b, d in zip(u, v, length))
+    g1.add_edges_from((int(ids[b]), int(ids[a]), {"length": float(d)}) for a, b, d in zip(u, v, length))
+    return g1
+
+
+def haversine_m(lon1: np.ndarray, lat1: np.ndarray, lon2: np.ndarray, lat2: np.ndarray) -> np.ndarray:
+    """
+    Distances in meters between arrays of points, the length attribute of osmnx edges.
+    Returns:
+    Array with the distance between each pair of points.
+    """
+    p1 = np.stack((lat1, lon1), axis=1)
+    p2 = np.stack((lat2, lon2), axis=1)
+    return city.haversine_array(p1, p2) * 1000
+
+
+def best_of(func: Callable, repeat: int) -> Tuple[float, Any]:
+    """
+    Runs func repeat times, to time it with as little noise as possible.
+    Returns:
+    Tuple with the shortest time in seconds and the result of the last run.
+    """
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t)
+    return best, result
+
+
+def peak_mb(func: Callable) -> float:
+    """
+    Runs func tracing the memory it allocates.
+    Returns:
+    Float with the peak of memory allocated while it ran, in MB.
+    """
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def latencies_ms(func: Callable, args: List[Tuple]) -> Dict[str, float]:
+    """
+    Times func on each of the args.
+    Returns:
+    Dictionary with the p50, p95 and mean latency in milliseconds.
+    """
+    durations = []
+    for a in args:
+        t = time.perf_counter()
+        func(*a)
+        durations.append(time.perf_counter() - t)
+    p50, p95 = np.percentile(durations, [50, 95]) * 1000
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "mean_ms": float(np.mean(durations) * 1000)}
+
+
+def suite_restaurants(queries: List[str], repeat: int) -> Dict[str, float]:
+    """
+    Measures loading the restaurants database, building its search index and searching it.
+    Args:
+        queries: search queries
+        repeat: number of runs of each measure, see best_of
+    Returns:
+    Dictionary of metrics.
+    """
+    t_read, restaurants = best_of(rest.read, repeat)
+    t_index, index = best_of(lambda: rest.build_index(restaurants), repeat)
+    t_find, _ = best_of(lambda: [rest.find(q, restaurants, index) for q in queries], repeat)
+    return {"restaurants.read_s": t_read, "restaurants.build_index_s": t_index,
+            "restaurants.index_mb": peak_mb(lambda: rest.build_index(restaurants)),
+            "restaurants.find_qps": len(queries) / t_find}
+
+
+def suite_graph(side: int, g2: city.MetroGraph, n: int, repeat: int, seed: int) -> Dict[str, float]:
+    """
+    Measures building, compiling, storing and routing on the CityGraph of a synthetic street graph.
+    Args:
+        side: side of the synthetic street graph, see synthetic_osmnx_graph
+        g2: MetroGraph
+        n: number of routing queries
+        repeat: number of runs of each measure, see best_of
+        seed: seed of the synthetic graph and of the queries
+    Returns:
+    Dictionary of metrics, named after the number of street nodes.
+    """
+    g1 = synthetic_osmnx_graph(side, seed)
+    prefix = "graph_" + str(g1.number_of_nodes()) + "."
+    results: Dict[str, float] = {prefix + "street_nodes": g1.number_of_nodes(),
+                                 prefix + "street_edges": g1.number_of_edges()}
+    with tempfile.TemporaryDirectory() as tmp:
+        street_dir = os.path.join(tmp, "street_graph")
+        results[prefix + "save_osmnx_graph_s"] = best_of(lambda: city.save_osmnx_graph(g1, street_dir), 1)[0]
+        results[prefix + "load_osmnx_graph_s"] = best_of(lambda: city.load_osmnx_graph(street_dir, ["x", "y"]),
+                                                         repeat)[0]
+        t_build, g = best_of(lambda: city.build_city_graph(g1, g2), repeat)
+        results[prefix + "build_city_graph_s"] = t_build
+        results[prefix + "build_city_graph_mb"] = peak_mb(lambda: city.build_city_graph(g1, g2))
+        results[prefix + "city_nodes"] = g.number_of_nodes()
+        results[prefix + "city_edges"] = g.number_of_edges()
+        t_snapshot, s = best_of(lambda: snapshot.snapshot_from_city_graph(g), repeat)
+        results[prefix + "snapshot_s"] = t_snapshot
+        snapshot_dir = os.path.join(tmp, "city_graph")
+        results[prefix + "save_snapshot_s"] = best_of(lambda: snapshot.save_snapshot(s, snapshot_dir, ""), 1)[0]
+        results[prefix + "open_snapshot_s"] = best_of(lambda: snapshot.open_snapshot(snapshot_dir), repeat)[0]
+    t_router, router = best_of(lambda: city.build_router(s), repeat)
+    results[prefix + "build_router_s"] = t_router
+    index = city.snapshot_index(s)
+    pairs = random_pairs(router.ids, n, seed)
+    for name, stats in latencies_ms(lambda o, d: routing.shortest_path(router, o, d), pairs).items():
+        results[prefix + "shortest_path_" + name] = stats
+    rnd = random.Random(seed)
+    lon0, lon1, lat0, lat1 = SYNTHETIC_BOUNDS
+    coords = [((rnd.uniform(lon0, lon1), rnd.uniform(lat0, lat1)), (rnd.uniform(lon0, lon1), rnd.uniform(lat0, lat1)))
+              for _ in range(n)]
+    for name, stats in latencies_ms(lambda src, dst: city.find_path(index, g, src, dst, router), coords).items():
+        results[prefix + "find_path_" + name] = stats
+    return results
+
+
+def run_suite(sizes: List[int], n: int = 100, repeat: int = 3, seed: int = 0) -> Dict[str, Any]:
+    """
+    Runs the whole benchmark suite offline: it only reads the bundled databases of Data/ and builds synthetic
+    street graphs instead of downloading them with osmnx, so results of different versions of the code on the same
+    machine can be compared.
+    Args:
+        sizes: sides of the synthetic street graphs, see synthetic_osmnx_graph
+        n: number of routing queries on each graph
+        repeat: number of runs of each measure, see best_of
+        seed: seed of the synthetic graphs and of the queries
+    Returns:
+    Dictionary with the version of the suite, its parameters, the environment it ran in and the metrics, named
+    after their unit ("_s", "_ms", "_mb", "_qps"...).
+    """
+    results: Dict[str, float] = {}
+    results.update(suite_restaurants(["pizza", "Sushi", "Gràcia", "Sagrada", "Hamburgueseria", "Poblenou"], repeat))
+    t_metro, g2 = best_of(city.get_metro_graph, repeat)
+    results["metro.get_metro_graph_s"] = t_metro
+    for side in sizes:
+        results.update(suite_graph(side, g2, n, repeat, seed))
+    return {"version": SUITE_VERSION,
+            "parameters": {"sizes": sizes, "n": n, "repeat": repeat, "seed": seed},
+            "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                            "networkx": networkx.__version__, "machine": platform.machine(),
+                            "platform": platform.platform(), "cpus": os.cpu_count()},
+            "results": results}
+
+
+def compare_suites(old: Dict[str, Any], new: Dict[str, Any], tolerance: float = 0.1) -> List[str]:
+    """
+    Compares the results of two runs of the suite, e.g. of two releases.
+    Args:
+        old: results of run_suite of the reference version
+        new: results of run_suite of the version under test
+        tolerance: relative change beyond which a metric counts as a regression
+    Returns:
+    List with a line per metric present in both, with its change, marked REGRESSION if it got worse by more than
+    tolerance. Throughputs ("_qps") get worse when they decrease, the rest of the metrics when they increase.
+    """
+    if old["version"] != new["version"]:
+        raise ValueError("Results of different versions of the suite can't be compared.")
+    lines = []
+    for name in sorted(set(old["results"]) & set(new["results"])):
+        a, b = old["results"][name], new["results"][name]
+        change = (b - a) / a if a else 0.0
+        worse = -change if name.endswith("_qps") else change
+        mark = "  REGRESSION" if worse > tolerance and name.rsplit("_", 1)[-1] in ("s", "ms", "mb", "qps") else ""
+        lines.append("%-44s %12.4f %12.4f %+8.1f%%%s" % (name, a, b, change * 100, mark))
+    return lines
+
+
+def main() -> None:
+    """
+    Runs the benchmarks on the real graphs (the default), or the offline suite with --suite.
+    """
+    parser = argparse.ArgumentParser(description="Benchmarks of the graph build, search and routing.")
+    parser.add_argument("--suite", action="store_true", help="run the offline suite on synthetic street graphs")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 100, 150],
+                        help="sides of the synthetic street graphs")
+    parser.add_argument("--queries", type=int, default=100, help="routing queries on each graph")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each measure, the best one is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic graphs and of the queries")
+    parser.add_argument("--output", help="JSON file the results of the suite are written to (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two results of the suite")
+    args = parser.parse_args()
+    if args.compare:
+        with open(args.compare[0]) as f1, open(args.compare[1]) as f2:
+            lines = compare_suites(json.load(f1), json.load(f2))
+        print("\n".join(lines))
+        sys.exit(1 if any(line.endswith("REGRESSION") for line in lines) else 0)
+    if args.suite:
+        results = run_suite(args.sizes, args.queries, args.repeat, args.seed)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        else:
+            print(json.dumps(results, indent=2))
+        return
+    bench_all()
+
+
+def bench_all() -> None:
+    """
+    Runs all the benchmarks on the graphs of Barcelona (street_graph and the compiled city_graph).
+    """
+    bench_search(rest.read(), ["pizza", "Sushi", "Gràcia", "Sagrada", "Hamburgueseria", "Poblenou"], [1, 4, 16])
+    street_graph = city.load_osmnx_graph("street_graph")
+    bench_build(street_graph)
+    bench_persistence(street_graph)
+    bench_memory(street_graph, city.get_metro_graph())
+    s = city.load_city_snapshot("city_graph", "street_graph")
+    router = city.build_router(s)
+    bench_find_path(city.snapshot_to_city_graph(s), router)
+    hierarchy = city.load_city_hierarchy(s, "city_graph")
+    if hierarchy is not None:
+        bench_hierarchy(router, hierarchy)
+    bench_timed(router, city.build_city_timed_router(s), [3.0, 8.0, 12.0, 23.5])
+    bench_matrix(router, [10, 100])
+
+
+if __name__ == "__main__":
+    main()
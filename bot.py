@@ -1,19 +1,262 @@
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters
+import asyncio
+import datetime
+import functools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Tuple, List, Optional
+import numpy as np
+from telegram.ext import Application, CommandHandler, MessageHandler, filters
 import city
+import contraction
+import workers
+import cache
 import restaurants as rest
+import schedule
+import profiles
+import metrics
+import sessions
 
-# Loads CityGraph of Barcelona, OsmnxGraph of the city and list of restaurants from the database.
-g2 = city.get_metro_graph()
-g1 = city.load_osmnx_graph("street_graph")
-g = city.build_city_graph(g1, g2)
-restaurants = rest.read()
+# Data of the bot, loaded in the background once it is running (see loaded) so that /start, /help and /find are
+# answered right after a deploy: the list of restaurants from the database and their search index first, then the
+# CityGraph of Barcelona (from its compiled snapshot), the spatial index of its streets and the street node closest
+# to each restaurant. The networkx CityGraph itself isn't built: routes are found on the snapshot and only the nodes
+# and edges of each path are rebuilt to plot it, as the worker processes do, so the graph is only built from the
+# snapshot when the metro databases change, see update_metro.
+restaurants: Optional[rest.Restaurants] = None
+restaurant_ids: Dict[str, rest.Restaurant] = {}  # restaurants by id, as they are kept in the sessions
+search_index: Optional[rest.SearchIndex] = None
+snapshot: Optional[city.CitySnapshot] = None
+hierarchy: Optional[contraction.Hierarchy] = None
+index: Optional[city.SpatialIndex] = None
+snapped: Optional[rest.Snapping] = None
 
+# Routing profiles users can choose with /profile (step-free, walk-only...), see profiles.py. The routers of all of
+# them are built once and share the graph, only their weights differ.
+factors: Dict[str, np.ndarray] = {}
+routers: Dict[str, city.Router] = {}
 
-def build_restaurant_list(list_of_rest: rest.Restaurants) -> str:
+# Whether estimated times take the time of day into account: the headway of each line, the time to reach its
+# platforms and the penalty for changing lines, see schedule.py. Routes are then found with the TimedRouter, so the
+# contraction hierarchy isn't loaded nor rebuilt after metro updates: time-dependent costs can't be precomputed into
+# shortcuts. Turning it off trades those estimates for the faster queries of the hierarchy, see the README.
+TIMED_ROUTING = True
+
+timed: Optional[Dict[str, schedule.TimedRouter]] = None
+
+# Data being loaded in the background or already loaded ("restaurants" and "city"), see loaded.
+loading: Dict[str, asyncio.Future] = {}
+
+# Minutes of each slot of the day. Routes that depart in the same slot share their cache entry, computed as if
+# departing at the start of the slot.
+DEPARTURE_SLOT_MIN = 15
+
+# Maximum number of requests of each command being served at once, and maximum number of requests waiting for
+# their turn. Beyond that, requests are rejected right away (backpressure) instead of piling up.
+COMMAND_LIMITS: Dict[str, Tuple[int, int]] = {"find": (8, 64), "guide": (4, 16)}
+
+# Handlers run concurrently on the asyncio event loop. CPU-bound work (searching, routing and rendering) is
+# offloaded to this pool so that a slow /guide doesn't block the other users. It has a thread for every request
+# that can be served at once, so that requests of one command never wait for those of another.
+pool = ThreadPoolExecutor(max_workers=sum(running for running, _ in COMMAND_LIMITS.values()))
+
+# Number of worker processes that serve /guide jobs, see workers.py. Routing and rendering hold the GIL, so with
+# 0 they run in the threads of the pool and /guide throughput doesn't scale with the number of cores.
+GUIDE_PROCESSES = COMMAND_LIMITS["guide"][0]
+
+# ProcessPoolExecutor of the workers, started in the main block.
+guide_pool = None
+
+# Routes already rendered, by snapped endpoints: many users ask for directions from the same places (offices,
+# stations) to the same popular restaurants. At most 256 routes and 64 MB of maps, each one kept for an hour.
+routes = cache.RouteCache(capacity=256, max_bytes=64 * 2 ** 20, ttl=3600)
+
+# Maps sent by /guide: zlib compression level (0 to 9) and factor they are resized by. Smaller maps are
+# uploaded faster.
+MAP_COMPRESS_LEVEL = 6
+MAP_SCALE = 1.0
+
+# Restaurants further than this (in hours) from the user aren't ranked by their estimated time of arrival.
+ETA_CUTOFF_H = 1.0
+
+# Seconds between checks of the metro databases: when they change, the graph is updated, see update_metro.
+METRO_CHECK_S = 60
+
+# Sessions of the users (position, restaurants of their last search and routing profile), see sessions.py: kept in
+# memory (at most SESSION_CAPACITY of them, the least recently used ones are forgotten first) or, if SESSION_DB is
+# given, in an SQLite database that survives restarts and is shared by all the bot processes of the machine.
+# Sessions that aren't used for SESSION_TTL seconds are forgotten.
+SESSION_DB: Optional[str] = None
+SESSION_CAPACITY = 100000
+SESSION_TTL = 24 * 3600
+
+session_store = sessions.open_store(SESSION_DB, SESSION_CAPACITY, SESSION_TTL)
+
+# Latency of each stage of the commands, see metrics.py: served by a local endpoint on METRICS_PORT
+# (http://127.0.0.1:9100/metrics, None for no endpoint) and printed every METRICS_DUMP_S seconds (None for never).
+# When disabled, stages aren't timed at all.
+METRICS_ENABLED = True
+METRICS_PORT: Optional[int] = 9100
+METRICS_DUMP_S: Optional[float] = 600
+
+metrics.ENABLED = METRICS_ENABLED
+
+# Routes being computed, so that simultaneous requests of the same route wait for it instead of computing it again.
+# Their keys hold the fingerprint of the snapshot, so requests made after a metro update don't wait for a route of
+# the previous one.
+computing: Dict[cache.RouteKey, asyncio.Future] = {}
+
+
+@dataclass
+class Limiter:
+    semaphore: asyncio.Semaphore  # bounds the requests being served
+    capacity: int  # maximum number of requests being served or waiting
+    pending: int = 0
+
+
+limiters = {command: Limiter(asyncio.Semaphore(running), running + waiting)
+            for command, (running, waiting) in COMMAND_LIMITS.items()}
+
+
+def limited(command: str):
+    """
+    Decorator that applies the concurrency limits of the given command to its handler.
+    Args:
+        command: name of the command, key of COMMAND_LIMITS
+
+    Returns:
+    Decorator for async handlers.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapper(update, context) -> None:
+            limiter = limiters[command]
+            if limiter.pending >= limiter.capacity:
+                metrics.count(command + ".rejected")
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text='Too many people are using /' + command + ' right now. Please retry in a few seconds.')
+                return
+            limiter.pending += 1
+            try:
+                async with limiter.semaphore:
+                    await handler(update, context)
+            finally:
+                limiter.pending -= 1
+        return wrapper
+    return decorator
+
+
+async def run_in_pool(func, *args, executor=None):
+    """
+    Runs func(*args) in the worker pool (or the given executor) without blocking the event loop.
+    Returns:
+    Result of func.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor or pool, func, *args)
+
+
+def load_restaurants() -> None:
+    """
+    Reads the restaurants database and builds its search index. Runs in the worker pool.
+    """
+    global restaurants, restaurant_ids, search_index
+    r = rest.read()
+    restaurants, restaurant_ids, search_index = r, {x.id: x for x in r}, rest.build_index(r)
+
+
+def load_city() -> None:
+    """
+    Loads the CityGraph from its compiled snapshot (compiling it if it is out of date), its contraction hierarchy
+    unless TIMED_ROUTING is on, the spatial index of its streets and the routers of every routing profile. Runs in
+    the worker pool.
+    """
+    global snapshot, hierarchy, index, factors, routers, timed
+    s = city.load_city_snapshot("city_graph", "street_graph")
+    f = city.build_city_profiles(s)
+    t = profiles.profile_timed_routers(s, city.build_city_timed_router(s), f) if TIMED_ROUTING else None
+    # Set at once, so that handlers never see some of them loaded and some not.
+    snapshot, hierarchy, index, factors, routers, timed = \
+        s, None if TIMED_ROUTING else city.load_city_hierarchy(s, "city_graph"), city.snapshot_index(s), f, \
+        profiles.profile_routers(s, city.build_router(s), f), t
+
+
+def snap_restaurants() -> None:
+    """
+    Finds the street node closest to each restaurant. Runs in the worker pool.
+    """
+    global snapped
+    snapped = rest.snapping_table(restaurants, index, snapshot.fingerprint, "restaurant_nodes")
+
+
+async def load(name: str) -> None:
+    """
+    Loads the given data of the bot, see loaded.
+    Args:
+        name: "restaurants" or "city", which also snaps the restaurants to the streets once both are loaded
+    """
+    if name == "restaurants":
+        await run_in_pool(load_restaurants)
+    else:
+        await run_in_pool(load_city)
+        await loaded("restaurants")
+        await run_in_pool(snap_restaurants)
+
+
+def start_loading() -> None:
+    """
+    Starts loading in the background the data that isn't loaded or being loaded yet, or failed to load.
+    """
+    for name in ("restaurants", "city"):
+        future = loading.get(name)
+        if future is None or (future.done() and (future.cancelled() or future.exception() is not None)):
+            loading[name] = asyncio.ensure_future(load(name))
+
+
+async def loaded(name: str) -> None:
+    """
+    Waits until the given data of the bot is loaded, starting to load it if needed.
+    Args:
+        name: "restaurants" or "city"
+    Raises the exception that made loading fail, if it did.
+    """
+    start_loading()
+    # Shielded, so that a cancelled request doesn't cancel the loading other requests are waiting for.
+    await asyncio.shield(loading[name])
+
+
+def is_loaded(name: str) -> bool:
+    """
+    Tells whether the given data of the bot has been loaded, without waiting for it.
+    Args:
+        name: "restaurants" or "city"
+    Returns:
+    True if it is ready to be used.
+    """
+    future = loading.get(name)
+    return future is not None and future.done() and not future.cancelled() and future.exception() is None
+
+
+def recommended(s: sessions.Session) -> rest.Restaurants:
+    """
+    Gives the restaurants of the last search of a user.
+    Args:
+        s: session of the user
+    Returns:
+    List of restaurants, without the ones that are no longer in the database.
+    Raises KeyError if the user hasn't searched yet.
+    """
+    if s.restaurants is None:
+        raise KeyError("recommended_restaurants")
+    return [restaurant_ids[i] for i in s.restaurants if i in restaurant_ids]
+
+
+def build_restaurant_list(list_of_rest: rest.Restaurants, minutes: Optional[List[Optional[int]]] = None) -> str:
     """
     Builds list of restaurants into a string with their names.
     Args:
         list_of_rest: restaurant list to transform
+        minutes: estimated time of arrival to each restaurant, if known
 
     Returns:
     String with restaurant names skipping a line after each one.
@@ -22,10 +265,37 @@ def build_restaurant_list(list_of_rest: rest.Restaurants) -> str:
     for i in range(len(list_of_rest)):
         r = list_of_rest[i]
         name = r.name.split(' *')[0]
-        s += str(i + 1) + ". " + name + "\n"
+        s += str(i + 1) + ". " + name
+        if minutes is not None and minutes[i] is not None:
+            s += " (" + str(minutes[i]) + " min)"
+        s += "\n"
     return s
 
 
+def closest_restaurants(query: str, user_pos: city.Coord,
+                        profile: str = profiles.DEFAULT_PROFILE) -> Tuple[rest.Restaurants, List[Optional[int]]]:
+    """
+    Finds all the restaurants that match the query and ranks them by their estimated time of arrival from the user
+    position, computed with a single search from it. Runs in the worker pool.
+    Args:
+        query: user search query
+        user_pos: user position
+        profile: routing profile of the user, see profiles.py
+
+    Returns:
+    Tuple with the (at most MAX_RESULTS) closest restaurants and the minutes needed to reach each one, None for
+    the ones further than ETA_CUTOFF_H, which go last in the order of their match.
+    """
+    found = rest.find(query, restaurants, search_index, limit=None)
+    nodes = [snapped.nodes[r.id] for r in found]
+    if timed is not None:
+        minutes = city.times_from_at(index, timed[profile], user_pos, nodes, now_h(), ETA_CUTOFF_H)
+    else:
+        minutes = city.times_from(index, routers[profile], user_pos, nodes, ETA_CUTOFF_H)
+    order = sorted(range(len(found)), key=lambda i: (minutes[i] is None, minutes[i] or 0))[:rest.MAX_RESULTS]
+    return [found[i] for i in order], [minutes[i] for i in order]
+
+
 def restaurant_info(r: rest.Restaurant) -> str:
     """
     Gives some restaurant info, which for now is name and address but could fit a description
@@ -44,35 +314,59 @@ def restaurant_info(r: rest.Restaurant) -> str:
         r.tel)
 
 
-def start(update, context) -> None:
+async def start(update, context) -> None:
     """
     Starts the bot.
     """
-    context.bot.send_message(chat_id=update.effective_chat.id,
-                             text="Hello! I am your telegram bot. I hope you're hungry! Type /help for guidance on how the bot works.")
+    await context.bot.send_message(chat_id=update.effective_chat.id,
+                                   text="Hello! I am your telegram bot. I hope you're hungry! Type /help for guidance on how the bot works.")
 
 
-def where(update, context) -> None:
+async def where(update, context) -> None:
     """
-    Takes user's location and pickles it into file user_pos.pickle.
+    Takes user's location and keeps it in their session.
     """
     try:
         u_pos = (update.message.location.longitude, update.message.location.latitude)
-        context.user_data["user_position"] = u_pos
+        s = session_store.get(update.effective_chat.id)
+        s.position = u_pos
+        session_store.put(update.effective_chat.id, s)
     except Exception as e:
         print(e)
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text='Please share your location with the bot so it can function correctly.')
 
 
-def help(update, context) -> None:
+async def profile(update, context) -> None:
+    """
+    Sets the routing profile of the user (step-free, walk-only...), used by /find and /guide from then on.
+    Without arguments, tells the current one.
+    """
+    s = session_store.get(update.effective_chat.id)
+    if len(context.args) == 0:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Your routing profile is " + (s.profile or profiles.DEFAULT_PROFILE)
+                 + ". Available profiles: " + ", ".join(profiles.PROFILES) + ".")
+    elif context.args[0] in profiles.PROFILES:
+        s.profile = context.args[0]
+        session_store.put(update.effective_chat.id, s)
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       text="Routing profile set to " + context.args[0] + ".")
+    else:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Unknown profile. Available profiles: " + ", ".join(profiles.PROFILES) + ".")
+
+
+async def help(update, context) -> None:
     """
     Bot sends help message.
     """
-    context.bot.send_message(
+    await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="I am a bot with commands /start, /help, /info, /find, /author and /guide. \n"
+        text="I am a bot with commands /start, /help, /info, /find, /author, /guide and /profile. \n"
              + "/find: this allows you to search for restaurants. Type in a query and it will return a list "
                "of restaurants related to said query. \n "
              + "/info: this gives information on the restaurants you just looked at. Type an index "
@@ -80,112 +374,330 @@ def help(update, context) -> None:
              + "/guide: this gives a map to the restaurant that you have selected from the list using the metro ("
                "possibly). "
              + "Type an index from 1 to 10 to indicate which restaurant you want information of from the list. \n"
+             + "/profile: this sets how you want to get around: default, step-free (only accessible metro "
+               "stations and accesses), walk-only or metro-preferred. \n"
              + "/author: this gives you the names of the authors of the bot. \n"
              + "Enjoy!")
 
 
-def author(update, context) -> None:
+async def author(update, context) -> None:
     """
     Bot sends message containing author's names.
     """
-    context.bot.send_message(
+    await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text="Paula Esquerrà and Nathaniel Mitrani")
 
 
-def find(update, context) -> None:
+def now_h() -> float:
+    """
+    Current time of day, used as the departure time of the routes.
+    Returns:
+    Float with the hours since midnight, local time.
+    """
+    now = datetime.datetime.now()
+    return now.hour + now.minute / 60 + now.second / 3600
+
+
+def route(origin: city.NodeID, destination: city.NodeID, depart_h: Optional[float] = None,
+          profile: str = profiles.DEFAULT_PROFILE) -> cache.Route:
+    """
+    Finds the path between two nodes and renders it. Runs in the worker pool.
+    Args:
+        origin: node closest to the user position
+        destination: node closest to the restaurant
+        depart_h: time of day of the departure in hours since midnight, None if it doesn't matter
+        profile: routing profile, see profiles.py
+
+    Returns:
+    Route with the path, its estimated time in minutes and the rendered map.
+    """
+    if depart_h is not None and timed is not None:
+        with metrics.stage("shortest_path_at"):
+            hours, path = schedule.shortest_path_at(timed[profile], origin, destination, depart_h)
+        return workers.render(city.path_graph(snapshot, path), path, MAP_COMPRESS_LEVEL, MAP_SCALE, int(hours * 60))
+    # The contraction hierarchy is only built for the default profile.
+    path = city.path_between(None, origin, destination, routers[profile],
+                             hierarchy if profile == profiles.DEFAULT_PROFILE else None)
+    return workers.render(city.path_graph(snapshot, path), path, MAP_COMPRESS_LEVEL, MAP_SCALE)
+
+
+async def compute_route(key: cache.RouteKey) -> cache.Route:
+    """
+    Computes a route in the worker processes (or the worker pool if there are none) and caches it.
+    Args:
+        key: fingerprint of the snapshot, snapped endpoints of the route, slot of the day it departs in and routing
+             profile, see get_route
+
+    Returns:
+    Route with the path, its estimated time in minutes and the rendered map.
+    """
+    fingerprint, origin, destination, slot, profile = key
+    depart_h = None if slot is None else slot * DEPARTURE_SLOT_MIN / 60
+    if guide_pool is not None:
+        r, samples = await run_in_pool(workers.route, origin, destination, MAP_COMPRESS_LEVEL, MAP_SCALE,
+                                       snapshot.fingerprint, depart_h, profile, hierarchy is not None,
+                                       executor=guide_pool)
+        metrics.merge(samples)
+    else:
+        r = await run_in_pool(route, origin, destination, depart_h, profile)
+    # If the snapshot has been updated meanwhile, the cache has been (or will be) emptied, and the route may have
+    # been found on either of them: it is given to the requests waiting for it, but not cached.
+    if snapshot.fingerprint == fingerprint:
+        cache.put(routes, key, r)
+    return r
+
+
+async def get_route(src: city.Coord, destination: city.NodeID, profile: str = profiles.DEFAULT_PROFILE) -> cache.Route:
+    """
+    Gives the route from src to destination departing now, from the cache if it has already been computed on the
+    same snapshot for the same snapped endpoints, slot of the day (see DEPARTURE_SLOT_MIN) and routing profile.
+    Args:
+        src: user position
+        destination: node closest to the restaurant, see snapped
+        profile: routing profile of the user, see profiles.py
+
+    Returns:
+    Route with the path, its estimated time in minutes and the rendered map.
+    """
+    cache.invalidate(routes, snapshot.fingerprint)
+    slot = int(now_h() * 60) // DEPARTURE_SLOT_MIN if timed is not None else None
+    with metrics.stage("snap"):
+        key = (snapshot.fingerprint, city.nearest_node(index, src), destination, slot, profile)
+    found = cache.get(routes, key)
+    if found is not None:
+        metrics.count("route_cache.hits")
+        return found
+    if key not in computing:
+        metrics.count("route_cache.misses")
+        computing[key] = asyncio.ensure_future(compute_route(key))
+        computing[key].add_done_callback(lambda _: computing.pop(key, None))
+    # Shielded, so that a cancelled request doesn't cancel the computation other requests are waiting for.
+    return await asyncio.shield(computing[key])
+
+
+@metrics.measured("find")
+@limited("find")
+async def find(update, context) -> None:
     """
     Bot asks for input on what the user wants to find and sends a message with the restaurant names that match his
-    search. The list is pickled for later use.
+    search. If the user has shared their location, the closest restaurants are given first. The list is kept for
+    later use.
     """
     try:
         query = ""
         for i in range(len(context.args)):
             query += str(context.args[i])
-        list_of_r = rest.find(query, restaurants)
-        context.user_data["recommended_restaurants"] = list_of_r
-        answer = build_restaurant_list(list_of_r)
-        context.bot.send_message(chat_id=update.effective_chat.id, text=answer)
+        if not query.strip():
+            raise IndexError("empty query")
+        minutes = None
+        await loaded("restaurants")
+        s = session_store.get(update.effective_chat.id)
+        with metrics.stage("find.search"):
+            # Until the CityGraph is loaded, restaurants aren't ranked by their estimated time of arrival.
+            if s.position is not None and is_loaded("city"):
+                list_of_r, minutes = await run_in_pool(closest_restaurants, query, s.position,
+                                                       s.profile or profiles.DEFAULT_PROFILE)
+            else:
+                list_of_r = await run_in_pool(rest.find, query, restaurants, search_index)
+        # Read again, since the user may have shared their location or changed their profile in the meantime.
+        s = session_store.get(update.effective_chat.id)
+        s.restaurants = [r.id for r in list_of_r]
+        session_store.put(update.effective_chat.id, s)
+        answer = build_restaurant_list(list_of_r, minutes)
+        with metrics.stage("find.send"):
+            await context.bot.send_message(chat_id=update.effective_chat.id, text=answer)
     except IndexError as e:
         print(e)
-        context.bot.send_message(chat_id=update.effective_chat.id, text='Empty query! Please enter a search query'
-                                                                        ' after the /find command')
+        await context.bot.send_message(chat_id=update.effective_chat.id, text='Empty query! Please enter a search '
+                                                                              'query after the /find command')
     except Exception as e:
         print(e)
-        context.bot.send_message(chat_id=update.effective_chat.id, text='No restaurants match your search! Please try '
-                                                                        'again.')
+        metrics.count("find.errors")
+        await context.bot.send_message(chat_id=update.effective_chat.id, text='No restaurants match your search! '
+                                                                              'Please try again.')
 
 
-def info(update, context) -> None:
+@metrics.measured("info")
+async def info(update, context) -> None:
     """
     Bot sends information about the restaurant he has been enquired about.
     """
     try:
         list_num = int(context.args[0]) - 1
-        recommended = context.user_data["recommended_restaurants"]
-        context.bot.send_message(
-            chat_id=update.effective_chat.id, text=restaurant_info(recommended[list_num]))
+        await loaded("restaurants")
+        listed = recommended(session_store.get(update.effective_chat.id))
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id, text=restaurant_info(listed[list_num]))
     except KeyError as e:
         print(e)
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text='Please search for restaurants with the /find command to ask for information.')
     except IndexError as e:
         print(e)
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text='Invalid index. Either no restaurants matches your search, or you selected an invalid index.')
 
 
-def guide(update, context) -> None:
+@metrics.measured("guide")
+@limited("guide")
+async def guide(update, context) -> None:
     """
     Bot sends a picture of a map from the user's location to the restaurant he asked directions to.
     """
+    s = session_store.get(update.effective_chat.id)
     try:
         list_num = int(context.args[0]) - 1
-        recommended = context.user_data["recommended_restaurants"]
-        user_pos = context.user_data["user_position"]
-        r = recommended[list_num]
-        path = city.find_path(g1, g, user_pos, r.coordinates)
-        city.plot_path(g, path, "user_plot")
-        t = city.time_from_path(g, path)
-        context.bot.send_photo(chat_id=update.effective_chat.id, photo=open("user_plot.png", 'rb'))
-        context.bot.send_message(chat_id=update.effective_chat.id,
-                                 text="Estimated time of arrival is " + str(t) + " minutes.")
+        await loaded("restaurants")
+        listed = recommended(s)
+        if s.position is None:
+            raise KeyError("user_position")
+        r = listed[list_num]
+        await loaded("city")
+        with metrics.stage("guide.route"):
+            found = await get_route(s.position, snapped.nodes[r.id], s.profile or profiles.DEFAULT_PROFILE)
+        with metrics.stage("guide.upload"):
+            await context.bot.send_photo(chat_id=update.effective_chat.id, photo=found.png)
+        await context.bot.send_message(chat_id=update.effective_chat.id,
+                                       text="Estimated time of arrival is " + str(found.minutes) + " minutes.")
     except IndexError as e:
         print(e)
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text='Invalid index. Please select an index between 1 and ' + str(
-                len(context.user_data["recommended_restaurants"])) + '.')
+            text='Invalid index. Please select an index between 1 and ' + str(len(s.restaurants or [])) + '.')
     except KeyError as e:
         print(e)
-        context.bot.send_message(
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text='Please share your location and ask for restaurant recommendations before using the /guide command.')
     except Exception as e:
         print(e)
-        context.bot.send_message(
+        metrics.count("guide.errors")
+        await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text='We are experiencing technical difficulties. Please retry.')
 
 
-# declares a constant with the access token retrieved from token.txt
-TOKEN = open('token.txt').read().strip()
+def update_metro() -> None:
+    """
+    Brings the CityGraph, its snapshot and the routing indexes up to date with the metro databases, patching only
+    the stations and accesses that have changed. Runs in the worker pool, requests keep being served meanwhile.
+    """
+    global snapshot, factors, routers, hierarchy, timed, snapped
+    s = city.update_city_snapshot(snapshot, index, "city_graph", "street_graph")
+    f = city.build_city_profiles(s)
+    r = profiles.profile_routers(s, city.build_router(s), f)
+    t = profiles.profile_timed_routers(s, city.build_city_timed_router(s), f) if TIMED_ROUTING else None
+    n = rest.snapping_table(restaurants, index, s.fingerprint, "restaurant_nodes")
+    # Set at once, as in load_city: requests served meanwhile use the old ones.
+    snapshot, factors, routers, hierarchy, timed, snapped = s, f, r, None, t, n
+
+
+async def rebuild_hierarchy() -> None:
+    """
+    Builds the contraction hierarchy of the current snapshot again, after update_metro has dropped it, and starts
+    using it once it is ready. The build takes about a minute of CPU (see contraction.build_hierarchy), so it runs
+    in a process of its own, spawned instead of forked since the bot is running threads, while routes are found
+    with the Router. If the snapshot is updated again meanwhile, the hierarchy of the newest one is built.
+    """
+    global hierarchy
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as builder:
+        while True:
+            s = snapshot
+            await run_in_pool(city.rebuild_city_hierarchy, "city_graph", executor=builder)
+            h = await run_in_pool(city.load_city_hierarchy, s, "city_graph")
+            if snapshot is s:
+                hierarchy = h
+                return
+
 
-# creates objects to work with Telegram
-updater = Updater(token=TOKEN, use_context=True)
-dispatcher = updater.dispatcher
+async def watch_metro() -> None:
+    """
+    Checks every METRO_CHECK_S seconds whether the metro databases have changed, and updates the graph if so. If
+    the graph had a contraction hierarchy (never while TIMED_ROUTING is on), it is rebuilt in the background, see
+    rebuild_hierarchy.
+    """
+    metro = city.sources_fingerprint(city.CITY_SOURCES)
+    # Changes made while the graph is being loaded are caught by the first check.
+    await loaded("city")
+    rebuilding: Optional[asyncio.Task] = None
+    while True:
+        await asyncio.sleep(METRO_CHECK_S)
+        current = city.sources_fingerprint(city.CITY_SOURCES)
+        if current != metro:
+            try:
+                had_hierarchy = hierarchy is not None
+                await run_in_pool(update_metro)
+                metro = current
+                if had_hierarchy and (rebuilding is None or rebuilding.done()):
+                    rebuilding = asyncio.create_task(rebuild_hierarchy())
+                    rebuilding.add_done_callback(report_failure)
+            except Exception as e:
+                print(e)
+
+
+def report_failure(task: asyncio.Task) -> None:
+    """
+    Prints the exception a background task failed with, if it did.
+    """
+    if not task.cancelled() and task.exception() is not None:
+        print(task.exception())
+
+
+async def dump_metrics() -> None:
+    """
+    Prints the latency of each stage of the commands every METRICS_DUMP_S seconds.
+    """
+    while True:
+        await asyncio.sleep(METRICS_DUMP_S)
+        print(metrics.report())
+
+
+async def post_init(application: Application) -> None:
+    """
+    Starts loading the data of the bot and its background tasks once the application is running.
+    """
+    start_loading()
+    background.append(asyncio.create_task(watch_metro()))
+    if METRICS_ENABLED and METRICS_DUMP_S is not None:
+        background.append(asyncio.create_task(dump_metrics()))
+
+
+# Background tasks, referenced so that they aren't garbage collected.
+background: List[asyncio.Task] = []
+
+
+def build_application(token: str) -> Application:
+    """
+    Creates the Telegram application with all the handlers of the bot.
+    Args:
+        token: access token of the bot
+
+    Returns:
+    Application ready to be started.
+    """
+    # Updates are handled concurrently, COMMAND_LIMITS bounds the expensive ones.
+    application = Application.builder().token(token).concurrent_updates(256).post_init(post_init).build()
+    # indicates that when the bot recieves the command /start, the start function is executed
+    application.add_handler(CommandHandler('start', start))
+    application.add_handler(MessageHandler(filters.LOCATION, where))
+    application.add_handler(CommandHandler('help', help))
+    application.add_handler(CommandHandler('find', find))
+    application.add_handler(CommandHandler('info', info))
+    application.add_handler(CommandHandler('guide', guide))
+    application.add_handler(CommandHandler('author', author))
+    application.add_handler(CommandHandler('profile', profile))
+    return application
 
-# indicates that when the bot recieves the command /start, the start function is executed
-dispatcher.add_handler(CommandHandler('start', start))
-dispatcher.add_handler(MessageHandler(Filters.location, where))
-dispatcher.add_handler(CommandHandler('help', help))
-dispatcher.add_handler(CommandHandler('find', find))
-dispatcher.add_handler(CommandHandler('info', info))
-dispatcher.add_handler(CommandHandler('guide', guide))
-dispatcher.add_handler(CommandHandler('author', author))
 
-# starts the bot
-updater.start_polling()
-updater.idle()
+if __name__ == "__main__":
+    # declares a constant with the access token retrieved from token.txt
+    TOKEN = open('token.txt').read().strip()
+    if GUIDE_PROCESSES > 0:
+        guide_pool = workers.start_workers("city_graph", GUIDE_PROCESSES)
+    if METRICS_ENABLED and METRICS_PORT is not None:
+        metrics.serve(METRICS_PORT)
+    # starts the bot
+    build_application(TOKEN).run_polling()
@@ -0,0 +1,110 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Tuple, Union, Optional, Hashable #type: ignore
+from typing_extensions import TypeAlias
+
+NodeID: TypeAlias = Union[int, str]
+
+Path: TypeAlias = List[NodeID]
+
+# (graph version, origin node, destination node, slot of the day, routing profile): the version of the graph the
+# route is found on (e.g. the fingerprint of its snapshot), the endpoints of the route once snapped to it, the slot
+# of the day it departs in (None if its time doesn't depend on the time of day) and the profile it was found with.
+RouteKey: TypeAlias = Tuple[Hashable, NodeID, NodeID, Optional[int], str]
+
+
+@dataclass
+class Route:
+    path: Path
+    minutes: int  # estimated time of arrival, see time_from_path
+    png: bytes  # rendered map of the path
+    created: float = 0.0  # time.monotonic() when it was cached
+
+
+@dataclass
+class RouteCache:
+    capacity: int  # maximum number of routes
+    max_bytes: int  # maximum total size of the rendered maps
+    ttl: float  # seconds a route is kept, 0 for no limit
+    version: Optional[Hashable] = None  # version of the graph the routes were computed on
+    routes: "OrderedDict[RouteKey, Route]" = field(default_factory=OrderedDict)  # least recently used first
+    size: int = 0  # total size of the rendered maps in bytes
+    hits: int = 0
+    misses: int = 0
+
+
+def invalidate(c: RouteCache, version: Hashable) -> None:
+    """
+    Empties the cache if its routes were computed on a graph other than the given version of it.
+    Args:
+        c: RouteCache
+        version: version of the graph in use, e.g. the fingerprint of its snapshot
+    """
+    if c.version != version:
+        c.routes.clear()
+        c.size = 0
+        c.version = version
+
+
+def get(c: RouteCache, key: RouteKey) -> Optional[Route]:
+    """
+    Looks up a route, and marks it as the most recently used one.
+    Args:
+        c: RouteCache
+        key: snapped endpoints of the route
+    Returns:
+    Cached Route, None if it isn't cached or it has expired.
+    """
+    route = c.routes.get(key)
+    if route is not None and c.ttl > 0 and time.monotonic() - route.created > c.ttl:
+        remove(c, key)
+        route = None
+    if route is None:
+        c.misses += 1
+        return None
+    c.routes.move_to_end(key)
+    c.hits += 1
+    return route
+
+
+def put(c: RouteCache, key: RouteKey, route: Route) -> None:
+    """
+    Caches a route, evicting the least recently used ones while the cache is over its limits.
+    Args:
+        c: RouteCache
+        key: snapped endpoints of the route
+        route: Route to be cached
+    """
+    remove(c, key)
+    route.created = time.monotonic()
+    c.routes[key] = route
+    c.size += len(route.png)
+    while c.routes and (len(c.routes) > c.capacity or c.size > c.max_bytes):
+        remove(c, next(iter(c.routes)))
+
+
+def remove(c: RouteCache, key: RouteKey) -> None:
+    """
+    Removes a route from the cache, if it is there.
+    Args:
+        c: RouteCache
+        key: snapped endpoints of the route
+    """
+    route = c.routes.pop(key, None)
+    if route is not None:
+        c.size -= len(route.png)
+
+
+def stats(c: RouteCache) -> str:
+    """
+    Summary of the usage of the cache.
+    Args:
+        c: RouteCache
+    Returns:
+    String with the number of routes, their size, hits, misses and hit rate.
+    """
+    total = c.hits + c.misses
+    rate = c.hits / total if total else 0.0
+    return ("routes: " + str(len(c.routes)) + ", size: " + str(c.size) + " bytes, hits: " + str(c.hits)
+            + ", misses: " + str(c.misses) + ", hit rate: " + str(round(100 * rate, 1)) + "%")
@@ -1,14 +1,24 @@
-from typing import List, Tuple, Union #type: ignore
-import osmnx as ox #type: ignore
+from typing import List, Tuple, Union, Optional, BinaryIO, Set, Dict #type: ignore
 import os #type: ignore
 import haversine #type: ignore
 import networkx
-import pickle as pck
+import gc
+import json
 from typing import Union
 import haversine
-import osmnx as ox
+from PIL import Image #type: ignore
 
 from metro import *
+from snapshot import CitySnapshot, snapshot_from_city_graph, snapshot_to_city_graph, save_snapshot, open_snapshot, \
+    is_snapshot_fresh, sources_fingerprint, patch_snapshot, path_graph, metro_subgraph, NODE_TYPES
+from routing import Router, build_router, shortest_path, travel_times_h, travel_time_matrix
+import contraction
+from spatial import SpatialIndex, build_spatial_index, nearest_nodes, nearest_node
+from render import TileCache, cached_map, to_png, TILE_DIR, TILE_URL, PNG_COMPRESS_LEVEL
+from schedule import TimedRouter, build_timed_router, travel_times_at, travel_time_matrix_at
+from profiles import profile_factors
+import columnar
+import metrics
 
 CityGraph: TypeAlias = networkx.Graph
 
@@ -18,6 +28,12 @@ NodeID: TypeAlias = Union[int, str]
 
 Path: TypeAlias = List[NodeID]
 
+# Files the CityGraph is built from. If any of them changes, the compiled snapshot is rebuilt.
+CITY_SOURCES = [os.path.join(DATA_DIR, "estacions.csv"), os.path.join(DATA_DIR, "accessos.csv")]
+
+# Background tiles of the maps, fetched once and kept on disk, see render.py.
+tiles = TileCache(TILE_DIR, TILE_URL)
+
 
 def node_to_color(node_info: str) -> str:
     """
@@ -38,6 +54,8 @@ def get_osmnx_graph() -> OsmnxGraph:
     Returns:
     OsmnxGraph of Barcelona.
     """
+    # osmnx takes seconds to import, and it is only needed to download the graph.
+    import osmnx as ox #type: ignore
     return ox.graph_from_place('Barcelona', network_type='walk', simplify=True)
 
 
@@ -57,72 +75,104 @@ def clean_up_graph(g: OsmnxGraph) -> OsmnxGraph:
 
 def save_city_graph(g: CityGraph, filename: str) -> None:
     """
-    Pickles city graph in path filename.pickle to avoid generating it everytime,
-    if the pickle doesn't exist already.
+    Saves city graph as a snapshot in the directory filename to avoid generating it everytime,
+    if it doesn't exist already.
     Args:
-        g: CityGraph to be pickled
-        filename: name of the file to save it
+        g: CityGraph to be saved
+        filename: name of the directory to save it
     """
-    if not os.path.exists(filename + '.pickle'):
-        pck_out = open(filename + ".pickle", "wb")
-        pck.dump(g, pck_out)
-        pck_out.close()
+    if not os.path.exists(filename):
+        save_snapshot(snapshot_from_city_graph(g), filename, "")
 
 
 def load_city_graph(filename: str) -> CityGraph:
     """
-    Loads the CityGraph from path filename.pickle, read only.
+    Loads the CityGraph from the snapshot in the directory filename.
     Args:
-        filename: name of the file where the CityGraph is
+        filename: name of the directory where the CityGraph is
     Returns:
     CityGraph of Barcelona
     """
-    pck_in = open(filename + ".pickle", "rb")
-    return pck.load(pck_in)
+    return snapshot_to_city_graph(open_snapshot(filename))
 
 
 def save_osmnx_graph(g: OsmnxGraph, filename: str) -> None:
     """
-    Pickles osmnx graph in path filename.pickle to avoid loading it everytime from osmnx,
-    if the pickle doesn't exist already.
+    Saves osmnx graph in the directory filename to avoid loading it everytime from osmnx,
+    if it doesn't exist already. It is stored in columns (see columnar.py): node ids, edge endpoints and keys, and
+    one column per node or edge attribute.
     Args:
-        g: Osmnxgraph to be pickled
-        filename: name of the file to save it
+        g: Osmnxgraph to be saved
+        filename: name of the directory to save it
     """
     g = clean_up_graph(g)
-    if not os.path.exists(filename + ".pickle"):
-        pck_out = open(filename + ".pickle", "wb")
-        pck.dump(g, pck_out)
-        pck_out.close()
+    if not os.path.exists(filename):
+        columns = {"node": list(g.nodes())}
+        columnar.attribute_columns((data for _, data in g.nodes(data=True)), "node:", columns)
+        edges = list(g.edges(keys=True, data=True))
+        columns["u"] = [u for u, _, _, _ in edges]
+        columns["v"] = [v for _, v, _, _ in edges]
+        columns["key"] = [key for _, _, key, _ in edges]
+        columnar.attribute_columns((data for _, _, _, data in edges), "edge:", columns)
+        # Graph attributes (crs...) go in the header, as strings if they aren't JSON types.
+        columnar.save_columns(filename, columns, {"graph": json.loads(json.dumps(g.graph, default=str))})
+
+
+def load_osmnx_graph(filename: str, attributes: Optional[List[str]] = None) -> OsmnxGraph:
+    """
+    Loads the OsmnxGraph from the directory filename. Only the columns of the given attributes are read, and the
+    checksum of each column is checked as it is read.
+    Args:
+        filename: name of the directory where the OsmnxGraph is
+        attributes: names of the node and edge attributes to be loaded (e.g. ["x", "y"] to build the CityGraph),
+                    None for all of them
+    Returns:
+    OsmnxGraph of Barcelona
+    """
+    header = columnar.read_header(filename)
+    g = OsmnxGraph(**header["meta"]["graph"])
+    nodes = columnar.load_column(filename, header, "node")
+    g.add_nodes_from(zip(nodes, columnar.attribute_records(filename, header, "node:", len(nodes), attributes)))
+    u = columnar.load_column(filename, header, "u")
+    v = columnar.load_column(filename, header, "v")
+    key = columnar.load_column(filename, header, "key")
+    # Edges are written straight into the adjacency dictionaries of the graph, as unpickling it does:
+    # add_edges_from checks every edge and takes most of the load time.
+    succ, pred = g._succ, g._pred
+    for u_, v_, key_, data in zip(u, v, key, columnar.attribute_records(filename, header, "edge:", len(u),
+                                                                        attributes)):
+        keys = succ[u_].get(v_)
+        if keys is None:
+            keys = succ[u_][v_] = pred[v_][u_] = {}
+        keys[key_] = data
+    return g
 
 
-def load_osmnx_graph(filename: str) -> OsmnxGraph:
+def osmnx_sources(osmnx_filename: str) -> List[str]:
     """
-    Loads the CityGraph from path filename.pickle, read only.
+    Files the CityGraph is built from, see CITY_SOURCES.
     Args:
-        filename: name of the file where the CityGraph is
+        osmnx_filename: name of the directory where the OsmnxGraph is saved
     Returns:
-    OsmnxGraph of Barcelona
+    List with the metro databases and the header of the OsmnxGraph, which holds the checksums of all its columns.
     """
-    pck_in = open(filename + ".pickle", "rb")
-    return pck.load(pck_in)
+    return CITY_SOURCES + [os.path.join(osmnx_filename, "header.json")]
 
 
 def get_osmnx_edges(g1: OsmnxGraph, g: CityGraph) -> None:
     """
-    Adds Osmnx edges to CityGraph.
+    Adds Osmnx edges to CityGraph. Distances and travel times of all edges are computed at once.
     Args:
         g1: OsmnxGraph
         g: CityGraph
     """
-    for edge in g1.edges():
-        node1 = edge[0]
-        node2 = edge[1]
-        if edge[0] != edge[1]:
-            g.add_edge(node1, node2,
-                       info=Edge("Street", edge_to_color("Street"),
-                                 haversine(g.nodes[node1]['pos'], g.nodes[node2]['pos'])),
-                       weight=needed_time_h(g.nodes[node1]['pos'], g.nodes[node2]['pos'], "walk"))
+    edges = [(u, v) for u, v in g1.edges() if u != v]
+    nodes1 = [u for u, _ in edges]
+    nodes2 = [v for _, v in edges]
+    p1 = np.array([g.nodes[u]['pos'] for u in nodes1])
+    p2 = np.array([g.nodes[v]['pos'] for v in nodes2])
+    g.add_edges_from(weighted_edges(nodes1, nodes2, p1, p2, "Street", [edge_to_color("Street")] * len(edges),
+                                    "walk"))
 
 
 def get_osmnx_nodes(g1: OsmnxGraph, g: CityGraph) -> None:
@@ -134,8 +184,8 @@ def get_osmnx_nodes(g1: OsmnxGraph, g: CityGraph) -> None:
     """
     for node in g1.nodes():
         if 'x' in g1.nodes[node] and 'y' in g1.nodes[node]:
-            g.add_node(node, pos=[g1.nodes[node]['x'],
-                                  g1.nodes[node]['y']], type="Street")
+            g.add_node(node, pos=(g1.nodes[node]['x'],
+                                  g1.nodes[node]['y']), type="Street")
 
 
 def get_metro_edges(g2: MetroGraph, g: CityGraph) -> None:
@@ -150,37 +200,28 @@ def get_metro_edges(g2: MetroGraph, g: CityGraph) -> None:
         ['info'], weight=g2.edges[edge]['weight'])
 
 
-def get_metro_nodes_and_links(g1: OsmnxGraph, g2: MetroGraph, g: CityGraph) -> None:
+def get_metro_nodes_and_links(g2: MetroGraph, g: CityGraph) -> None:
     """
     Adds metro nodes to CityGraph, as well as edges for links between accesses and stations.
     Args:
-        g1: OsmnxGraph
         g2: MetroGraph
-        g: CityGraph to be modified
+        g: CityGraph to be modified, with the street nodes already added
     """
     node_access: List = []
-    dict_access: List[Dict] = []
-    coord_access_lat: List[float] = []
-    coord_access_long: List[float] = []
+    coord_access: List[Coord] = []
+    street_index = city_graph_index(g)
     for node in g2.nodes():
         # Adding nodes from MetroGraph:
         g.add_node(node, pos=g2.nodes[node]['pos'],
                    type=g2.nodes[node]['type'])
         if g2.nodes[node]['type'] == "Acces":
             node_access.append(node)
-            coord_access_long.append(g2.nodes[node]['pos'][0])
-            coord_access_lat.append(g2.nodes[node]['pos'][1])
-    nearest_to_access = ox.distance.nearest_nodes(
-        g1, coord_access_long, coord_access_lat, return_dist=False)
-    for i in range(len(node_access)):
-        dict_access.append({'info': Edge("Street", edge_to_color("Street"),
-                                         haversine(g.nodes[node_access[i]]['pos'],
-                                                   g.nodes[nearest_to_access[i]]['pos'])),
-                            'weight': needed_time_h(g.nodes[node_access[i]]['pos'],
-                                                    g.nodes[nearest_to_access[i]]['pos'], "walk")})
-    # Adding edges from accesses to their respective stations:
-    # merges lists into a list of tuples.
-    list_of_edges = list(zip(node_access, nearest_to_access, dict_access))
+            coord_access.append(g2.nodes[node]['pos'])
+    nearest_to_access = nearest_nodes(street_index, coord_access)
+    # Adding edges from accesses to their nearest streets:
+    list_of_edges = weighted_edges(node_access, nearest_to_access, np.array(coord_access),
+                                   np.array([g.nodes[node]['pos'] for node in nearest_to_access]), "Street",
+                                   [edge_to_color("Street")] * len(node_access), "walk")
     g.add_edges_from(list_of_edges)
     # This configuration allows the efficient execution of nearest_nodes by giving it a list of coordinates.
 
@@ -195,13 +236,203 @@ def build_city_graph(g1: OsmnxGraph, g2: MetroGraph) -> CityGraph:
     CityGraph given from union of both given graphs.
     """
     g = CityGraph()
-    get_osmnx_nodes(g1, g)
-    get_osmnx_edges(g1, g)
-    get_metro_nodes_and_links(g1, g2, g)
-    get_metro_edges(g2, g)
+    # The graph is made of hundreds of thousands of new dictionaries and edges, which makes the garbage collector
+    # run over and over while nothing can be freed. It is paused during the build.
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        get_osmnx_nodes(g1, g)
+        get_osmnx_edges(g1, g)
+        get_metro_nodes_and_links(g2, g)
+        get_metro_edges(g2, g)
+    finally:
+        if gc_enabled:
+            gc.enable()
     return g
 
 
+def update_city_graph(g: CityGraph, g2: MetroGraph, index: SpatialIndex) -> Set[NodeID]:
+    """
+    Updates the CityGraph in place to a new MetroGraph (e.g. after a change in the stations or accesses databases),
+    as build_city_graph would build it, but only touching the stations and accesses that have changed and their
+    edges. Streets are left as they are, so g may hold only some of them, e.g. a metro_subgraph with the streets the
+    accesses are linked to and the ones new and moved accesses are snapped to.
+    Args:
+        g: CityGraph to be modified
+        g2: new MetroGraph
+        index: SpatialIndex of the street nodes of g, used to link new and moved accesses to their nearest streets
+    Returns:
+    Set of the stations and accesses that have been added, removed or moved, or whose edges have changed.
+    """
+    old = {node for node, node_type in g.nodes(data='type') if node_type != "Street"}
+    touched = old - set(g2.nodes())
+    moved = set()
+    for node in g2.nodes():
+        if node not in old or g.nodes[node]['pos'] != g2.nodes[node]['pos'] \
+                or g.nodes[node]['type'] != g2.nodes[node]['type']:
+            moved.add(node)
+    touched |= moved
+    # Edges the metro nodes should have: the ones of g2, plus the link of each access to its nearest street.
+    # Accesses that haven't moved keep their link.
+    wanted = {(u, v): data for u, v, data in g2.edges(data=True)}
+    accesses = [node for node in g2.nodes() if g2.nodes[node]['type'] == "Acces"]
+    to_snap = [node for node in accesses if node in moved]
+    for node in accesses:
+        if node not in moved:
+            for street in g[node]:
+                if g.nodes[street]['type'] == "Street":
+                    wanted[(node, street)] = g.edges[node, street]
+    if to_snap:
+        coords = [g2.nodes[node]['pos'] for node in to_snap]
+        streets = nearest_nodes(index, coords)
+        for u, v, data in weighted_edges(to_snap, streets, np.array(coords),
+                                         np.array([g.nodes[node]['pos'] for node in streets]), "Street",
+                                         [edge_to_color("Street")] * len(to_snap), "walk"):
+            wanted[(u, v)] = data
+    for node in old & touched:
+        g.remove_node(node)
+    for node in g2.nodes():
+        if node in touched:
+            g.add_node(node, pos=g2.nodes[node]['pos'], type=g2.nodes[node]['type'])
+    for (u, v), data in wanted.items():
+        if not g.has_edge(u, v) or g.edges[u, v]['weight'] != data['weight'] or g.edges[u, v]['info'] != data['info']:
+            g.add_edge(u, v, info=data['info'], weight=data['weight'])
+            # u is a station or an access, touching it is enough for patch_snapshot to replace the edge.
+            touched.add(u)
+    for node in g2.nodes():
+        for v in list(g[node]):
+            if (node, v) not in wanted and (v, node) not in wanted:
+                g.remove_edge(node, v)
+                touched.add(node)
+    return touched
+
+
+def city_graph_index(g: CityGraph) -> SpatialIndex:
+    """
+    Builds the spatial index of the street nodes of the CityGraph, used to snap coordinates to the graph.
+    Args:
+        g: CityGraph
+    Returns:
+    SpatialIndex of the Street nodes of g.
+    """
+    streets = [node for node in g.nodes() if g.nodes[node]['type'] == "Street"]
+    return build_spatial_index(streets, np.array([g.nodes[node]['pos'] for node in streets]))
+
+
+def snapshot_index(s: CitySnapshot) -> SpatialIndex:
+    """
+    Builds the spatial index of the street nodes of a CityGraph snapshot, used to snap coordinates to the graph.
+    Args:
+        s: CitySnapshot
+    Returns:
+    SpatialIndex of the Street nodes of the snapshot.
+    """
+    streets = np.flatnonzero(np.asarray(s.types) == NODE_TYPES.index("Street"))
+    return build_spatial_index(s.ids[streets].tolist(), s.pos[streets])
+
+
+def compile_city_snapshot(dirname: str, osmnx_filename: str) -> CitySnapshot:
+    """
+    Builds the CityGraph from the metro databases and the OsmnxGraph saved in the directory osmnx_filename,
+    and compiles it into a snapshot stored in the directory dirname.
+    Args:
+        dirname: directory where the snapshot is stored
+        osmnx_filename: name of the directory where the OsmnxGraph is saved
+    Returns:
+    CitySnapshot opened from dirname.
+    """
+    sources = osmnx_sources(osmnx_filename)
+    # Only the coordinates of the street nodes are needed, the other attributes aren't read.
+    g = build_city_graph(load_osmnx_graph(osmnx_filename, ["x", "y"]), get_metro_graph())
+    save_snapshot(snapshot_from_city_graph(g), dirname, sources_fingerprint(sources))
+    return open_snapshot(dirname)
+
+
+def load_city_snapshot(dirname: str, osmnx_filename: str) -> CitySnapshot:
+    """
+    Opens the compiled CityGraph snapshot in dirname, memory-mapped read only.
+    If it doesn't exist or the databases or the OsmnxGraph have changed since it was compiled, it is rebuilt.
+    Args:
+        dirname: directory where the snapshot is stored
+        osmnx_filename: name of the directory where the OsmnxGraph is saved
+    Returns:
+    CitySnapshot of Barcelona.
+    """
+    if is_snapshot_fresh(dirname, osmnx_sources(osmnx_filename)):
+        return open_snapshot(dirname)
+    return compile_city_snapshot(dirname, osmnx_filename)
+
+
+def update_city_snapshot(s: CitySnapshot, index: SpatialIndex, dirname: str, osmnx_filename: str) -> CitySnapshot:
+    """
+    Brings the snapshot up to date with the metro databases, patching only what has changed (see update_city_graph
+    and patch_snapshot) instead of building it again. The OsmnxGraph must not have changed. Only the metro_subgraph
+    of the snapshot is rebuilt for the update, in a few milliseconds, instead of the whole CityGraph.
+    The contraction hierarchy of the old snapshot is dropped: routes are found with the Router until it is compiled
+    again, see rebuild_city_hierarchy.
+    Args:
+        s: CitySnapshot, opened from dirname
+        index: SpatialIndex of the street nodes of s
+        dirname: directory where the snapshot is stored
+        osmnx_filename: name of the directory where the OsmnxGraph is saved
+    Returns:
+    CitySnapshot of the updated CityGraph, opened from dirname.
+    """
+    g2 = get_metro_graph()
+    # The streets new and moved accesses are linked to are among the nearest ones of all the accesses.
+    streets = nearest_nodes(index, [g2.nodes[node]['pos'] for node in g2.nodes() if g2.nodes[node]['type'] == "Acces"])
+    g = metro_subgraph(s, streets)
+    touched = update_city_graph(g, g2, index)
+    save_snapshot(patch_snapshot(s, g, touched), dirname, sources_fingerprint(osmnx_sources(osmnx_filename)))
+    return open_snapshot(dirname)
+
+
+def compile_city_hierarchy(s: CitySnapshot, dirname: str) -> contraction.Hierarchy:
+    """
+    Builds the contraction hierarchy of the CityGraph snapshot in dirname and saves it alongside the snapshot.
+    Warning: can take a while, it is meant to be run as a build step.
+    Args:
+        s: CitySnapshot opened from dirname
+        dirname: directory where the snapshot is stored
+    Returns:
+    Hierarchy opened from dirname.
+    """
+    contraction.save_hierarchy(contraction.build_hierarchy(s), dirname)
+    return contraction.open_hierarchy(s, dirname)
+
+
+def rebuild_city_hierarchy(dirname: str) -> str:
+    """
+    Builds the contraction hierarchy of the snapshot currently in dirname and saves it alongside it, e.g. in a
+    background process after the snapshot has been patched, since the hierarchy can't be patched. It is saved in the
+    version of the snapshot it was built from (see columnar.replace_dir), so if the snapshot is replaced meanwhile,
+    the new one isn't given an outdated hierarchy.
+    Args:
+        dirname: directory where the snapshot is stored
+    Returns:
+    Fingerprint of the snapshot the hierarchy was built from.
+    """
+    version = os.path.realpath(dirname)
+    s = open_snapshot(version)
+    contraction.save_hierarchy(contraction.build_hierarchy(s), version)
+    return s.fingerprint
+
+
+def load_city_hierarchy(s: CitySnapshot, dirname: str) -> Optional[contraction.Hierarchy]:
+    """
+    Opens the contraction hierarchy saved alongside the snapshot in dirname, if it was built from that snapshot.
+    Args:
+        s: CitySnapshot opened from dirname
+        dirname: directory where the snapshot is stored
+    Returns:
+    Hierarchy of the CityGraph, None if there is none (or it is outdated) and queries have to use the Router.
+    """
+    if contraction.is_hierarchy_fresh(dirname):
+        return contraction.open_hierarchy(s, dirname)
+    return None
+
+
+@metrics.measured("time_from_path")
 def time_from_path(g: CityGraph, p: Path) -> int:
     """
     Gives the time needed to complete a certain path.
@@ -218,30 +449,155 @@ def time_from_path(g: CityGraph, p: Path) -> int:
     return total_time
 
 
-def find_path(ox_g: OsmnxGraph, g: CityGraph, src: Coord, dst: Coord) -> Path:
+@metrics.measured("find_path")
+def find_path(index: SpatialIndex, g: CityGraph, src: Coord, dst: Coord, router: Optional[Router] = None,
+              hierarchy: Optional[contraction.Hierarchy] = None) -> Path:
     """
-    Returns the shortest path from src to dst as a list of nodes.
+    Returns the fastest path from src to dst as a list of nodes, weighting edges by their travel time.
     Args:
-        ox_g: OsmnxGraph
-        g: CityGraph
+        index: SpatialIndex of the street nodes of g, used to snap src and dst to the graph
+        g: CityGraph, only searched if neither router nor hierarchy are given
         src: starting point of path
         dst: end point of path
+        router: routing engine over the snapshot of g, see routing.py. If None, networkx is used on g.
+        hierarchy: contraction hierarchy of g, see contraction.py. If given, it is used instead of the router.
     Returns:
     Path, list of nodes from src to dst.
     """
-    origin = ox.distance.nearest_nodes(ox_g, src[0], src[1], return_dist=False)
-    destination = ox.distance.nearest_nodes(
-        ox_g, dst[0], dst[1], return_dist=False)
-    path = networkx.shortest_path(g, origin, destination)
+    origin, destination = nearest_nodes(index, [src, dst])
+    return path_between(g, origin, destination, router, hierarchy)
+
+
+@metrics.measured("path_between")
+def path_between(g: CityGraph, origin: NodeID, destination: NodeID, router: Optional[Router] = None,
+                 hierarchy: Optional[contraction.Hierarchy] = None) -> Path:
+    """
+    Returns the fastest path between two nodes of the graph, see find_path.
+    Args:
+        g: CityGraph, only searched if neither router nor hierarchy are given
+        origin: first node of the path
+        destination: last node of the path
+        router: routing engine over the snapshot of g, see routing.py. If None, networkx is used on g.
+        hierarchy: contraction hierarchy of g, see contraction.py. If given, it is used instead of the router.
+    Returns:
+    Path, list of nodes from origin to destination.
+    """
+    if hierarchy is not None:
+        return contraction.shortest_path(hierarchy, origin, destination)
+    if router is not None:
+        return shortest_path(router, origin, destination)
+    path = networkx.shortest_path(g, origin, destination, weight="weight")
     return path
 
 
+@metrics.measured("times_from")
+def times_from(index: SpatialIndex, router: Router, src: Coord, destinations: List[NodeID],
+               cutoff: float) -> List[Optional[int]]:
+    """
+    Gives the time needed to go from src to each of the destinations, with a single search from src instead of one
+    search per destination.
+    Args:
+        index: SpatialIndex of the street nodes, used to snap src to the graph
+        router: routing engine over the snapshot of the CityGraph, see routing.py
+        src: starting point of the paths
+        destinations: end nodes of the paths
+        cutoff: maximum travel time in hours
+    Returns:
+    List with the minutes needed to reach each of the destinations as in time_from_path, None for the ones that
+    can't be reached within cutoff.
+    """
+    origin = nearest_node(index, src)
+    return [None if t is None else int(t * 60) for t in travel_times_h(router, origin, destinations, cutoff)]
+
+
+def time_matrix(index: SpatialIndex, router: Router, srcs: List[Coord], destinations: List[NodeID],
+                cutoff: float = float("inf")) -> np.ndarray:
+    """
+    Gives the time needed to go from each of the srcs to each of the destinations at once (e.g. from a few user
+    positions to thousands of restaurants), with one search per src instead of one find_path per pair.
+    Args:
+        index: SpatialIndex of the street nodes, used to snap srcs to the graph
+        router: routing engine over the snapshot of the CityGraph, see routing.py
+        srcs: starting points of the paths
+        destinations: end nodes of the paths
+        cutoff: maximum travel time in hours
+    Returns:
+    Array of shape (len(srcs), len(destinations)) with the time in hours from each src to each destination, inf for
+    the ones that can't be reached within cutoff.
+    """
+    return travel_time_matrix(router, nearest_nodes(index, srcs), destinations, cutoff)
+
+
+def time_matrix_at(index: SpatialIndex, tr: TimedRouter, srcs: List[Coord], destinations: List[NodeID],
+                   depart_h: float, cutoff: float = float("inf")) -> np.ndarray:
+    """
+    Same as time_matrix, but leaving the srcs at the given time of day, see schedule.py.
+    Args:
+        index: SpatialIndex of the street nodes, used to snap srcs to the graph
+        tr: time-aware routing engine over the snapshot of the CityGraph
+        srcs: starting points of the paths
+        destinations: end nodes of the paths
+        depart_h: time of day of the departure, in hours since midnight
+        cutoff: maximum travel time in hours
+    Returns:
+    Array of shape (len(srcs), len(destinations)) with the time in hours from each src to each destination, inf for
+    the ones that can't be reached within cutoff.
+    """
+    return travel_time_matrix_at(tr, nearest_nodes(index, srcs), destinations, depart_h, cutoff)
+
+
+def build_city_timed_router(s: CitySnapshot) -> TimedRouter:
+    """
+    Builds the time-aware routing engine over the CityGraph snapshot, see schedule.py.
+    Args:
+        s: CitySnapshot of the city
+    Returns:
+    TimedRouter with the service of the line of each station, as in the stations database.
+    """
+    return build_timed_router(s, {station.id: station.line for station in read_stations()})
+
+
+def build_city_profiles(s: CitySnapshot) -> Dict[str, np.ndarray]:
+    """
+    Computes the factors of the edges of the CityGraph snapshot for each routing profile, see profiles.py.
+    Args:
+        s: CitySnapshot of the city
+    Returns:
+    Dictionary from profile name to the factors of its edges, with the accessibility of each access and station
+    as in the metro databases.
+    """
+    inaccessible = {access.id for access in read_accesses() if not access.accessibility}
+    inaccessible |= {station.id for station in read_stations() if not station.accessibility}
+    return profile_factors(s, inaccessible)
+
+
+@metrics.measured("times_from_at")
+def times_from_at(index: SpatialIndex, tr: TimedRouter, src: Coord, destinations: List[NodeID], depart_h: float,
+                  cutoff: float) -> List[Optional[int]]:
+    """
+    Same as times_from, but leaving src at the given time of day: the wait for each train depends on it.
+    Args:
+        index: SpatialIndex of the street nodes, used to snap src to the graph
+        tr: time-aware routing engine over the snapshot of the CityGraph, see schedule.py
+        src: starting point of the paths
+        destinations: end nodes of the paths
+        depart_h: time of day of the departure, in hours since midnight
+        cutoff: maximum travel time in hours
+    Returns:
+    List with the minutes needed to reach each of the destinations, None for the ones that can't be reached within
+    cutoff.
+    """
+    origin = nearest_node(index, src)
+    return [None if t is None else int(t * 60) for t in travel_times_at(tr, origin, destinations, depart_h, cutoff)]
+
+
 def show(g: CityGraph) -> None:
     """
     Shows the CityGraph in an interactive form in a new window
     Args:
         g: CityGraph
     """
+    import matplotlib.pyplot as plt #type: ignore
     networkx.draw(g, with_labels=False, node_size=25,
                   pos=networkx.get_node_attributes(g, "pos"))
     plt.show()
@@ -256,7 +612,8 @@ def plot(g: CityGraph, filename: str) -> None:
     Note: The file is saved as filename.png, if you can't open .png extensions consider an online converter.
     """
     # stores g as an image with the city map in the background in the filename file
-    new_map = StaticMap(1000, 1000)
+    from staticmap import CircleMarker, Line #type: ignore
+    new_map = cached_map(1000, 1000, tiles)
     for node in g.nodes():
         color = node_to_color(g.nodes[node]['type'])
         new_map.add_marker(CircleMarker((g.nodes[node]['pos']), color, 1))
@@ -270,16 +627,17 @@ def plot(g: CityGraph, filename: str) -> None:
     image.save(filename + ".png")
 
 
-def plot_path(g: CityGraph, p: Path, filename: str) -> None:
+def path_map(g: CityGraph, p: Path) -> Image.Image:
     """
-    Plots path and saves it in path filename.png, as a StaticMap.
+    Renders the path over the map of the city, in memory.
     Args:
         g: CityGraph to be drawn over
         p: path to be plotted
-        filename: name of the file to save plot
-    Note: The file is saved as filename.png, if you can't open .png extensions consider an online converter.
+    Returns:
+    Image of the map.
     """
-    new_map = StaticMap(1000, 1000)
+    from staticmap import CircleMarker, Line #type: ignore
+    new_map = cached_map(1000, 1000, tiles)
     for i in range(len(p)):
         color = node_to_color(g.nodes[p[i]]['type'])
         new_map.add_marker(CircleMarker((g.nodes[p[i]]['pos']), color, 2))
@@ -287,5 +645,35 @@ def plot_path(g: CityGraph, p: Path, filename: str) -> None:
         color = g.edges[p[i], p[i + 1]]['info'].color
         new_map.add_line(
             Line([g.nodes[p[i]]['pos'], g.nodes[p[i + 1]]['pos']], color, 3))
-    image = new_map.render()
-    image.save(filename + ".png")
+    return new_map.render()
+
+
+@metrics.measured("plot_path")
+def plot_path(g: CityGraph, p: Path, filename: Union[str, BinaryIO], compress_level: int = PNG_COMPRESS_LEVEL,
+              scale: float = 1.0) -> None:
+    """
+    Plots path and saves it in path filename.png, as a StaticMap.
+    Args:
+        g: CityGraph to be drawn over
+        p: path to be plotted
+        filename: name of the file to save plot, or a binary buffer (e.g. io.BytesIO) to write it in memory
+        compress_level: zlib compression level of the png, from 0 to 9
+        scale: factor the map is resized by, e.g. 0.5 for a map half as wide and high, smaller to upload
+    Note: The file is saved as filename.png, if you can't open .png extensions consider an online converter.
+    """
+    png = to_png(path_map(g, p), compress_level, scale)
+    if isinstance(filename, str):
+        with open(filename + ".png", "wb") as f:
+            f.write(png)
+    else:
+        filename.write(png)
+
+
+if __name__ == "__main__":
+    # Build step: compiles the CityGraph snapshot used by the bot and its contraction hierarchy.
+    if not os.path.exists("street_graph") and os.path.exists("street_graph.pickle"):
+        # Street graphs pickled by older versions are converted once. Only unpickle files you created yourself.
+        import pickle
+        with open("street_graph.pickle", "rb") as f:
+            save_osmnx_graph(pickle.load(f), "street_graph")
+    compile_city_hierarchy(compile_city_snapshot("city_graph", "street_graph"), "city_graph")
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import numpy as np
+from typing import List, Dict, Tuple, Any, Optional, Iterable #type: ignore
+
+# Typed columnar storage: a directory with one .npy file per column and a header.json that describes them, with the
+# checksum of each file. Unlike a pickle, loading it doesn't run any code, it doesn't depend on the version of the
+# libraries that wrote it, and columns can be read one by one, so the ones that aren't needed are never read.
+
+# Bumped every time the layout of the directory changes, so older files are rejected instead of misread.
+COLUMNAR_VERSION = 1
+
+
+def versions(dirname: str) -> List[str]:
+    """
+    Lists the versions of a directory written by replace_dir.
+    Args:
+        dirname: path of the directory
+    Returns:
+    List of the paths of its versions, oldest first.
+    """
+    parent, name = os.path.split(os.path.abspath(dirname))
+    found = [f for f in os.listdir(parent) if f.startswith(name + ".v") and f[len(name) + 2:].isdigit()]
+    return [os.path.join(os.path.dirname(dirname), f) for f in sorted(found, key=lambda f: int(f[len(name) + 2:]))]
+
+
+def replace_dir(tmp: str, dirname: str) -> None:
+    """
+    Puts a directory written aside in place of dirname, so that readers always find either the old directory or the
+    new one, never none or half of one. dirname is a symbolic link to the current version of the directory
+    (dirname.v<timestamp>), swapped atomically with os.replace. The version it replaces is kept until the next one,
+    so that readers that have just resolved the link can still open its files. Where symbolic links can't be
+    created (e.g. Windows without the privilege), the old directory is renamed aside and the new one renamed into
+    place, which leaves dirname missing for an instant.
+    Args:
+        tmp: directory written aside, in the same directory as dirname
+        dirname: path of the directory
+    """
+    previous = os.path.realpath(dirname) if os.path.islink(dirname) else None
+    version = dirname + ".v" + str(time.time_ns())
+    os.rename(tmp, version)
+    link = dirname + ".link" + str(os.getpid())
+    try:
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.basename(version), link, target_is_directory=True)
+    except (OSError, NotImplementedError):
+        aside = dirname + ".old" + str(os.getpid())
+        if os.path.exists(dirname):
+            os.rename(dirname, aside)
+        os.rename(version, dirname)
+        if os.path.exists(aside):
+            shutil.rmtree(aside)
+        return
+    if os.path.isdir(dirname) and not os.path.islink(dirname):
+        # Directory written before versions were kept: moved aside once, dirname is missing for an instant.
+        aside = dirname + ".old" + str(os.getpid())
+        os.rename(dirname, aside)
+        os.replace(link, dirname)
+        shutil.rmtree(aside)
+    else:
+        os.replace(link, dirname)
+    for old in versions(dirname):
+        if os.path.realpath(old) not in (os.path.realpath(version), previous):
+            shutil.rmtree(old, ignore_errors=True)
+
+
+def checksum(path: str) -> str:
+    """
+    Computes the checksum of a file.
+    Args:
+        path: path of the file
+    Returns:
+    String with the hex digest of the sha256 of its content.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode(values: List[Any]) -> Tuple[str, Dict[str, np.ndarray]]:
+    """
+    Encodes a column of values into typed arrays. None stands for a missing value.
+    Args:
+        values: list of values of the column
+    Returns:
+    Tuple with the kind of the column ("bool", "int", "float", "str" or "json") and its arrays: "data" with the
+    values (the UTF-8 bytes of all of them one after the other for strings and JSON, delimited by "offsets"), and
+    "present" telling which values aren't missing, only if some are.
+    Raises TypeError if some value can't be stored as JSON.
+    """
+    types = set(map(type, values))
+    parts = {}
+    if type(None) in types:
+        types.discard(type(None))
+        parts["present"] = np.array([v is not None for v in values], dtype=np.bool_)
+    if types <= {bool, np.bool_}:
+        kind = "bool"
+        parts["data"] = np.array([bool(v) if v is not None else False for v in values], dtype=np.bool_)
+    elif all(issubclass(t, (int, np.integer)) and not issubclass(t, (bool, np.bool_)) for t in types):
+        kind = "int"
+        parts["data"] = np.array([v if v is not None else 0 for v in values], dtype=np.int64)
+    elif all(issubclass(t, (int, float, np.integer, np.floating)) and not issubclass(t, (bool, np.bool_))
+             for t in types):
+        kind = "float"
+        parts["data"] = np.array([v if v is not None else np.nan for v in values], dtype=np.float64)
+    else:
+        kind = "str" if types <= {str} else "json"
+        encoded = [(v if kind == "str" else json.dumps(v)).encode() if v is not None else b"" for v in values]
+        parts["data"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        parts["offsets"] = np.concatenate(([0], np.cumsum([len(b) for b in encoded], dtype=np.int64)))
+    return kind, parts
+
+
+def decode(kind: str, parts: Dict[str, np.ndarray]) -> List[Any]:
+    """
+    Decodes a column encoded by encode.
+    Args:
+        kind: kind of the column
+        parts: arrays of the column
+    Returns:
+    List of values of the column, None for missing values.
+    """
+    if kind in ("str", "json"):
+        buffer = parts["data"].tobytes()
+        offsets = parts["offsets"].tolist()
+        values = [buffer[a:b].decode() for a, b in zip(offsets, offsets[1:])]
+        if kind == "json":
+            values = [json.loads(v) if v else None for v in values]
+    else:
+        values = parts["data"].tolist()
+    if "present" in parts:
+        values = [v if p else None for v, p in zip(values, parts["present"].tolist())]
+    return values
+
+
+def save_columns(dirname: str, columns: Dict[str, List[Any]], meta: Dict[str, Any]) -> None:
+    """
+    Writes columns in the directory dirname. The directory is written aside and swapped into place, so readers
+    never see it half written, see replace_dir.
+    Args:
+        dirname: directory where the columns are stored
+        columns: name of each column and its values, None for missing values
+        meta: JSON serializable information stored in the header along the columns
+    """
+    tmp = dirname + ".tmp" + str(os.getpid())
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    described = {}
+    for i, (name, values) in enumerate(columns.items()):
+        kind, parts = encode(values)
+        # Column names may be any string, files are numbered instead.
+        files = {part: str(i) + "_" + part + ".npy" for part in parts}
+        for part, data in parts.items():
+            np.save(os.path.join(tmp, files[part]), data)
+        described[name] = {"kind": kind, "length": len(values), "files": files,
+                           "checksums": {part: checksum(os.path.join(tmp, f)) for part, f in files.items()}}
+    header = {"version": COLUMNAR_VERSION, "meta": meta, "columns": described}
+    with open(os.path.join(tmp, "header.json"), "w") as f:
+        json.dump(header, f)
+    replace_dir(tmp, dirname)
+
+
+def read_header(dirname: str) -> Dict[str, Any]:
+    """
+    Reads the header of the columns in dirname.
+    Args:
+        dirname: directory where the columns are stored
+    Returns:
+    Dictionary with the header.
+    Raises ValueError if there are no columns in dirname or they have an unsupported version.
+    """
+    path = os.path.join(dirname, "header.json")
+    if not os.path.exists(path):
+        raise ValueError("There are no columns in " + dirname + ".")
+    with open(path) as f:
+        header = json.load(f)
+    if header.get("version") != COLUMNAR_VERSION:
+        raise ValueError("Columns in " + dirname + " have an unsupported version.")
+    return header
+
+
+def load_part(dirname: str, header: Dict[str, Any], name: str, part: str, verify: bool) -> np.ndarray:
+    """
+    Reads one of the files of a column, checking that it hasn't been altered.
+    Args:
+        dirname: directory where the columns are stored
+        header: header of the columns, see read_header
+        name: name of the column
+        part: "data", "offsets" or "present", see encode
+        verify: whether to check the checksum of the file
+    Returns:
+    Array stored in the file.
+    Raises ValueError if the checksum doesn't match.
+    """
+    column = header["columns"][name]
+    path = os.path.join(dirname, column["files"][part])
+    if verify and checksum(path) != column["checksums"][part]:
+        raise ValueError("Column " + name + " in " + dirname + " is corrupted.")
+    return np.load(path, allow_pickle=False)
+
+
+def load_column(dirname: str, header: Dict[str, Any], name: str, verify: bool = True) -> List[Any]:
+    """
+    Reads one column, and no other.
+    Args:
+        dirname: directory where the columns are stored
+        header: header of the columns, see read_header
+        name: name of the column
+        verify: whether to check the checksums of its files
+    Returns:
+    List of values of the column, None for missing values.
+    """
+    column = header["columns"][name]
+    return decode(column["kind"], {part: load_part(dirname, header, name, part, verify) for part in column["files"]})
+
+
+def load_array(dirname: str, header: Dict[str, Any], name: str, verify: bool = True) -> np.ndarray:
+    """
+    Reads one bool, int or float column with no missing values as an array, without turning it into Python
+    objects.
+    Args:
+        dirname: directory where the columns are stored
+        header: header of the columns, see read_header
+        name: name of the column
+        verify: whether to check the checksum of its file
+    Returns:
+    Array with the values of the column.
+    """
+    return load_part(dirname, header, name, "data", verify)
+
+
+def attribute_columns(records: Iterable[Dict[str, Any]], prefix: str, columns: Dict[str, List[Any]]) -> None:
+    """
+    Turns the attribute dictionaries of nodes or edges into columns, one per attribute name, with None where
+    an attribute is missing.
+    Args:
+        records: attribute dictionary of each node or edge
+        prefix: prepended to the attribute names to name the columns, e.g. "node:"
+        columns: dictionary the columns are added to
+    """
+    records = list(records)
+    names: List[str] = []
+    for record in records:
+        for key in record:
+            if key not in names:
+                names.append(key)
+    for key in names:
+        columns[prefix + key] = [record.get(key) for record in records]
+
+
+def attribute_names(header: Dict[str, Any], prefix: str) -> List[str]:
+    """
+    Names of the attributes stored as columns with the given prefix, see attribute_columns.
+    Args:
+        header: header of the columns, see read_header
+        prefix: prefix of the columns
+    Returns:
+    List of attribute names.
+    """
+    return [name[len(prefix):] for name in header["columns"] if name.startswith(prefix)]
+
+
+def attribute_records(dirname: str, header: Dict[str, Any], prefix: str, n: int,
+                      attributes: Optional[List[str]], verify: bool = True) -> List[Dict[str, Any]]:
+    """
+    Rebuilds the attribute dictionaries of nodes or edges from their columns, reading only the given attributes.
+    Args:
+        dirname: directory where the columns are stored
+        header: header of the columns, see read_header
+        prefix: prefix of the columns, see attribute_columns
+        n: number of nodes or edges
+        attributes: names of the attributes to be read, None for all of them
+        verify: whether to check the checksums of the files
+    Returns:
+    List with the attribute dictionary of each node or edge, without the attributes they are missing.
+    """
+    names = attribute_names(header, prefix)
+    if attributes is not None:
+        names = [name for name in names if name in attributes]
+    records: List[Dict[str, Any]] = [{} for _ in range(n)]
+    for name in names:
+        for record, value in zip(records, load_column(dirname, header, prefix + name, verify)):
+            if value is not None:
+                record[name] = value
+    return records
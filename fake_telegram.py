@@ -0,0 +1,128 @@
+import io
+import time
+import asyncio
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional, Callable, Any #type: ignore
+from typing_extensions import TypeAlias
+
+# Local stand-in for the Telegram API: it builds updates like the ones Telegram sends and a bot object that records
+# the answers instead of sending them, so that the handlers of bot.py can be run (and timed) without a network
+# connection or an access token.
+
+Handler: TypeAlias = Callable[[Any, Any], Any]
+
+
+@dataclass
+class Chat:
+    id: int
+
+
+@dataclass
+class Location:
+    longitude: float
+    latitude: float
+
+
+@dataclass
+class Message:
+    text: Optional[str]
+    location: Optional[Location]
+
+
+@dataclass
+class Update:
+    update_id: int
+    effective_chat: Chat
+    message: Message
+
+
+@dataclass
+class Answer:
+    chat_id: int
+    text: Optional[str]
+    photo: Optional[bytes]
+    time: float  # time.perf_counter() when it was sent
+
+
+@dataclass
+class Context:
+    bot: "FakeBot"
+    args: List[str]
+    user_data: Dict
+
+
+class FakeBot:
+    """
+    Bot that records the answers of the handlers. latency is the time in seconds each call to the API takes.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.answers: List[Answer] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs: Any) -> None:
+        await asyncio.sleep(self.latency)
+        self.answers.append(Answer(chat_id, text, None, time.perf_counter()))
+
+    async def send_photo(self, chat_id: int, photo: Any, **kwargs: Any) -> None:
+        if isinstance(photo, (bytes, bytearray)):
+            data = bytes(photo)
+        elif isinstance(photo, io.IOBase) or hasattr(photo, "read"):
+            data = photo.read()
+        else:
+            data = open(photo, "rb").read()
+        await asyncio.sleep(self.latency)
+        self.answers.append(Answer(chat_id, None, data, time.perf_counter()))
+
+
+class FakeTelegram:
+    """
+    Routes fake updates to the handlers of the bot the same way the CommandHandlers and the location
+    MessageHandler of the real application do, keeping the user_data of each chat between updates.
+    """
+
+    def __init__(self, commands: Dict[str, Handler], location_handler: Handler, latency: float = 0.0) -> None:
+        self.commands = commands
+        self.location_handler = location_handler
+        self.bot = FakeBot(latency)
+        self.user_data: Dict[int, Dict] = {}
+        self.next_update_id = 0
+
+    async def send(self, chat_id: int, text: Optional[str] = None,
+                   location: Optional[Location] = None) -> List[Answer]:
+        """
+        Sends an update to the bot as the user of chat chat_id, and waits for the handler to finish.
+        Args:
+            chat_id: chat of the user
+            text: message text, e.g. "/find pizza"
+            location: shared location
+        Returns:
+        List of the answers sent to chat_id while the update was handled.
+        """
+        self.next_update_id += 1
+        update = Update(self.next_update_id, Chat(chat_id), Message(text, location))
+        context = Context(self.bot, [], self.user_data.setdefault(chat_id, {}))
+        start = len(self.bot.answers)
+        if location is not None:
+            await self.location_handler(update, context)
+        elif text is not None and text.startswith("/"):
+            words = text.split()
+            command = words[0][1:]
+            context.args = words[1:]
+            if command in self.commands:
+                await self.commands[command](update, context)
+        return [a for a in self.bot.answers[start:] if a.chat_id == chat_id]
+
+
+def bot_telegram(bot_module: Any, latency: float = 0.0) -> FakeTelegram:
+    """
+    Builds the stand-in with the handlers of the bot module.
+    Args:
+        bot_module: the imported bot module
+        latency: time in seconds each call to the API takes
+    Returns:
+    FakeTelegram routing updates to the handlers of the bot.
+    """
+    commands = {name: getattr(bot_module, name) for name in ["start", "help", "find", "info", "guide", "author",
+                                                                "profile"]}
+    return FakeTelegram(commands, bot_module.where, latency)
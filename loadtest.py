@@ -0,0 +1,246 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+from dataclasses import dataclass, field
+from typing import List, Dict, Tuple, Any #type: ignore
+
+import fake_telegram as ft
+
+# Load generator for the bot: simulated users share their location somewhere in Barcelona and then send commands
+# one after the other (searches, information and directions), waiting a bit between them like real users do. The
+# updates go through the local stand-in of the Telegram API (see fake_telegram.py), so the handlers of bot.py run
+# exactly as they would in production, and the time from each update to its last answer is measured.
+
+# Places many users are around (longitude, latitude), and the spread of their positions around them in degrees.
+HOTSPOTS: List[Tuple[float, float]] = [(2.1700, 41.3870),  # Plaça de Catalunya
+                                       (2.1744, 41.4036),  # Sagrada Família
+                                       (2.1589, 41.3809),  # Sant Antoni
+                                       (2.1530, 41.4010),  # Gràcia
+                                       (2.1980, 41.4030),  # Poblenou
+                                       (2.1340, 41.3870),  # Les Corts
+                                       (2.1830, 41.3820)]  # Born
+HOTSPOT_SPREAD = 0.01
+
+# Queries of the simulated /find commands.
+QUERIES = ["pizza", "sushi", "bar", "restaurant", "tapas", "Gràcia", "Sagrada", "Hamburgueseria", "Poblenou", "cafe"]
+
+# Default share of each command among the requests of the users. "where" shares a new location.
+DEFAULT_MIX = {"find": 0.4, "info": 0.2, "guide": 0.3, "where": 0.1}
+
+# Answers that mean the request wasn't served: rejected by the concurrency limits of the bot or failed.
+REJECTED_ANSWER = "Please retry in a few seconds."
+ERROR_ANSWERS = ["We are experiencing technical difficulties.", "No restaurants match your search!"]
+
+
+@dataclass
+class Sample:
+    command: str
+    start: float  # time.perf_counter() when the update was sent
+    latency: float  # seconds until the handler finished
+    outcome: str  # "ok", "rejected" or "error"
+
+
+@dataclass
+class LoadTest:
+    users: int  # number of simulated users, each one sending a command after the other
+    duration: float  # seconds users keep sending commands
+    mix: Dict[str, float] = field(default_factory=lambda: dict(DEFAULT_MIX))  # share of each command
+    think: float = 1.0  # mean seconds a user waits between commands
+    seed: int = 0
+    samples: List[Sample] = field(default_factory=list)
+
+
+def random_position(rnd: random.Random) -> ft.Location:
+    """
+    Picks the position of a user around one of the HOTSPOTS.
+    Args:
+        rnd: random generator
+    Returns:
+    Location of the user.
+    """
+    lon, lat = rnd.choice(HOTSPOTS)
+    return ft.Location(lon + rnd.gauss(0, HOTSPOT_SPREAD), lat + rnd.gauss(0, HOTSPOT_SPREAD))
+
+
+def outcome(answers: List[ft.Answer]) -> str:
+    """
+    Classifies the answers to an update.
+    Args:
+        answers: answers sent to the user while the update was handled
+    Returns:
+    "rejected" if the bot asked to retry, "error" if it failed, "ok" otherwise.
+    """
+    for a in answers:
+        if a.text is not None and a.text.endswith(REJECTED_ANSWER):
+            return "rejected"
+        if a.text is not None and any(a.text.startswith(e) for e in ERROR_ANSWERS):
+            return "error"
+    return "ok"
+
+
+async def simulate_user(t: LoadTest, tg: ft.FakeTelegram, chat_id: int, deadline: float) -> None:
+    """
+    Sends the commands of one user until the deadline: first the location, then commands picked according to the
+    mix of the test, and records how long each one takes.
+    Args:
+        t: LoadTest, its samples are appended to
+        tg: FakeTelegram the updates are sent through
+        chat_id: chat of the user
+        deadline: time.perf_counter() when the user stops
+    """
+    rnd = random.Random(t.seed * 1000003 + chat_id)
+    commands = list(t.mix)
+    weights = [t.mix[c] for c in commands]
+    command = "where"
+    while time.perf_counter() < deadline:
+        if command == "where":
+            update = {"location": random_position(rnd)}
+        elif command == "find":
+            update = {"text": "/find " + rnd.choice(QUERIES)}
+        else:
+            update = {"text": "/" + command + " " + str(rnd.randint(1, 10))}
+        start = time.perf_counter()
+        try:
+            result = outcome(await tg.send(chat_id, **update))
+        except Exception as e:
+            print(e)
+            result = "error"
+        t.samples.append(Sample(command, start, time.perf_counter() - start, result))
+        await asyncio.sleep(rnd.expovariate(1 / t.think) if t.think > 0 else 0)
+        command = rnd.choices(commands, weights)[0]
+
+
+async def run(t: LoadTest, tg: ft.FakeTelegram) -> None:
+    """
+    Runs the load test: all its users send commands at once for its duration.
+    Args:
+        t: LoadTest
+        tg: FakeTelegram the updates are sent through
+    """
+    deadline = time.perf_counter() + t.duration
+    await asyncio.gather(*(simulate_user(t, tg, chat_id, deadline) for chat_id in range(1, t.users + 1)))
+
+
+async def run_loaded(t: LoadTest, tg: ft.FakeTelegram, bot: Any) -> float:
+    """
+    Runs the load test once the bot has loaded its data, so that the time it takes to load it in the background
+    isn't measured as the latency of the first requests.
+    Args:
+        t: LoadTest
+        tg: FakeTelegram the updates are sent through
+        bot: bot module, see bot.loaded
+    Returns:
+    Seconds the test took, without the loading.
+    """
+    await bot.loaded("restaurants")
+    await bot.loaded("city")
+    start = time.perf_counter()
+    await run(t, tg)
+    return time.perf_counter() - start
+
+
+def summarize(samples: List[Sample], seconds: float) -> Dict[str, float]:
+    """
+    Summarizes the requests of a load test.
+    Args:
+        samples: requests of the test
+        seconds: duration of the test
+    Returns:
+    Dictionary with the number of requests, the throughput in requests per second, the p50, p95, p99 and max
+    latency in milliseconds of the served ones, and the rates of rejected and failed requests.
+    """
+    served = [s.latency for s in samples if s.outcome == "ok"] or [0.0]
+    p50, p95, p99 = np.percentile(served, [50, 95, 99]) * 1000
+    n = max(len(samples), 1)
+    return {"requests": len(samples), "throughput_rps": len(samples) / seconds,
+            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": max(served) * 1000,
+            "rejected_rate": sum(s.outcome == "rejected" for s in samples) / n,
+            "error_rate": sum(s.outcome == "error" for s in samples) / n}
+
+
+def report(t: LoadTest, seconds: float) -> Dict[str, Any]:
+    """
+    Reports the results of a load test, overall and per command.
+    Args:
+        t: LoadTest that has been run
+        seconds: time it took
+    Returns:
+    Dictionary with the parameters of the test, its overall summary and the summary of each command, see summarize.
+    """
+    return {"parameters": {"users": t.users, "duration": t.duration, "mix": t.mix, "think": t.think, "seed": t.seed},
+            "overall": summarize(t.samples, seconds),
+            "commands": {c: summarize([s for s in t.samples if s.command == c], seconds)
+                         for c in DEFAULT_MIX if any(s.command == c for s in t.samples)}}
+
+
+def format_report(r: Dict[str, Any]) -> str:
+    """
+    Formats the report of a load test as a table.
+    Returns:
+    String with a line per command and one for all of them.
+    """
+    lines = ["%-8s %8s %8s %9s %9s %9s %9s %9s" % ("command", "requests", "req/s", "p50 ms", "p95 ms", "p99 ms",
+                                                   "rejected", "errors")]
+    for name, stats in list(r["commands"].items()) + [("all", r["overall"])]:
+        lines.append("%-8s %8d %8.2f %9.1f %9.1f %9.1f %8.1f%% %8.1f%%"
+                     % (name, stats["requests"], stats["throughput_rps"], stats["p50_ms"], stats["p95_ms"],
+                        stats["p99_ms"], stats["rejected_rate"] * 100, stats["error_rate"] * 100))
+    return "\n".join(lines)
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """
+    Parses a query mix such as "find=0.5,guide=0.5".
+    Returns:
+    Dictionary with the share of each command.
+    Raises ValueError if a command isn't one of DEFAULT_MIX.
+    """
+    mix = {}
+    for item in text.split(","):
+        command, share = item.split("=")
+        if command not in DEFAULT_MIX:
+            raise ValueError("Unknown command " + command + ", expected one of " + ", ".join(DEFAULT_MIX) + ".")
+        mix[command] = float(share)
+    return mix
+
+
+def main() -> None:
+    """
+    Runs a load test against the bot, loading its graph and starting its worker processes as bot.py does.
+    """
+    parser = argparse.ArgumentParser(description="Load test of the bot with simulated users.")
+    parser.add_argument("--users", type=int, default=20, help="number of simulated users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds users keep sending commands")
+    parser.add_argument("--mix", type=parse_mix, default=dict(DEFAULT_MIX),
+                        help="share of each command, e.g. find=0.4,info=0.2,guide=0.3,where=0.1")
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds users wait between commands")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each call to the Telegram API takes")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="worker processes for /guide (default: GUIDE_PROCESSES of the bot)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the simulated users")
+    parser.add_argument("--output", help="JSON file the report is written to")
+    parser.add_argument("--stages", action="store_true", help="also print the latency of each stage, see metrics.py")
+    args = parser.parse_args()
+    import bot
+    import metrics
+    import workers
+    processes = bot.GUIDE_PROCESSES if args.processes is None else args.processes
+    if processes > 0:
+        bot.guide_pool = workers.start_workers("city_graph", processes)
+    t = LoadTest(args.users, args.duration, args.mix, args.think, args.seed)
+    r = report(t, asyncio.run(run_loaded(t, ft.bot_telegram(bot, args.latency), bot)))
+    print(format_report(r))
+    if args.stages:
+        print(metrics.report())
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(r, f, indent=2)
+    if bot.guide_pool is not None:
+        bot.guide_pool.shutdown()
+
+
+if __name__ == "__main__":
+    main()
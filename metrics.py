@@ -0,0 +1,251 @@
+import time
+import json
+import inspect
+import functools
+import threading
+import contextlib
+import numpy as np
+from dataclasses import dataclass, field
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Callable, Any #type: ignore
+from typing_extensions import TypeAlias
+
+# Latency of each stage of the commands of the bot (snapping, routing, rendering, uploading...): every time a stage
+# runs, its duration is recorded in a rolling histogram of its last WINDOW samples, from which its percentiles are
+# computed when they are reported. While ENABLED is False nothing is recorded, and instrumented code only pays for
+# checking it.
+
+# Whether durations are recorded.
+ENABLED = False
+
+# Number of last samples of each stage its percentiles are computed from.
+WINDOW = 1024
+
+# Percentiles reported for each stage.
+PERCENTILES = (50, 95, 99)
+
+# Durations in seconds of each stage, as returned by drain.
+Samples: TypeAlias = Dict[str, List[float]]
+
+
+@dataclass
+class Histogram:
+    samples: np.ndarray = field(default_factory=lambda: np.zeros(WINDOW))  # ring buffer of the last durations
+    count: int = 0  # number of durations recorded, even the ones no longer in samples
+    total: float = 0.0  # sum of the durations recorded
+    max: float = 0.0
+
+
+@dataclass
+class Registry:
+    histograms: Dict[str, Histogram] = field(default_factory=dict)
+    counters: Dict[str, int] = field(default_factory=dict)  # e.g. errors or cache hits
+    lock: threading.Lock = field(default_factory=threading.Lock)  # stages run in several threads at once
+
+
+# Registry of the current process.
+registry = Registry()
+
+
+def record(stage: str, seconds: float) -> None:
+    """
+    Records a duration of a stage.
+    Args:
+        stage: name of the stage, e.g. "plot_path"
+        seconds: its duration
+    """
+    with registry.lock:
+        h = registry.histograms.get(stage)
+        if h is None:
+            h = registry.histograms[stage] = Histogram()
+        h.samples[h.count % WINDOW] = seconds
+        h.count += 1
+        h.total += seconds
+        h.max = max(h.max, seconds)
+
+
+def count(counter: str, n: int = 1) -> None:
+    """
+    Adds n to a counter, if ENABLED.
+    Args:
+        counter: name of the counter, e.g. "guide.errors"
+        n: number added
+    """
+    if ENABLED:
+        with registry.lock:
+            registry.counters[counter] = registry.counters.get(counter, 0) + n
+
+
+@contextlib.contextmanager
+def measuring(name: str):
+    """
+    Context manager that records the duration of its block as a stage, see stage.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def stage(name: str) -> contextlib.AbstractContextManager:
+    """
+    Context manager that records the duration of its block as a stage, if ENABLED.
+    Args:
+        name: name of the stage
+    Returns:
+    Context manager.
+    """
+    if not ENABLED:
+        return contextlib.nullcontext()
+    return measuring(name)
+
+
+def measured(name: str) -> Callable:
+    """
+    Decorator that records the duration of every call of a function (or of an async function, until it finishes)
+    as a stage, if ENABLED.
+    Args:
+        name: name of the stage
+
+    Returns:
+    Decorator for functions and async functions.
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not ENABLED:
+                    return await func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    record(name, time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def drain() -> Samples:
+    """
+    Takes the durations recorded in the current process since the last call, e.g. in a worker process, to merge them
+    into the registry of the bot.
+    Returns:
+    Samples with the durations of each stage (at most WINDOW of them), oldest first.
+    """
+    with registry.lock:
+        histograms, registry.histograms = registry.histograms, {}
+    return {name: np.roll(h.samples, -h.count)[-min(h.count, WINDOW):].tolist() for name, h in histograms.items()}
+
+
+def merge(samples: Samples) -> None:
+    """
+    Records durations taken by drain.
+    Args:
+        samples: durations of each stage
+    """
+    for name, durations in samples.items():
+        for seconds in durations:
+            record(name, seconds)
+
+
+def summary() -> Dict[str, Dict[str, float]]:
+    """
+    Summarizes the histograms of all the stages.
+    Returns:
+    Dictionary from stage name to its count, mean, max and PERCENTILES ("p50", "p95"...) in seconds, computed from
+    its last WINDOW durations.
+    """
+    with registry.lock:
+        histograms = {name: (h.samples[:min(h.count, WINDOW)].copy(), h.count, h.total, h.max)
+                      for name, h in registry.histograms.items()}
+    stages = {}
+    for name, (samples, n, total, longest) in sorted(histograms.items()):
+        stats = {"count": n, "mean": total / n, "max": longest}
+        for p, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES)):
+            stats["p" + str(p)] = float(value)
+        stages[name] = stats
+    return stages
+
+
+def report() -> str:
+    """
+    Formats the summary of the stages and the counters as a table, for the logs.
+    Returns:
+    String with a line per stage and per counter, durations in milliseconds.
+    """
+    lines = ["%-24s %8s %9s %9s %9s %9s %9s" % ("stage", "count", "mean ms", "p50 ms", "p95 ms", "p99 ms", "max ms")]
+    for name, stats in summary().items():
+        lines.append("%-24s %8d %9.2f %9.2f %9.2f %9.2f %9.2f"
+                     % (name, stats["count"], stats["mean"] * 1000, stats["p50"] * 1000, stats["p95"] * 1000,
+                        stats["p99"] * 1000, stats["max"] * 1000))
+    for name, n in sorted(registry.counters.items()):
+        lines.append("%-24s %8d" % (name, n))
+    return "\n".join(lines)
+
+
+def exposition() -> str:
+    """
+    Formats the summary of the stages and the counters in the Prometheus text format, for scrapers.
+    Returns:
+    String with the metrics, durations in seconds.
+    """
+    lines = ["# TYPE stage_seconds summary"]
+    for name, stats in summary().items():
+        for p in PERCENTILES:
+            lines.append('stage_seconds{stage="%s",quantile="%s"} %.9f' % (name, p / 100, stats["p" + str(p)]))
+        lines.append('stage_seconds_sum{stage="%s"} %.9f' % (name, stats["mean"] * stats["count"]))
+        lines.append('stage_seconds_count{stage="%s"} %d' % (name, stats["count"]))
+    lines.append("# TYPE events_total counter")
+    for name, n in sorted(registry.counters.items()):
+        lines.append('events_total{event="%s"} %d' % (name, n))
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Serves /metrics in the Prometheus text format and /metrics.json with the summary and the counters.
+    """
+
+    def do_GET(self) -> None:
+        if self.path == "/metrics":
+            body, content_type = exposition().encode(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, content_type = json.dumps({"stages": summary(), "counters": registry.counters}).encode(), \
+                "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serves the metrics over HTTP in a background thread, only to the local machine by default.
+    Args:
+        port: port of the endpoint
+        host: address the endpoint listens on
+    Returns:
+    ThreadingHTTPServer, stopped with its shutdown method.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
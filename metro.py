@@ -1,24 +1,36 @@
+import os
+import sys
 import pandas as pd
+import numpy as np
 from typing import List, Tuple, Dict, Any #type: ignore
 from dataclasses import dataclass #type: ignore
 import networkx #type: ignore
 from haversine import haversine #type: ignore
-import matplotlib.pyplot as plt #type: ignore
 from typing_extensions import TypeAlias
-from staticmap import StaticMap, CircleMarker, Line #type: ignore
 
+# matplotlib and staticmap are only needed to show and plot graphs, so they are imported by the functions that do,
+# the first time they are called, instead of slowing down every import of this module.
 
+# Directory of the bundled databases, found next to the code (and with its exact case) wherever it is run from.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+
+
+# Records are slotted (no __dict__ per instance), since the CityGraph holds one Edge per edge. Strings repeated
+# among them (lines, colors, types, station names) are interned so that every record shares the same objects.
 @dataclass
 class Station:
+    __slots__ = ("name", "line", "order", "pos", "id", "accessibility")
     name: str
     line: str
     order: int
     pos: Tuple[float, float]
     id: int
+    accessibility: bool
 
 
 @dataclass
 class Access:
+    __slots__ = ("name", "accessibility", "station_name", "pos", "id")
     name: str
     accessibility: bool
     station_name: str
@@ -28,6 +40,7 @@ class Access:
 
 @dataclass
 class Edge:
+    __slots__ = ("type", "color", "distance")
     type: str
     color: str
     distance: float
@@ -41,6 +54,10 @@ MetroGraph: TypeAlias = networkx.Graph
 
 Coord: TypeAlias = Tuple[float, float]  # (longitude, latitude)
 
+# Speed in km/h of each way of transportation. This dictionary can be scaled once we implement new ways of
+# transportation in the project, speeds can also be changed.
+METHOD_TO_SPEED = {"walk": 5, "metro": 30}
+
 
 def is_station(name: Any, line: Any, order: Any, pos: Any, station_id: Any) -> bool:
     """
@@ -95,47 +112,103 @@ def edge_to_color(edge_info: str) -> str:
     return e_to_c[edge_info]
 
 
-def needed_time_h(p1: Coord, p2: Coord, method: str) -> float:
+def speed_and_delay(method: str) -> Tuple[float, float]:
     """
-    Returns the given time in hours that is needed to go from p1 to p2 by the method given.
+    Returns the speed and the fixed time delay of the given way of transportation.
     Args:
-        p1: coordinates of the src
-        p2: coordinates of the dst
-        method: way of transportation considered (either "walk" or "metro" are implemented for now)
+        method: way of transportation considered ("walk", "metro", "acces" or "link")
 
     Returns:
-    Float with the time in hours needed to go from p1 to p2 using method.
+    Tuple with the speed in km/h and the delay in hours.
     """
     m = method
     t_delay: float = 0
     if m == "acces" or m == "link":
         t_delay = 0.05
         m = "walk"
-    method_to_speed = {"walk": 5, "metro": 30}
-    # This dictionary can be scaled once we implement new ways of transportation in the project.
-    # Speed in km/h for method can also be changed
     # t_delay is the time delay in hours to go from an access to the street, or from time needed to use a link.
-    speed = method_to_speed[m]
+    return METHOD_TO_SPEED[m], t_delay
+
+
+def needed_time_h(p1: Coord, p2: Coord, method: str) -> float:
+    """
+    Returns the given time in hours that is needed to go from p1 to p2 by the method given.
+    Args:
+        p1: coordinates of the src
+        p2: coordinates of the dst
+        method: way of transportation considered (either "walk" or "metro" are implemented for now)
+
+    Returns:
+    Float with the time in hours needed to go from p1 to p2 using method.
+    """
+    speed, t_delay = speed_and_delay(method)
     return haversine(p1, p2) / speed + t_delay
 
 
+def haversine_array(p1: np.ndarray, p2: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of haversine, computes the distances in km between arrays of coordinates at once.
+    Coordinates are taken in the same order as in the rest of the project, so the result is exactly the one that
+    haversine gives for each pair of points.
+    Args:
+        p1: array of shape (n, 2) or (2,) with coordinates
+        p2: array of shape (n, 2) or (2,) with coordinates
+
+    Returns:
+    Array with the distance in km between each pair of points.
+    """
+    p1 = np.radians(np.asarray(p1, dtype=np.float64))
+    p2 = np.radians(np.asarray(p2, dtype=np.float64))
+    a1, b1 = p1[..., 0], p1[..., 1]
+    a2, b2 = p2[..., 0], p2[..., 1]
+    d = np.sin((a2 - a1) * 0.5) ** 2 + np.cos(a1) * np.cos(a2) * np.sin((b2 - b1) * 0.5) ** 2
+    return 2 * 6371.0088 * np.arcsin(np.sqrt(d))
+
+
+def weighted_edges(nodes1: List, nodes2: List, p1: np.ndarray, p2: np.ndarray, edge_type: str, colors: List[str],
+                   method: str) -> List[Tuple]:
+    """
+    Computes the distances and travel times of many edges at once, ready to be added with add_edges_from.
+    Args:
+        nodes1: first node of each edge
+        nodes2: second node of each edge
+        p1: array of shape (n, 2) with the coordinates of nodes1
+        p2: array of shape (n, 2) with the coordinates of nodes2
+        edge_type: type of the edges
+        colors: color of each edge
+        method: way of transportation considered, see needed_time_h
+
+    Returns:
+    List of (node1, node2, attributes) with the info and weight of each edge.
+    """
+    if len(nodes1) == 0:
+        return []
+    speed, t_delay = speed_and_delay(method)
+    distances = haversine_array(np.asarray(p1).reshape(-1, 2), np.asarray(p2).reshape(-1, 2))
+    times = (distances / speed + t_delay).tolist()
+    distances = distances.tolist()
+    return [(nodes1[i], nodes2[i], {'info': Edge(edge_type, colors[i], distances[i]), 'weight': times[i]})
+            for i in range(len(nodes1))]
+
+
 def read_stations() -> Stations:
     """
     Reads cleaned stations from database, i.e. removing missing values, incomplete and incorrect stations.
     Returns:
     List of stations present in the database.
     """
-    df = pd.read_csv("data/estacions.csv")
+    df = pd.read_csv(os.path.join(DATA_DIR, "estacions.csv"))
     stations = []
     for station in df.itertuples():
-        name = station.NOM_ESTACIO
-        line = station.NOM_LINIA
+        name = sys.intern(station.NOM_ESTACIO) if type(station.NOM_ESTACIO) == str else station.NOM_ESTACIO
+        line = sys.intern(station.NOM_LINIA) if type(station.NOM_LINIA) == str else station.NOM_LINIA
         order = station.ORDRE_ESTACIO
         station_id = station.CODI_ESTACIO_LINIA
+        accessibility = (station.ID_TIPUS_ACCESSIBILITAT == 1)
         point = station.GEOMETRY[7:-1]
         pos = (float(point.split(' ')[0]), float(point.split(' ')[1]))
         if is_station(name, line, order, pos, station_id):
-            stations.append(Station(name, line, order, pos, station_id))
+            stations.append(Station(name, line, order, pos, station_id, accessibility))
     return stations
 
 
@@ -145,7 +218,7 @@ def read_accesses() -> Accesses:
     Returns:
     List of accesses present in the database.
     """
-    df = pd.read_csv("data/accessos.csv")
+    df = pd.read_csv(os.path.join(DATA_DIR, "accessos.csv"))
     accesses = []
     for access in df.itertuples():
         name = access.NOM_ACCES
@@ -153,7 +226,7 @@ def read_accesses() -> Accesses:
         accessibility = (id_accessibility == 1)
         point = access.GEOMETRY[7:-1]
         pos = (float(point.split(' ')[0]), float(point.split(' ')[1]))
-        station_name = access.NOM_ESTACIO
+        station_name = sys.intern(access.NOM_ESTACIO) if type(access.NOM_ESTACIO) == str else access.NOM_ESTACIO
         access_id = access.CODI_ACCES
         accesses.append(Access(name, accessibility, station_name, pos, access_id))
     return accesses
@@ -171,18 +244,20 @@ def add_stations(stations: Stations, metro: MetroGraph) -> Dict:
     """
     prev_station = None
     access_to_stations: Dict[str, Stations] = {}
+    trams: List[Tuple[Station, Station]] = []
     for station in stations:
         metro.add_node(station.id, info=station,
                        pos=station.pos, type="Station")
         if prev_station is not None and prev_station.line == station.line:
-            metro.add_edge(station.id, prev_station.id, info=Edge("Tram", edge_to_color(station.line),
-                                                                  haversine(station.pos, prev_station.pos)),
-                           weight=needed_time_h(station.pos, prev_station.pos, "metro"))
+            trams.append((station, prev_station))
         prev_station = station
         if station.name in access_to_stations.keys():
             access_to_stations[station.name] += [station]
         else:
             access_to_stations[station.name] = [station]
+    metro.add_edges_from(weighted_edges([s1.id for s1, _ in trams], [s2.id for _, s2 in trams],
+                                        np.array([s1.pos for s1, _ in trams]), np.array([s2.pos for _, s2 in trams]),
+                                        "Tram", [edge_to_color(s1.line) for s1, _ in trams], "metro"))
     return access_to_stations
 
 
@@ -194,14 +269,16 @@ def add_accesses(accesses: List, access_to_stations: Dict, metro: MetroGraph) ->
         access_to_stations: dictionary, station.name as keys and list of stations accessible from it as values
         metro: metro graph
     """
+    links: List[Tuple[Access, Station]] = []
     for access in accesses:
         metro.add_node(access.id, info=access, pos=access.pos, type="Acces")
         station_name = access.station_name
         connections = access_to_stations[station_name]
         for station in connections:
-            metro.add_edge(access.id, station.id,
-                           info=Edge("Acces", edge_to_color("Acces"), haversine(access.pos, station.pos)),
-                           weight=needed_time_h(access.pos, station.pos, "acces"))
+            links.append((access, station))
+    metro.add_edges_from(weighted_edges([a.id for a, _ in links], [s.id for _, s in links],
+                                        np.array([a.pos for a, _ in links]), np.array([s.pos for _, s in links]),
+                                        "Acces", [edge_to_color("Acces")] * len(links), "acces"))
 
 
 def connect_stations(access_to_stations: Dict, metro: MetroGraph) -> None:
@@ -211,15 +288,16 @@ def connect_stations(access_to_stations: Dict, metro: MetroGraph) -> None:
         access_to_stations: dictionary, station.name as keys and list of stations accessible from it as values
         metro: metro graph
     """
+    links: List[Tuple[Station, Station]] = []
     for station_name in access_to_stations.keys():
         list_stations = access_to_stations[station_name]
         n = len(list_stations)
         for i in range(n - 1):
             for j in range(i + 1, n):
-                metro.add_edge(list_stations[i].id, list_stations[j].id,
-                               info=Edge("Link", edge_to_color("Link"),
-                                         haversine(list_stations[i].pos, list_stations[j].pos)),
-                               weight=needed_time_h(list_stations[i].pos, list_stations[j].pos, "link"))
+                links.append((list_stations[i], list_stations[j]))
+    metro.add_edges_from(weighted_edges([s1.id for s1, _ in links], [s2.id for _, s2 in links],
+                                        np.array([s1.pos for s1, _ in links]), np.array([s2.pos for _, s2 in links]),
+                                        "Link", [edge_to_color("Link")] * len(links), "link"))
 
 
 def get_metro_graph() -> MetroGraph:
@@ -244,6 +322,7 @@ def metro_show(g: MetroGraph) -> None:
     Args:
         g: MetroGraph being drawn
     """
+    import matplotlib.pyplot as plt #type: ignore
     networkx.draw(g, with_labels=False, node_size=25,
             pos=networkx.get_node_attributes(g, "pos"))
     plt.show()
@@ -257,6 +336,7 @@ def metro_plot(g: MetroGraph, filename: str) -> None:
         filename: determines path where image is saved
     Note: The file is saved as filename.png, if you can't open .png extensions consider an online converter.
     """
+    from staticmap import StaticMap, CircleMarker, Line #type: ignore
     new_map = StaticMap(500, 500)
     for node in g.nodes():
         new_map.add_marker(CircleMarker((g.nodes[node]['pos']), 'red', 3))
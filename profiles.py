@@ -0,0 +1,121 @@
+import dataclasses
+import numpy as np
+from typing import Dict, Union, Set #type: ignore
+from typing_extensions import TypeAlias
+
+from metro import METHOD_TO_SPEED
+from snapshot import CitySnapshot, EDGE_KINDS
+from routing import Router
+from schedule import TimedRouter
+
+# Routing profiles: ways of getting around the same CityGraph that use or weigh its edges differently. Each profile
+# is an array with a factor for every edge of the snapshot (in CSR order) that its time is multiplied by to give
+# its cost, inf for the edges the profile can't use. Routers of every profile are built once and share all their
+# arrays but the weights, so switching profile per request costs nothing.
+
+NodeID: TypeAlias = Union[int, str]
+
+PROFILES = ("default", "step-free", "walk-only", "metro-preferred")
+
+DEFAULT_PROFILE = "default"
+
+# Factor walking times are multiplied by in the metro-preferred profile: a walk is only taken instead of the metro
+# if it is that many times faster.
+METRO_PREFERRED_WALK_FACTOR = 1.5
+
+
+def profile_factors(s: CitySnapshot, inaccessible: Set[NodeID]) -> Dict[str, np.ndarray]:
+    """
+    Computes the factors of the edges of the snapshot for each profile of PROFILES:
+    "default" uses every edge as it is, "step-free" can't enter or leave the metro through accesses or stations
+    that aren't accessible, nor change lines at those stations, but can stay on a train through them, "walk-only"
+    can only walk along streets and "metro-preferred" weighs walks by METRO_PREFERRED_WALK_FACTOR.
+    Args:
+        s: CitySnapshot of the city
+        inaccessible: accesses and stations that aren't accessible with a wheelchair
+    Returns:
+    Dictionary from profile name to the array of factors of its edges.
+    """
+    ids = s.ids.tolist()
+    blocked = np.array([node in inaccessible for node in ids], dtype=bool)
+    src = np.repeat(np.arange(len(ids)), np.diff(np.asarray(s.indptr)))
+    dst = np.asarray(s.indices)
+    kinds = np.asarray(s.kinds)
+    street = kinds == EDGE_KINDS.index("Street")
+    # Only the edges between an access and its platforms and between the platforms of a station need steps, the
+    # trains between stations don't.
+    steps = (kinds == EDGE_KINDS.index("Acces")) | (kinds == EDGE_KINDS.index("Link"))
+    inf = float("inf")
+    return {"default": np.ones(len(dst)),
+            "step-free": np.where(steps & (blocked[src] | blocked[dst]), inf, 1.0),
+            "walk-only": np.where(street, 1.0, inf),
+            "metro-preferred": np.where(street, METRO_PREFERRED_WALK_FACTOR, 1.0)}
+
+
+def is_mask(factors: np.ndarray) -> bool:
+    """
+    Tells whether the factors of a profile only forbid edges, so that the costs of the rest are their times.
+    Returns:
+    True if every factor is 1 or inf.
+    """
+    return bool(np.all((factors == 1) | np.isinf(factors)))
+
+
+def profile_max_speed(s: CitySnapshot, factors: np.ndarray, max_speed: float) -> float:
+    """
+    Fastest speed among the edges a profile can use, for the heuristic of its searches: only walking, if the
+    profile can't use the metro.
+    Args:
+        s: CitySnapshot of the city
+        factors: factors of the edges of the profile
+        max_speed: fastest speed among all the edges
+    Returns:
+    Float with the speed in km/h.
+    """
+    if np.all(np.isinf(factors[np.asarray(s.kinds) != EDGE_KINDS.index("Street")])):
+        return METHOD_TO_SPEED["walk"]
+    return max_speed
+
+
+def profile_routers(s: CitySnapshot, r: Router, factors: Dict[str, np.ndarray]) -> Dict[str, Router]:
+    """
+    Builds the Router of each profile from the Router of the snapshot.
+    Args:
+        s: CitySnapshot of the city
+        r: Router of s
+        factors: factors of the edges of each profile, see profile_factors
+    Returns:
+    Dictionary from profile name to its Router, sharing the adjacency of r.
+    """
+    routers = {}
+    weights = np.asarray(r.weights)
+    for name, f in factors.items():
+        if np.all(f == 1):
+            routers[name] = r
+            continue
+        # Forbidden edges weigh inf, even the ones of no length.
+        routers[name] = dataclasses.replace(r, weights=memoryview(np.where(np.isinf(f), np.inf, weights * f)),
+                                            times=None if is_mask(f) else r.weights,
+                                            max_speed=profile_max_speed(s, f, r.max_speed))
+    return routers
+
+
+def profile_timed_routers(s: CitySnapshot, tr: TimedRouter, factors: Dict[str, np.ndarray]) -> Dict[str, TimedRouter]:
+    """
+    Builds the TimedRouter of each profile from the TimedRouter of the snapshot.
+    Args:
+        s: CitySnapshot of the city
+        tr: TimedRouter of s
+        factors: factors of the edges of each profile, see profile_factors
+    Returns:
+    Dictionary from profile name to its TimedRouter, sharing the adjacency and the waits of tr.
+    """
+    routers = {}
+    for name, f in factors.items():
+        if np.all(f == 1):
+            routers[name] = tr
+            continue
+        routers[name] = dataclasses.replace(tr, factors=memoryview(np.ascontiguousarray(f, dtype=np.float64)),
+                                            max_speed=profile_max_speed(s, f, tr.max_speed))
+    return routers
+
@@ -0,0 +1,255 @@
+import io
+import os
+import sys
+import math
+import functools
+import threading
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Tuple, Set, Optional #type: ignore
+from typing_extensions import TypeAlias
+from PIL import Image #type: ignore
+
+# Map rendering without downloading the background of every map: tiles are kept in a directory on disk (fetched
+# once from a tile server, or copied from a local tile directory) and stitched base layers are kept in memory, so
+# rendering a map only pastes a base layer and draws the path over it.
+
+TILE_SIZE = 256
+
+# Where missing tiles are fetched from. It can be a local tile directory as well, with a url like
+# "file:///srv/tiles/{z}/{x}/{y}.png", or a tile server of our own.
+TILE_URL = "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"
+
+TILE_DIR = "tiles"
+
+# Number of tiles fetched at once.
+FETCH_THREADS = 4
+
+# zlib compression level of the maps, from 0 (none, fastest) to 9 (smallest, slowest).
+PNG_COMPRESS_LEVEL = 6
+
+# (min longitude, min latitude, max longitude, max latitude) of Barcelona, the tiles seeded by default.
+BARCELONA = (2.05, 41.32, 2.23, 41.47)
+
+TileKey: TypeAlias = Tuple[int, int, int]  # (zoom, x, y)
+
+LayerKey: TypeAlias = Tuple[int, int, int, int, int]  # (zoom, min x, min y, max x, max y), max excluded
+
+
+@dataclass
+class TileCache:
+    directory: str  # tiles are stored as directory/zoom/x/y.png
+    url_template: Optional[str]  # where missing tiles are fetched from, None to work offline
+    timeout: float = 5.0  # seconds to wait for a tile
+    capacity: int = 32  # number of base layers kept in memory
+    background: str = "#fff"  # color of the tiles that are missing
+    layers: "OrderedDict[LayerKey, Image.Image]" = field(default_factory=OrderedDict)  # least recently used first
+    missing: Set[TileKey] = field(default_factory=set)  # tiles that couldn't be fetched, they aren't asked again
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def tile_path(c: TileCache, z: int, x: int, y: int) -> str:
+    """
+    Path of a tile in the directory of the cache.
+    Returns:
+    String with directory/z/x/y.png.
+    """
+    return os.path.join(c.directory, str(z), str(x), str(y) + ".png")
+
+
+def fetch_tile(c: TileCache, z: int, x: int, y: int) -> bool:
+    """
+    Fetches a tile from the tile server and stores it in the directory of the cache.
+    Args:
+        c: TileCache
+        z: zoom
+        x: x coordinate of the tile
+        y: y coordinate of the tile
+    Returns:
+    True if the tile was stored, False if it couldn't be fetched.
+    """
+    if c.url_template is None or (z, x, y) in c.missing:
+        return False
+    request = urllib.request.Request(c.url_template.format(z=z, x=x, y=y), headers={"User-Agent": "Food-bot"})
+    try:
+        with urllib.request.urlopen(request, timeout=c.timeout) as response:
+            data = response.read()
+        Image.open(io.BytesIO(data)).verify()
+    except Exception as e:
+        print(e)
+        c.missing.add((z, x, y))
+        return False
+    path = tile_path(c, z, x, y)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Written aside and renamed, as other processes may be reading the same tiles.
+    tmp = path + ".tmp" + str(os.getpid()) + "_" + str(threading.get_ident())
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+
+def get_tile(c: TileCache, z: int, x: int, y: int) -> Optional[Image.Image]:
+    """
+    Gives a tile, from the directory of the cache or else from the tile server.
+    Args:
+        c: TileCache
+        z: zoom
+        x: x coordinate of the tile
+        y: y coordinate of the tile
+    Returns:
+    RGBA image of the tile, None if it isn't available.
+    """
+    path = tile_path(c, z, x, y)
+    if not os.path.exists(path) and not fetch_tile(c, z, x, y):
+        return None
+    with Image.open(path) as tile:
+        return tile.convert("RGBA")
+
+
+def base_layer(c: TileCache, key: LayerKey) -> Image.Image:
+    """
+    Gives the background made of the given range of tiles, stitching it only the first time it is needed.
+    Args:
+        c: TileCache
+        key: zoom and range of tiles
+    Returns:
+    RGB image with the tiles of the range, the missing ones filled with the background color.
+    """
+    with c.lock:
+        layer = c.layers.get(key)
+        if layer is not None:
+            c.layers.move_to_end(key)
+            return layer
+    z, x_min, y_min, x_max, y_max = key
+    layer = Image.new("RGB", ((x_max - x_min) * TILE_SIZE, (y_max - y_min) * TILE_SIZE), c.background)
+    n = 2 ** z
+    cells = [(x, y) for x in range(x_min, x_max) for y in range(y_min, y_max)]
+    # Tiles that aren't on disk yet are fetched in parallel, as StaticMap does.
+    with ThreadPoolExecutor(FETCH_THREADS) as pool:
+        # x and y may have crossed the date line
+        found = pool.map(lambda cell: get_tile(c, z, (cell[0] + n) % n, (cell[1] + n) % n), cells)
+        for (x, y), tile in zip(cells, found):
+            if tile is not None:
+                layer.paste(tile, ((x - x_min) * TILE_SIZE, (y - y_min) * TILE_SIZE), tile)
+    with c.lock:
+        c.layers[key] = layer
+        while len(c.layers) > c.capacity:
+            c.layers.popitem(last=False)
+    return layer
+
+
+def to_tile(lon: float, lat: float, z: int) -> Tuple[int, int]:
+    """
+    Tile that contains the given coordinates, in the Web Mercator tiling of tile servers.
+    Returns:
+    Tuple with the x and y coordinates of the tile.
+    """
+    n = 2 ** z
+    rad = math.radians(lat)
+    return int((lon + 180) / 360 * n), int((1 - math.log(math.tan(rad) + 1 / math.cos(rad)) / math.pi) / 2 * n)
+
+
+def tile_range(bounds: Tuple[float, float, float, float], z: int) -> Tuple[int, int, int, int]:
+    """
+    Range of the tiles that cover the given bounds.
+    Args:
+        bounds: (min longitude, min latitude, max longitude, max latitude)
+        z: zoom
+    Returns:
+    Tuple with min x, min y, max x and max y of the tiles, max included.
+    """
+    x_min, y_min = to_tile(bounds[0], bounds[3], z)
+    x_max, y_max = to_tile(bounds[2], bounds[1], z)
+    return x_min, y_min, x_max, y_max
+
+
+def seed(c: TileCache, bounds: Tuple[float, float, float, float], zooms: List[int]) -> int:
+    """
+    Fetches all the tiles that cover the given bounds at the given zooms and aren't in the cache yet, so that maps
+    of that area can be rendered offline.
+    Args:
+        c: TileCache
+        bounds: (min longitude, min latitude, max longitude, max latitude)
+        zooms: zoom levels
+    Returns:
+    Int with the number of tiles fetched.
+    """
+    fetched = 0
+    for z in zooms:
+        x_min, y_min, x_max, y_max = tile_range(bounds, z)
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                if not os.path.exists(tile_path(c, z, x, y)) and fetch_tile(c, z, x, y):
+                    fetched += 1
+    return fetched
+
+
+@functools.lru_cache(maxsize=None)
+def cached_map_class() -> type:
+    """
+    Defines CachedMap the first time a map is drawn, so that staticmap is only imported by the processes that draw
+    maps, and only when they do.
+    Returns:
+    The CachedMap class.
+    """
+    from staticmap import StaticMap #type: ignore
+
+    class CachedMap(StaticMap):
+        """
+        StaticMap whose background is taken from a TileCache instead of being downloaded for every map.
+        Lines and markers are added and drawn as in StaticMap.
+        """
+
+        def __init__(self, width: int, height: int, tiles: TileCache) -> None:
+            super().__init__(width, height, tile_size=TILE_SIZE, background_color=tiles.background)
+            self.tiles = tiles
+
+        def _draw_base_layer(self, image: Image.Image) -> None:
+            # Same tiles as StaticMap, pasted at once from the base layer made of them.
+            x_min = int(math.floor(self.x_center - (0.5 * self.width / self.tile_size)))
+            y_min = int(math.floor(self.y_center - (0.5 * self.height / self.tile_size)))
+            x_max = int(math.ceil(self.x_center + (0.5 * self.width / self.tile_size)))
+            y_max = int(math.ceil(self.y_center + (0.5 * self.height / self.tile_size)))
+            layer = base_layer(self.tiles, (self.zoom, x_min, y_min, x_max, y_max))
+            image.paste(layer, (self._x_to_px(x_min), self._y_to_px(y_min)))
+
+    return CachedMap
+
+
+def cached_map(width: int, height: int, tiles: TileCache):
+    """
+    Creates a map whose background is taken from the TileCache, see cached_map_class.
+    Args:
+        width: width of the map in pixels
+        height: height of the map in pixels
+        tiles: TileCache the background is taken from
+    Returns:
+    CachedMap, a StaticMap lines and markers are added to.
+    """
+    return cached_map_class()(width, height, tiles)
+
+
+def to_png(image: Image.Image, compress_level: int = PNG_COMPRESS_LEVEL, scale: float = 1.0) -> bytes:
+    """
+    Encodes a rendered map as PNG, in memory.
+    Args:
+        image: rendered map
+        compress_level: zlib compression level, from 0 to 9
+        scale: factor the map is resized by, e.g. 0.5 for a map half as wide and high, smaller to upload
+    Returns:
+    Bytes of the PNG file, ready to be sent as a photo.
+    """
+    if scale != 1.0:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=compress_level)
+    return buffer.getvalue()
+
+
+if __name__ == "__main__":
+    # Seeds the tile directory with the tiles of Barcelona, from TILE_URL or the url template given as argument.
+    cache = TileCache(TILE_DIR, sys.argv[1] if len(sys.argv) > 1 else TILE_URL)
+    print(seed(cache, BARCELONA, list(range(12, 17))), "tiles fetched")
@@ -1,12 +1,21 @@
+import os
+import sys
+import numpy as np
 import pandas as pd
 from typing_extensions import TypeAlias
-from typing import List, Any
+from typing import List, Dict, Tuple, Optional, Any
 from dataclasses import dataclass
 from fuzzysearch import find_near_matches
 
+from spatial import SpatialIndex, NodeID, k_nearest
+
+# Directory of the bundled databases, see metro.DATA_DIR.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Data")
+
 
 @dataclass
 class Restaurant:
+    __slots__ = ("id", "name", "street", "coordinates", "street_num", "district", "neighbourhood", "tel")
     id: str
     name: str
     street: List  # name,id
@@ -20,6 +29,30 @@ class Restaurant:
 
 Restaurants: TypeAlias = List[Restaurant]
 
+# Length of the n-grams of the search index.
+NGRAM = 3
+
+# Maximum Levenshtein distance between the query and the matched text.
+MAX_L_DIST = 1
+
+# Maximum number of restaurants returned by a search.
+MAX_RESULTS = 10
+
+
+@dataclass
+class SearchIndex:
+    texts: List[str]  # searchable text of each restaurant, see search_text
+    name_lengths: List[int]  # length of the name at the beginning of each text, to rank matches in the name first
+    postings: Dict[str, List[int]]  # n-gram: positions of the restaurants whose text contains it
+
+
+@dataclass
+class Snapping:
+    fingerprint: str  # of the snapshot of the graph the restaurants are snapped to
+    nodes: Dict[str, NodeID]  # restaurant id: closest street node
+    offsets: Dict[str, float]  # restaurant id: distance in meters from the restaurant to its node, walked
+    coordinates: Dict[str, Tuple[float, float]]  # restaurant id: coordinates it was snapped from
+
 
 def is_restaurant(name: Any, coord: Any, rest_id: Any, street: Any, tel: Any, neighbourhood: Any, district: Any,
                   street_num: Any) -> bool:
@@ -43,6 +76,18 @@ def is_restaurant(name: Any, coord: Any, rest_id: Any, street: Any, tel: Any, ne
         district) == str and type(street_num) == float
 
 
+def search_text(r: Restaurant) -> str:
+    """
+    Text of the restaurant that is compared to the user search queries: its name, street and neighbourhood.
+    Args:
+        r: restaurant
+
+    Returns:
+    String with the searchable text of the restaurant.
+    """
+    return r.name + r.street[0] + r.neighbourhood + r.street[0]
+
+
 def is_match(query: str, r: Restaurant) -> bool:
     """
     Checks whether the user search query would match the specific restaurant, i.e. if
@@ -54,44 +99,210 @@ def is_match(query: str, r: Restaurant) -> bool:
     Returns:
     True if the restaurant matches the query, False otherwise.
     """
-    return find_near_matches(query, r.name + r.street[0] + r.neighbourhood + r.street[0], max_l_dist=1) != []
+    return find_near_matches(query, search_text(r), max_l_dist=MAX_L_DIST) != []
+
+
+def valid_rows(df: pd.DataFrame) -> pd.Series:
+    """
+    Vectorized version of is_restaurant: checks every row of the database at once.
+    Args:
+        df: restaurants database
+
+    Returns:
+    Boolean Series, True for the rows whose fields have the types of a restaurant.
+    """
+    valid = pd.Series(pd.api.types.is_float_dtype(df["addresses_start_street_number"]), index=df.index)
+    for column in ["register_id", "name", "addresses_road_name", "values_value", "addresses_neighborhood_name",
+                   "addresses_district_name"]:
+        # In string columns every value that is not missing is a str.
+        valid &= pd.api.types.is_string_dtype(df[column]) & df[column].notna()
+    return valid
 
 
 def read() -> Restaurants:
     """
-    Reads restaurants from the database.
+    Reads restaurants from the database. Rows are cleaned and deduplicated by register_id in a vectorized way,
+    keeping the first valid row of each restaurant.
     Returns:
     List of restaurants of the database, cleaned, i.e. no missing values, incorrect types
     """
-    df = pd.read_csv("data/restaurants.csv")
-    restaurants = []
-    for rest in df.itertuples():
-        rest_id = rest.register_id
-        name = rest.name
-        address = [rest.addresses_road_name, rest.addresses_road_id]
-        coord = [rest.geo_epgs_4326_y, rest.geo_epgs_4326_x]  # epgs fromat is lat,long and we are using long,lat.
-        tel = rest.values_value
-        distr = rest.addresses_district_name
-        nbr = rest.addresses_neighborhood_name
-        str_num = rest.addresses_start_street_number
-        r = Restaurant(rest_id, name, address, coord, str_num, distr, nbr, tel)
-        if r not in restaurants and is_restaurant(name, coord, rest_id, address, tel, nbr, distr, str_num):
-            restaurants.append(r)
-    return restaurants
-
-
-def find(query: str, restaurants: Restaurants) -> Restaurants:
-    """
-    Finds all restaurants from the database that relate to the query. See is_match to understand what similitude is.
+    df = pd.read_csv(os.path.join(DATA_DIR, "restaurants.csv"),
+                     usecols=["register_id", "name", "addresses_road_name", "addresses_road_id", "geo_epgs_4326_x",
+                              "geo_epgs_4326_y", "values_value", "addresses_district_name",
+                              "addresses_neighborhood_name", "addresses_start_street_number"])
+    df = df[valid_rows(df)].drop_duplicates(subset="register_id", keep="first")
+    columns = [df[column].tolist() for column in ["register_id", "name", "addresses_road_name", "addresses_road_id",
+                                                  "geo_epgs_4326_y", "geo_epgs_4326_x",
+                                                  "addresses_start_street_number", "addresses_district_name",
+                                                  "addresses_neighborhood_name", "values_value"]]
+    for i in [2, 7, 8]:
+        # Streets, districts and neighbourhoods are shared by many restaurants, interning keeps one copy of each.
+        columns[i] = [sys.intern(value) for value in columns[i]]
+    # epgs fromat is lat,long and we are using long,lat.
+    return [Restaurant(rest_id, name, [road_name, road_id], [y, x], str_num, distr, nbr, tel)
+            for rest_id, name, road_name, road_id, y, x, str_num, distr, nbr, tel in zip(*columns)]
+
+
+def build_index(restaurants: Restaurants) -> SearchIndex:
+    """
+    Builds the n-gram index of the restaurants, to be done once after read.
+    Args:
+        restaurants: list of all restaurants from the considered database.
+
+    Returns:
+    SearchIndex with the postings of every n-gram of the searchable text of the restaurants.
+    """
+    texts = [search_text(r) for r in restaurants]
+    postings: Dict[str, List[int]] = {}
+    for i, text in enumerate(texts):
+        for gram in {text[j:j + NGRAM] for j in range(len(text) - NGRAM + 1)}:
+            postings.setdefault(gram, []).append(i)
+    return SearchIndex(texts, [len(r.name) for r in restaurants], postings)
+
+
+def candidates(query: str, index: SearchIndex) -> List[int]:
+    """
+    Restaurants that may match the query. Each edit destroys at most NGRAM of the n-grams of the query, so a text
+    that matches it has to contain at least all the others (q-gram lemma). Short queries have no such guarantee,
+    instead they are split in MAX_L_DIST + 1 pieces and the texts that contain one of them exactly are candidates.
+    Args:
+        query: user input
+        index: SearchIndex of the restaurants
+
+    Returns:
+    List of positions of the candidate restaurants, in order.
+    """
+    grams = [query[j:j + NGRAM] for j in range(len(query) - NGRAM + 1)]
+    threshold = len(grams) - NGRAM * MAX_L_DIST
+    if threshold <= 0:
+        step = len(query) // (MAX_L_DIST + 1)
+        if step == 0:
+            return list(range(len(index.texts)))
+        pieces = [query[j * step:(j + 1) * step] for j in range(MAX_L_DIST)] + [query[MAX_L_DIST * step:]]
+        return [i for i, text in enumerate(index.texts) if any(piece in text for piece in pieces)]
+    counts: Dict[int, int] = {}
+    for gram in grams:
+        for i in index.postings.get(gram, []):
+            counts[i] = counts.get(i, 0) + 1
+    return sorted(i for i, c in counts.items() if c >= threshold)
+
+
+def find(query: str, restaurants: Restaurants, index: Optional[SearchIndex] = None,
+         limit: Optional[int] = MAX_RESULTS) -> Restaurants:
+    """
+    Finds the restaurants from the database that relate to the query. See is_match to understand what similitude is.
+    With an index, only the candidates it gives are checked, and results are ranked: closest matches first, then
+    matches in the name before matches in the address. Without it, the list is scanned in order.
     Args:
         query: user input that will be compared to the restaurants
         restaurants: list of all restaurants from the considered database.
+        index: SearchIndex of restaurants, see build_index
+        limit: maximum number of restaurants returned, None for all the matches
 
     Returns:
-    List of restaurants that match the query. Empty list if there are no similitudes whatsoever.
+    List of at most limit restaurants that match the query. Empty list if there are no similitudes whatsoever or
+    the query is blank, which would otherwise be a substring of every restaurant.
     """
     found: Restaurants = []
+    if not query.strip():
+        return found
+    if index is None:
+        for r in restaurants:
+            if is_match(query, r):
+                found.append(r)
+                if len(found) == limit:
+                    break
+        return found
+    ranked = []
+    for i in candidates(query, index):
+        start = index.texts[i].find(query)
+        if start != -1:
+            # Exact matches are the most common ones and much cheaper to find.
+            ranked.append((0, start >= index.name_lengths[i], i))
+            continue
+        matches = find_near_matches(query, index.texts[i], max_l_dist=MAX_L_DIST)
+        if matches:
+            best = min(matches, key=lambda m: (m.dist, m.start))
+            ranked.append((best.dist, best.start >= index.name_lengths[i], i))
+    ranked.sort()
+    return [restaurants[i] for _, _, i in ranked[:limit]]
+
+
+def snap(restaurants: Restaurants, index: SpatialIndex, fingerprint: str,
+         previous: Optional[Snapping] = None) -> Snapping:
+    """
+    Snaps every restaurant to its closest street node. Only the restaurants that are new or have moved since the
+    previous table are snapped again, if it was computed on the same graph.
+    Args:
+        restaurants: list of all restaurants from the considered database.
+        index: SpatialIndex of the street nodes of the graph
+        fingerprint: fingerprint of the snapshot of the graph
+        previous: table computed before, if any
+
+    Returns:
+    Snapping table of the restaurants.
+    """
+    if previous is None or previous.fingerprint != fingerprint:
+        previous = Snapping(fingerprint, {}, {}, {})
+    s = Snapping(fingerprint, {}, {}, {})
     for r in restaurants:
-        if is_match(query, r) and len(found) != 10:
-            found.append(r)
-    return found
+        coord = (float(r.coordinates[0]), float(r.coordinates[1]))
+        if previous.coordinates.get(r.id) == coord:
+            s.nodes[r.id], s.offsets[r.id] = previous.nodes[r.id], previous.offsets[r.id]
+        else:
+            s.nodes[r.id], s.offsets[r.id] = k_nearest(index, coord)[0]
+        s.coordinates[r.id] = coord
+    return s
+
+
+def save_snapping(s: Snapping, filename: str) -> None:
+    """
+    Saves the snapping table in filename.npz, written aside and renamed into place.
+    Args:
+        s: Snapping table
+        filename: name of the file
+    """
+    ids = list(s.nodes)
+    tmp = filename + ".tmp" + str(os.getpid()) + ".npz"
+    np.savez(tmp, fingerprint=np.array(s.fingerprint), ids=np.array(ids, dtype=str),
+             nodes=np.array([s.nodes[i] for i in ids]), offsets=np.array([s.offsets[i] for i in ids], dtype=np.float64),
+             coordinates=np.array([s.coordinates[i] for i in ids], dtype=np.float64).reshape(len(ids), 2))
+    os.replace(tmp, filename + ".npz")
+
+
+def load_snapping(filename: str) -> Optional[Snapping]:
+    """
+    Loads the snapping table saved in filename.npz.
+    Args:
+        filename: name of the file
+
+    Returns:
+    Snapping table, None if there is none.
+    """
+    if not os.path.exists(filename + ".npz"):
+        return None
+    with np.load(filename + ".npz") as f:
+        ids = f["ids"].tolist()
+        return Snapping(str(f["fingerprint"]), dict(zip(ids, f["nodes"].tolist())),
+                        dict(zip(ids, f["offsets"].tolist())),
+                        dict(zip(ids, [tuple(c) for c in f["coordinates"].tolist()])))
+
+
+def snapping_table(restaurants: Restaurants, index: SpatialIndex, fingerprint: str, filename: str) -> Snapping:
+    """
+    Loads the snapping table of the restaurants from filename.npz, updates it if restaurants have been added or
+    moved, or the graph has changed, and saves it back if needed.
+    Args:
+        restaurants: list of all restaurants from the considered database.
+        index: SpatialIndex of the street nodes of the graph
+        fingerprint: fingerprint of the snapshot of the graph
+        filename: name of the file where the table is kept
+
+    Returns:
+    Snapping table of the restaurants.
+    """
+    previous = load_snapping(filename)
+    s = snap(restaurants, index, fingerprint, previous)
+    if previous is None or s != previous:
+        save_snapping(s, filename)
+    return s
@@ -0,0 +1,226 @@
+import heapq
+import numpy as np
+import networkx
+from dataclasses import dataclass
+from typing import List, Tuple, Dict, Union, Optional, Set, Callable, Sequence #type: ignore
+from typing_extensions import TypeAlias
+
+from metro import METHOD_TO_SPEED, haversine_array
+from snapshot import CitySnapshot
+
+NodeID: TypeAlias = Union[int, str]
+
+Path: TypeAlias = List[NodeID]
+
+
+@dataclass
+class Router:
+    ids: List[NodeID]
+    index: Dict[NodeID, int]
+    pos: np.ndarray  # (n, 2) long,lat
+    # CSR adjacency, as memoryviews of the arrays of the snapshot: their elements are read one at a time as Python
+    # numbers about as fast as from lists, but nothing is copied, so the worker processes that open the same snapshot
+    # memory-mapped share its pages instead of holding lists of their own.
+    indptr: Sequence[int]
+    indices: Sequence[int]
+    weights: Sequence[float]  # time in hours, or cost of the edge in a routing profile (inf if it can't be used)
+    max_speed: float  # km/h, fastest way of transportation, used by the heuristic
+    times: Optional[Sequence[float]] = None  # time in hours of each edge, if weights aren't times, see profiles.py
+
+
+def build_router(s: CitySnapshot) -> Router:
+    """
+    Builds the routing engine over the array-backed CityGraph of a snapshot.
+    Args:
+        s: CitySnapshot of the city
+    Returns:
+    Router ready to answer shortest path queries.
+    """
+    return Router(s.ids.tolist(), s.index, np.asarray(s.pos), memoryview(s.indptr), memoryview(s.indices),
+                  memoryview(s.weights), max(METHOD_TO_SPEED.values()))
+
+
+def heuristic(r: Router, dst: int) -> List[float]:
+    """
+    Lower bound of the time in hours needed to reach dst from every node: the distance as the crow flies
+    travelled at the fastest speed. It never overestimates, since every edge weight is at least its haversine
+    distance over the speed of its way of transportation.
+    Args:
+        r: Router
+        dst: index of the destination node
+    Returns:
+    List with the lower bound for each node index.
+    """
+    return (haversine_array(r.pos, r.pos[dst]) / r.max_speed).tolist()
+
+
+def astar(r: Router, src: int, dst: int) -> Tuple[float, List[int]]:
+    """
+    Time-weighted A* search between two node indices.
+    Args:
+        r: Router
+        src: index of the origin node
+        dst: index of the destination node
+    Returns:
+    Tuple with the travel time in hours and the list of node indices of the path of least weight.
+    Raises networkx.NetworkXNoPath if dst can't be reached from src.
+    """
+    h = heuristic(r, dst)
+    indptr, indices, weights = r.indptr, r.indices, r.weights
+    inf = float("inf")
+    dist = [inf] * len(indptr)
+    dist[src] = 0.0
+    parent = {src: src}
+    via = {}  # edge each node is reached by
+    done = bytearray(len(indptr))
+    heap = [(h[src], src)]
+    while heap:
+        _, u = heapq.heappop(heap)
+        if done[u]:
+            continue
+        if u == dst:
+            path = [u]
+            while u != src:
+                u = parent[u]
+                path.append(u)
+            path.reverse()
+            if r.times is not None:
+                return sum(r.times[via[v]] for v in path[1:]), path
+            return dist[dst], path
+        done[u] = 1
+        du = dist[u]
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            dv = du + weights[k]
+            if dv < dist[v]:
+                dist[v] = dv
+                parent[v] = u
+                via[v] = k
+                heapq.heappush(heap, (dv + h[v], v))
+    raise networkx.NetworkXNoPath("No path between " + str(r.ids[src]) + " and " + str(r.ids[dst]) + ".")
+
+
+def shortest_path(r: Router, origin: NodeID, destination: NodeID) -> Path:
+    """
+    Returns the fastest path between two nodes of the CityGraph, taking into account the travel time of each edge.
+    Args:
+        r: Router
+        origin: starting node
+        destination: end node
+    Returns:
+    Path, list of nodes from origin to destination.
+    """
+    _, path = astar(r, r.index[origin], r.index[destination])
+    return [r.ids[i] for i in path]
+
+
+def travel_time_h(r: Router, origin: NodeID, destination: NodeID) -> float:
+    """
+    Returns the time in hours of the fastest path between two nodes of the CityGraph.
+    Args:
+        r: Router
+        origin: starting node
+        destination: end node
+    Returns:
+    Float with the travel time in hours.
+    """
+    t, _ = astar(r, r.index[origin], r.index[destination])
+    return t
+
+
+def dijkstra(r: Router, src: int, cutoff: float, targets: Optional[Set[int]] = None) -> Dict[int, float]:
+    """
+    Time-weighted single-source search: travel times from one node to every node reachable within cutoff.
+    Args:
+        r: Router
+        src: index of the origin node
+        cutoff: maximum travel time in hours
+        targets: node indices we are interested in. If given, the search stops once all of them are reached.
+    Returns:
+    Dictionary from node index to travel time in hours, for the nodes reached within cutoff. If the weights aren't
+    times, the cutoff applies to the weights and the times are the ones of the paths of least weight.
+    """
+    indptr, indices, weights, times = r.indptr, r.indices, r.weights, r.times
+    dist = {src: 0.0}
+    clock = {src: 0.0}  # time of the best path found to each node, if weights aren't times
+    settled: Dict[int, float] = {}
+    left = len(targets) if targets is not None else -1
+    heap = [(0.0, src)]
+    while heap and left != 0:
+        du, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        settled[u] = du if times is None else clock[u]
+        if targets is not None and u in targets:
+            left -= 1
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            dv = du + weights[k]
+            if dv <= cutoff and dv < dist.get(v, cutoff + 1):
+                dist[v] = dv
+                if times is not None:
+                    clock[v] = clock[u] + times[k]
+                heapq.heappush(heap, (dv, v))
+    return settled
+
+
+def travel_times_h(r: Router, origin: NodeID, destinations: List[NodeID], cutoff: float) -> List[Optional[float]]:
+    """
+    Returns the time in hours of the fastest paths from one node to many, with a single search.
+    Args:
+        r: Router
+        origin: starting node
+        destinations: end nodes
+        cutoff: maximum travel time in hours
+    Returns:
+    List with the travel time to each destination, None for the ones that can't be reached within cutoff.
+    """
+    targets = [r.index[node] for node in destinations]
+    times = dijkstra(r, r.index[origin], cutoff, set(targets))
+    return [times.get(i) for i in targets]
+
+
+def travel_time_matrix(r: Router, origins: List[NodeID], destinations: List[NodeID],
+                       cutoff: float = float("inf")) -> np.ndarray:
+    """
+    Returns the time in hours of the fastest paths from many nodes to many, with one single-source search per
+    distinct origin that stops once all the destinations are reached.
+    Args:
+        r: Router
+        origins: starting nodes
+        destinations: end nodes
+        cutoff: maximum travel time in hours
+    Returns:
+    Array of shape (len(origins), len(destinations)) with the travel time from each origin to each destination,
+    inf for the ones that can't be reached within cutoff.
+    """
+    return search_matrix(r, origins, destinations, lambda src, wanted: dijkstra(r, src, cutoff, wanted))
+
+
+def search_matrix(r: Router, origins: List[NodeID], destinations: List[NodeID],
+                  search: Callable[[int, Set[int]], Dict[int, float]]) -> np.ndarray:
+    """
+    Assembles a travel time matrix from one single-source search per distinct origin, see travel_time_matrix.
+    Args:
+        r: Router
+        origins: starting nodes
+        destinations: end nodes
+        search: takes the index of an origin and the indexes of the destinations, and returns the time to the
+                nodes it reached by index
+    Returns:
+    Array of shape (len(origins), len(destinations)), inf for the destinations the search didn't reach.
+    """
+    targets = np.array([r.index[node] for node in destinations], dtype=np.int64)
+    sources = [r.index[node] for node in origins]
+    distinct = sorted(set(sources))
+    rows = np.full((len(distinct), len(targets)), np.inf)
+    # Scratch array the times of each search are scattered into, so that reading the targets is a single gather.
+    dist = np.full(len(r.ids), np.inf)
+    wanted = set(targets.tolist())
+    for i, src in enumerate(distinct):
+        times = search(src, wanted)
+        settled = np.fromiter(times.keys(), dtype=np.int64, count=len(times))
+        dist[settled] = np.fromiter(times.values(), dtype=np.float64, count=len(times))
+        rows[i] = dist[targets]
+        dist[settled] = np.inf
+    return rows[np.searchsorted(distinct, sources)]
@@ -0,0 +1,281 @@
+import heapq
+import numpy as np
+import networkx
+from dataclasses import dataclass
+from typing import List, Tuple, Dict, Union, Optional, Set, Sequence #type: ignore
+from typing_extensions import TypeAlias
+
+from metro import METHOD_TO_SPEED, haversine_array
+from snapshot import CitySnapshot, NODE_TYPES, EDGE_KINDS
+from routing import Router, build_router, search_matrix
+
+# Time-aware routing over the metro: instead of a constant speed and a fixed delay for every access and link, each
+# line has its own speed, time from the street to the platform, transfer penalty and headways by period of the
+# day. Boarding a line (going from an access or from another line to one of its platforms) costs the expected
+# wait for its next train at the time the platform is reached, so travel times depend on the departure time.
+
+NodeID: TypeAlias = Union[int, str]
+
+Path: TypeAlias = List[NodeID]
+
+# (hour the period starts at, minutes between trains) of each period of the day, sorted by hour. None when the
+# line is closed.
+Headways: TypeAlias = List[Tuple[float, Optional[float]]]
+
+MINUTES_PER_DAY = 24 * 60
+
+METRO_HEADWAYS: Headways = [(0, None), (5, 6), (7, 3), (9.5, 5), (17, 3.5), (20.5, 6), (22, 8)]
+
+# Automatic lines (L9, L10, L11) run shorter trains less often.
+AUTOMATIC_HEADWAYS: Headways = [(0, None), (5, 9), (7, 7), (9.5, 8), (17, 7), (20.5, 9), (22, 12)]
+
+FUNICULAR_HEADWAYS: Headways = [(0, None), (7.5, 10), (20, None)]
+
+
+@dataclass
+class LineService:
+    headways: Headways
+    speed: float = 27  # km/h between stations, stops included
+    access_min: float = 2.0  # minutes from an access to the platform, or back
+    transfer_min: float = 2.0  # minutes of penalty for changing to this line, on top of the walk between platforms
+
+
+# Service of each line, by line code as in estacions.csv (NOM_LINIA).
+SERVICES: Dict[str, LineService] = {
+    "L1": LineService(METRO_HEADWAYS, 26), "L2": LineService(METRO_HEADWAYS, 27),
+    "L3": LineService(METRO_HEADWAYS, 27), "L4": LineService(METRO_HEADWAYS, 26), "L5": LineService(METRO_HEADWAYS, 27),
+    "L9N": LineService(AUTOMATIC_HEADWAYS, 32, 3.0), "L9S": LineService(AUTOMATIC_HEADWAYS, 32, 3.0),
+    "L10N": LineService(AUTOMATIC_HEADWAYS, 32, 3.0), "L10S": LineService(AUTOMATIC_HEADWAYS, 32, 3.0),
+    "L11": LineService(AUTOMATIC_HEADWAYS, 20), "FM": LineService(FUNICULAR_HEADWAYS, 10, 1.0, 3.0)}
+
+# Service of the lines missing from SERVICES.
+DEFAULT_SERVICE = LineService(METRO_HEADWAYS, METHOD_TO_SPEED["metro"])
+
+
+@dataclass
+class TimedRouter:
+    router: Router  # ids, positions and CSR adjacency of the snapshot
+    base: Sequence[float]  # time in hours of each edge (CSR order) that doesn't depend on the time of day
+    board: Sequence[int]  # line boarded by each edge (index into waits), -1 if it doesn't board any
+    waits: List[List[float]]  # expected wait in hours for each line at each minute of the day
+    max_speed: float  # km/h, fastest way of transportation, used by the heuristic
+    factors: Optional[Sequence[float]] = None  # cost of each edge per hour in a routing profile, see profiles.py
+
+
+def waits_by_minute(headways: Headways) -> List[float]:
+    """
+    Expected wait for a train at each minute of the day: half the headway, as people don't arrive at the platform
+    in sync with the trains. Before a line opens, the wait until it opens is added. Waits are smoothed so that
+    reaching the platform later never means leaving earlier (when the headway shortens), which is what lets the
+    searches settle each node once.
+    Args:
+        headways: headways of the line by period of the day
+    Returns:
+    List with the wait in hours at each minute of the day, inf if the line doesn't open in the whole day.
+    """
+    waits = [0.0] * MINUTES_PER_DAY
+    for i, (start, headway) in enumerate(headways):
+        end = headways[i + 1][0] if i + 1 < len(headways) else 24
+        for m in range(int(start * 60), int(end * 60)):
+            waits[m] = headway / 120 if headway is not None else float("inf")
+    # Two passes backwards, as the wait at the end of the day depends on the first minutes of the next one.
+    for m in reversed(range(2 * MINUTES_PER_DAY - 1)):
+        i = m % MINUTES_PER_DAY
+        waits[i] = min(waits[i], waits[(i + 1) % MINUTES_PER_DAY] + 1 / 60)
+    return waits
+
+
+def build_timed_router(s: CitySnapshot, lines: Dict[NodeID, str],
+                       services: Optional[Dict[str, LineService]] = None) -> TimedRouter:
+    """
+    Builds the time-aware routing engine over the array-backed CityGraph of a snapshot.
+    Args:
+        s: CitySnapshot of the city
+        lines: line code of each station node
+        services: service of each line code, SERVICES if None. Lines missing from it use DEFAULT_SERVICE.
+    Returns:
+    TimedRouter ready to answer queries at any time of the day.
+    """
+    services = SERVICES if services is None else services
+    router = build_router(s)
+    codes = sorted(set(lines.values()))
+    line_services = [services.get(code, DEFAULT_SERVICE) for code in codes]
+    station = NODE_TYPES.index("Station")
+    # Line of each node, as an index into codes, -1 for streets and accesses.
+    node_line = np.array([codes.index(lines[node]) if t == station and node in lines else -1
+                          for node, t in zip(router.ids, np.asarray(s.types).tolist())], dtype=np.int64)
+    src = np.repeat(np.arange(len(router.ids)), np.diff(np.asarray(s.indptr)))
+    dst = np.asarray(s.indices)
+    kinds = np.asarray(s.kinds)
+    distances = np.asarray(s.distances, dtype=np.float64)
+    speed = np.array([service.speed for service in line_services] + [METHOD_TO_SPEED["metro"]])
+    access_h = np.array([service.access_min / 60 for service in line_services] + [0.0])
+    transfer_h = np.array([service.transfer_min / 60 for service in line_services] + [0.0])
+    walk = distances / METHOD_TO_SPEED["walk"]
+    # Index -1 picks the last element, the values for nodes of unknown lines.
+    base = np.where(kinds == EDGE_KINDS.index("Street"), walk, 0.0)
+    tram = kinds == EDGE_KINDS.index("Tram")
+    base[tram] = distances[tram] / speed[node_line[src[tram]]]
+    # From an access to a platform or back, the walk plus the time to go down (or up) to the platform.
+    acces = kinds == EDGE_KINDS.index("Acces")
+    platform = np.where(node_line[dst] >= 0, node_line[dst], node_line[src])
+    base[acces] = walk[acces] + access_h[platform[acces]]
+    # Between the platforms of two lines, the walk plus the transfer penalty of the line changed to.
+    link = kinds == EDGE_KINDS.index("Link")
+    base[link] = walk[link] + transfer_h[node_line[dst[link]]]
+    # Trains are boarded when a platform is reached from an access or another line.
+    board = np.where((acces | link) & (node_line[dst] >= 0), node_line[dst], -1)
+    # Memoryviews of compact arrays instead of lists, see Router.
+    return TimedRouter(router, memoryview(base), memoryview(board),
+                       [waits_by_minute(service.headways) for service in line_services],
+                       max([METHOD_TO_SPEED["walk"]] + [service.speed for service in line_services]))
+
+
+def timed_astar(tr: TimedRouter, src: int, dst: int, depart_h: float) -> Tuple[float, List[int]]:
+    """
+    Time-dependent A* search between two node indices: same as routing.astar, but the time of each edge is
+    evaluated at the time of day it is reached. With the factors of a routing profile, the path of least cost is
+    found instead of the fastest one.
+    Args:
+        tr: TimedRouter
+        src: index of the origin node
+        dst: index of the destination node
+        depart_h: time of day of the departure, in hours since midnight
+    Returns:
+    Tuple with the travel time in hours and the list of node indices of the shortest path.
+    Raises networkx.NetworkXNoPath if dst can't be reached from src.
+    """
+    r = tr.router
+    # Lower bound as in routing.heuristic, with the speed of the fastest line. Costs are never below times.
+    h = (haversine_array(r.pos, r.pos[dst]) / tr.max_speed).tolist()
+    indptr, indices, base, board, waits, factors = r.indptr, r.indices, tr.base, tr.board, tr.waits, tr.factors
+    inf = float("inf")
+    dist = [inf] * len(indptr)
+    dist[src] = 0.0
+    clock = [inf] * len(indptr)  # travel time of the path to each node, the same as dist without factors
+    clock[src] = 0.0
+    parent = {src: src}
+    done = bytearray(len(indptr))
+    heap = [(h[src], src)]
+    while heap:
+        _, u = heapq.heappop(heap)
+        if done[u]:
+            continue
+        if u == dst:
+            path = [u]
+            while u != src:
+                u = parent[u]
+                path.append(u)
+            path.reverse()
+            return clock[dst], path
+        done[u] = 1
+        du, cu = dist[u], clock[u]
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            t = base[k]
+            line = board[k]
+            if line >= 0:
+                t += waits[line][int((depart_h + cu + t) * 60) % MINUTES_PER_DAY]
+            dv = du + (t if factors is None else t * factors[k])
+            if dv < dist[v]:
+                dist[v] = dv
+                clock[v] = cu + t
+                parent[v] = u
+                heapq.heappush(heap, (dv + h[v], v))
+    raise networkx.NetworkXNoPath("No path between " + str(r.ids[src]) + " and " + str(r.ids[dst]) + ".")
+
+
+def shortest_path_at(tr: TimedRouter, origin: NodeID, destination: NodeID, depart_h: float) -> Tuple[float, Path]:
+    """
+    Returns the fastest path between two nodes of the CityGraph leaving at the given time of day.
+    Args:
+        tr: TimedRouter
+        origin: starting node
+        destination: end node
+        depart_h: time of day of the departure, in hours since midnight
+    Returns:
+    Tuple with the travel time in hours and the Path, list of nodes from origin to destination.
+    """
+    r = tr.router
+    t, path = timed_astar(tr, r.index[origin], r.index[destination], depart_h)
+    return t, [r.ids[i] for i in path]
+
+
+def timed_dijkstra(tr: TimedRouter, src: int, depart_h: float, cutoff: float,
+                   targets: Optional[Set[int]] = None) -> Dict[int, float]:
+    """
+    Time-dependent single-source search, see routing.dijkstra.
+    Args:
+        tr: TimedRouter
+        src: index of the origin node
+        depart_h: time of day of the departure, in hours since midnight
+        cutoff: maximum travel time in hours, or maximum cost with the factors of a routing profile
+        targets: node indices we are interested in. If given, the search stops once all of them are reached.
+    Returns:
+    Dictionary from node index to travel time in hours, for the nodes reached within cutoff.
+    """
+    r = tr.router
+    indptr, indices, base, board, waits, factors = r.indptr, r.indices, tr.base, tr.board, tr.waits, tr.factors
+    dist = {src: 0.0}
+    clock = {src: 0.0}  # travel time of the best path found to each node, the same as dist without factors
+    settled: Dict[int, float] = {}
+    left = len(targets) if targets is not None else -1
+    heap = [(0.0, src)]
+    while heap and left != 0:
+        du, u = heapq.heappop(heap)
+        if u in settled:
+            continue
+        cu = settled[u] = clock[u]
+        if targets is not None and u in targets:
+            left -= 1
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            t = base[k]
+            line = board[k]
+            if line >= 0:
+                t += waits[line][int((depart_h + cu + t) * 60) % MINUTES_PER_DAY]
+            dv = du + (t if factors is None else t * factors[k])
+            if dv <= cutoff and dv < dist.get(v, cutoff + 1):
+                dist[v] = dv
+                clock[v] = cu + t
+                heapq.heappush(heap, (dv, v))
+    return settled
+
+
+def travel_times_at(tr: TimedRouter, origin: NodeID, destinations: List[NodeID], depart_h: float,
+                    cutoff: float) -> List[Optional[float]]:
+    """
+    Returns the time in hours of the fastest paths from one node to many leaving at the given time of day, with a
+    single search.
+    Args:
+        tr: TimedRouter
+        origin: starting node
+        destinations: end nodes
+        depart_h: time of day of the departure, in hours since midnight
+        cutoff: maximum travel time in hours
+    Returns:
+    List with the travel time to each destination, None for the ones that can't be reached within cutoff.
+    """
+    r = tr.router
+    targets = [r.index[node] for node in destinations]
+    times = timed_dijkstra(tr, r.index[origin], depart_h, cutoff, set(targets))
+    return [times.get(i) for i in targets]
+
+
+def travel_time_matrix_at(tr: TimedRouter, origins: List[NodeID], destinations: List[NodeID], depart_h: float,
+                          cutoff: float = float("inf")) -> np.ndarray:
+    """
+    Returns the time in hours of the fastest paths from many nodes to many leaving at the given time of day, see
+    routing.travel_time_matrix.
+    Args:
+        tr: TimedRouter
+        origins: starting nodes
+        destinations: end nodes
+        depart_h: time of day of the departure, in hours since midnight
+        cutoff: maximum travel time in hours
+    Returns:
+    Array of shape (len(origins), len(destinations)) with the travel time from each origin to each destination,
+    inf for the ones that can't be reached within cutoff.
+    """
+    return search_matrix(tr.router, origins, destinations,
+                         lambda src, wanted: timed_dijkstra(tr, src, depart_h, cutoff, wanted))
@@ -0,0 +1,154 @@
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field, asdict
+from typing import List, Tuple, Optional #type: ignore
+from typing_extensions import TypeAlias
+
+# Sessions of the users of the bot: their position, the restaurants of their last search (by id, not the
+# Restaurant objects, so sessions are small and can be stored anywhere) and their routing profile. They are kept
+# in a SessionStore instead of the user_data of the Telegram application, so that their memory is bounded, and with
+# SQLiteSessionStore they survive restarts and are shared by several bot processes.
+
+Coord: TypeAlias = Tuple[float, float]  # (longitude, latitude)
+
+
+@dataclass
+class Session:
+    position: Optional[Coord] = None  # last location shared by the user
+    restaurants: Optional[List[str]] = None  # ids of the restaurants of the last search, None before the first one
+    profile: Optional[str] = None  # routing profile, None for the default one, see profiles.py
+    updated: float = 0.0  # time.time() when it was last stored
+
+
+def to_json(s: Session) -> str:
+    """
+    Serializes a session.
+    Returns:
+    String with the session as JSON.
+    """
+    return json.dumps(asdict(s), separators=(",", ":"))
+
+
+def from_json(text: str) -> Session:
+    """
+    Deserializes a session serialized by to_json.
+    Returns:
+    Session.
+    """
+    data = json.loads(text)
+    if data["position"] is not None:
+        data["position"] = tuple(data["position"])
+    return Session(**data)
+
+
+class SessionStore(ABC):
+    """
+    Where the sessions of the users are kept, by chat id. Sessions that haven't been stored for ttl seconds expire
+    (0 for never).
+    """
+
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+
+    def expired(self, s: Session) -> bool:
+        """
+        Tells whether a session hasn't been stored for longer than ttl.
+        """
+        return self.ttl > 0 and time.time() - s.updated > self.ttl
+
+    @abstractmethod
+    def get(self, chat_id: int) -> Session:
+        """
+        Gives the session of a user, a new empty one if it has none or it has expired.
+        """
+
+    @abstractmethod
+    def put(self, chat_id: int, s: Session) -> None:
+        """
+        Stores the session of a user, replacing the previous one.
+        """
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Sessions kept in the memory of the process, at most capacity of them: beyond that, the least recently used ones
+    are evicted.
+    """
+
+    def __init__(self, capacity: int, ttl: float) -> None:
+        super().__init__(ttl)
+        self.capacity = capacity
+        self.sessions: "OrderedDict[int, Session]" = OrderedDict()  # least recently used first
+
+    def get(self, chat_id: int) -> Session:
+        s = self.sessions.get(chat_id)
+        if s is None or self.expired(s):
+            self.sessions.pop(chat_id, None)
+            return Session()
+        self.sessions.move_to_end(chat_id)
+        # A copy, so that changes only count once the session is stored, as with the other stores.
+        return Session(s.position, None if s.restaurants is None else list(s.restaurants), s.profile, s.updated)
+
+    def put(self, chat_id: int, s: Session) -> None:
+        s.updated = time.time()
+        self.sessions[chat_id] = s
+        self.sessions.move_to_end(chat_id)
+        while len(self.sessions) > self.capacity:
+            self.sessions.popitem(last=False)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Sessions kept in an SQLite database on disk, which survives restarts and can be shared by several bot processes
+    on the same machine. Expired sessions are deleted every purge_every writes.
+    """
+
+    def __init__(self, filename: str, ttl: float, purge_every: int = 1000) -> None:
+        super().__init__(ttl)
+        self.purge_every = purge_every
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        # Write-ahead logging, so that processes reading sessions don't wait for the ones writing them.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, updated REAL, data TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+
+    def get(self, chat_id: int) -> Session:
+        with self.lock:
+            row = self.db.execute("SELECT data FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return Session()
+        s = from_json(row[0])
+        return Session() if self.expired(s) else s
+
+    def put(self, chat_id: int, s: Session) -> None:
+        s.updated = time.time()
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (chat_id, s.updated, to_json(s)))
+            self.writes += 1
+            if self.ttl > 0 and self.writes % self.purge_every == 0:
+                self.db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def open_store(filename: Optional[str], capacity: int, ttl: float) -> SessionStore:
+    """
+    Opens the session store of the bot.
+    Args:
+        filename: SQLite database the sessions are kept in, None to keep them in memory
+        capacity: maximum number of sessions kept in memory
+        ttl: seconds a session is kept since it was last stored, 0 for no limit
+    Returns:
+    SQLiteSessionStore if filename is given, MemorySessionStore otherwise.
+    """
+    if filename is not None:
+        return SQLiteSessionStore(filename, ttl)
+    return MemorySessionStore(capacity, ttl)
@@ -0,0 +1,322 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import networkx
+from dataclasses import dataclass, field
+from typing import List, Dict, Set, Union, Iterable #type: ignore
+from typing_extensions import TypeAlias
+
+from metro import Edge
+from columnar import replace_dir
+
+# Bumped every time the layout of the snapshot directory changes, so older snapshots are rebuilt instead of misread.
+SNAPSHOT_VERSION = 1
+
+NODE_TYPES = ("Street", "Station", "Acces")
+
+EDGE_KINDS = ("Street", "Tram", "Acces", "Link")
+
+ARRAYS = ("ids", "pos", "types", "indptr", "indices", "weights", "kinds", "colors", "distances")
+
+NodeID: TypeAlias = Union[int, str]
+
+
+@dataclass
+class CitySnapshot:
+    ids: np.ndarray  # node ids, int64 if all of them are integers, unicode otherwise
+    pos: np.ndarray  # (n, 2) long,lat
+    types: np.ndarray  # codes into NODE_TYPES
+    indptr: np.ndarray  # CSR adjacency, both directions of every edge are stored
+    indices: np.ndarray
+    weights: np.ndarray  # time in hours, as the 'weight' attribute of the CityGraph
+    kinds: np.ndarray  # codes into EDGE_KINDS
+    colors: np.ndarray  # codes into color_names
+    distances: np.ndarray
+    color_names: List[str]
+    fingerprint: str = ""  # of the sources it was built from, see sources_fingerprint
+    index: Dict[NodeID, int] = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.index = {node: i for i, node in enumerate(self.ids.tolist())}
+
+
+def sources_fingerprint(paths: List[str]) -> str:
+    """
+    Computes a fingerprint of the files the CityGraph is built from, so a snapshot can tell if it is outdated.
+    Args:
+        paths: list of source files (csv databases, osmnx pickle...)
+    Returns:
+    String with the hex digest of the size and modification time of each file.
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            h.update((path + ":" + str(st.st_size) + ":" + str(st.st_mtime_ns) + "\n").encode())
+        else:
+            h.update((path + ":missing\n").encode())
+    return h.hexdigest()
+
+
+def snapshot_from_city_graph(g: networkx.Graph) -> CitySnapshot:
+    """
+    Compiles a CityGraph into arrays: node positions and types, CSR adjacency, edge weights, kinds and colors.
+    Args:
+        g: CityGraph to be compiled
+    Returns:
+    CitySnapshot with the same nodes and edges as g.
+    """
+    nodes = list(g.nodes())
+    index = {node: i for i, node in enumerate(nodes)}
+    if all(type(node) == int for node in nodes):
+        ids = np.array(nodes, dtype=np.int64)
+    else:
+        ids = np.array([str(node) for node in nodes])
+    pos = np.array([g.nodes[node]['pos'] for node in nodes], dtype=np.float64).reshape(len(nodes), 2)
+    types = np.array([NODE_TYPES.index(g.nodes[node]['type']) for node in nodes], dtype=np.uint8)
+    color_names: List[str] = []
+    src, dst, weights, kinds, colors, distances = [], [], [], [], [], []
+    for u, v, data in g.edges(data=True):
+        info = data['info']
+        if info.color not in color_names:
+            color_names.append(info.color)
+        # Both directions are stored so that neighbours of a node are a contiguous slice.
+        for a, b in ((u, v), (v, u)):
+            src.append(index[a])
+            dst.append(index[b])
+            weights.append(data['weight'])
+            kinds.append(EDGE_KINDS.index(info.type))
+            colors.append(color_names.index(info.color))
+            distances.append(info.distance)
+    order = np.argsort(np.array(src, dtype=np.int64), kind="stable")
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(np.array(src, dtype=np.int64), minlength=len(nodes)), out=indptr[1:])
+    return CitySnapshot(ids, pos, types, indptr,
+                        np.array(dst, dtype=np.int32)[order],
+                        np.array(weights, dtype=np.float64)[order],
+                        np.array(kinds, dtype=np.uint8)[order],
+                        np.array(colors, dtype=np.uint8)[order],
+                        np.array(distances, dtype=np.float64)[order],
+                        color_names)
+
+
+def snapshot_to_city_graph(s: CitySnapshot) -> networkx.Graph:
+    """
+    Rebuilds the networkx CityGraph from a snapshot, for the functions that still need it (plotting, time_from_path).
+    Args:
+        s: CitySnapshot
+    Returns:
+    CityGraph with the nodes and edges stored in the snapshot.
+    """
+    g = networkx.Graph()
+    ids = s.ids.tolist()
+    pos = s.pos.tolist()
+    types = s.types.tolist()
+    g.add_nodes_from((ids[i], {'pos': tuple(pos[i]), 'type': NODE_TYPES[types[i]]}) for i in range(len(ids)))
+    indptr = s.indptr.tolist()
+    indices = s.indices.tolist()
+    weights = s.weights.tolist()
+    kinds = s.kinds.tolist()
+    colors = s.colors.tolist()
+    distances = s.distances.tolist()
+    edges = []
+    for u in range(len(ids)):
+        for k in range(indptr[u], indptr[u + 1]):
+            v = indices[k]
+            if u < v:
+                edges.append((ids[u], ids[v], {'info': Edge(EDGE_KINDS[kinds[k]], s.color_names[colors[k]],
+                                                            distances[k]),
+                                               'weight': weights[k]}))
+    g.add_edges_from(edges)
+    return g
+
+
+def path_graph(s: CitySnapshot, p: List[NodeID]) -> networkx.Graph:
+    """
+    Rebuilds only the nodes and edges of a path from a snapshot, enough to time and plot it without building the
+    whole CityGraph.
+    Args:
+        s: CitySnapshot
+        p: path, list of nodes of the snapshot
+    Returns:
+    CityGraph with the nodes of p and the edges between consecutive ones, with the same attributes as in the full one.
+    """
+    g = networkx.Graph()
+    nodes = [s.index[node] for node in p]
+    g.add_nodes_from((node, {'pos': tuple(s.pos[i].tolist()), 'type': NODE_TYPES[int(s.types[i])]})
+                     for node, i in zip(p, nodes))
+    for k in range(len(nodes) - 1):
+        start = int(s.indptr[nodes[k]])
+        e = start + int(np.flatnonzero(s.indices[start:s.indptr[nodes[k] + 1]] == nodes[k + 1])[0])
+        g.add_edge(p[k], p[k + 1], info=Edge(EDGE_KINDS[int(s.kinds[e])], s.color_names[int(s.colors[e])],
+                                             float(s.distances[e])), weight=float(s.weights[e]))
+    return g
+
+
+def metro_subgraph(s: CitySnapshot, streets: Iterable[NodeID] = ()) -> networkx.Graph:
+    """
+    Rebuilds only the stations and accesses of a snapshot with all their edges, the street nodes at the other end of
+    those and the given street nodes, enough to bring the metro up to date without building the whole CityGraph,
+    see update_city_snapshot.
+    Args:
+        s: CitySnapshot
+        streets: other street nodes to be included, without their edges
+    Returns:
+    CityGraph with those nodes and edges, with the same attributes as in the full one.
+    """
+    metro = np.asarray(s.types) != NODE_TYPES.index("Street")
+    src = np.repeat(np.arange(len(s.ids)), np.diff(np.asarray(s.indptr)))
+    edges = np.flatnonzero(metro[src])
+    nodes = np.flatnonzero(metro)
+    nodes = np.union1d(nodes, np.asarray(s.indices)[edges])
+    nodes = np.union1d(nodes, np.array([s.index[node] for node in streets], dtype=np.int64))
+    ids = s.ids.tolist()
+    g = networkx.Graph()
+    g.add_nodes_from((ids[i], {'pos': tuple(s.pos[i].tolist()), 'type': NODE_TYPES[int(s.types[i])]})
+                     for i in nodes.tolist())
+    g.add_edges_from((ids[src[k]], ids[s.indices[k]], {'info': Edge(EDGE_KINDS[int(s.kinds[k])],
+                                                                    s.color_names[int(s.colors[k])],
+                                                                    float(s.distances[k])),
+                                                       'weight': float(s.weights[k])})
+                     for k in edges.tolist())
+    return g
+
+
+def patch_snapshot(s: CitySnapshot, g: networkx.Graph, touched: Set[NodeID]) -> CitySnapshot:
+    """
+    Brings a snapshot up to date with a CityGraph that only differs from the one it was compiled from in the touched
+    nodes (added, removed or moved) and the edges incident to them. The rest of the arrays are kept as they are,
+    filtered and renumbered at once, which is much faster than compiling g again.
+    Args:
+        s: CitySnapshot of the graph before the changes
+        g: CityGraph after the changes, or any subgraph of it with the touched nodes and all their edges, e.g. the
+           metro_subgraph of the snapshot updated by update_city_graph
+        touched: nodes whose presence, position, type or incident edges have changed. Each changed edge only needs
+                 one of its ends touched.
+    Returns:
+    CitySnapshot with the same nodes and edges as g.
+    """
+    n = len(s.ids)
+    keep = np.ones(n, dtype=bool)
+    keep[[s.index[node] for node in touched if node in s.index and node not in g]] = False
+    dirty = np.zeros(n, dtype=bool)
+    dirty[[s.index[node] for node in touched if node in s.index]] = True
+    added = [node for node in touched if node in g and node not in s.index]
+    renumber = np.cumsum(keep) - 1
+    nodes = s.ids[keep].tolist() + added
+    index = {node: i for i, node in enumerate(nodes)}
+    if s.ids.dtype.kind == 'i' and all(type(node) == int for node in added):
+        ids = np.array(nodes, dtype=np.int64)
+    else:
+        ids = np.array([str(node) for node in nodes])
+    pos = np.concatenate((s.pos[keep], np.array([g.nodes[node]['pos'] for node in added],
+                                                 dtype=np.float64).reshape(len(added), 2)))
+    types = np.concatenate((s.types[keep], np.array([NODE_TYPES.index(g.nodes[node]['type']) for node in added],
+                                                    dtype=np.uint8)))
+    for node in touched:
+        if node in g and node in s.index:
+            pos[index[node]] = g.nodes[node]['pos']
+            types[index[node]] = NODE_TYPES.index(g.nodes[node]['type'])
+    # Edges between untouched nodes are kept, the ones incident to touched nodes are taken from g.
+    src = np.repeat(np.arange(n), np.diff(s.indptr))
+    kept = ~(dirty[src] | dirty[s.indices])
+    color_names = list(s.color_names)
+    new_src, new_dst, weights, kinds, colors, distances = [], [], [], [], [], []
+    seen = set()
+    for u in touched:
+        if u not in g:
+            continue
+        for v, data in g[u].items():
+            info = data['info']
+            if info.color not in color_names:
+                color_names.append(info.color)
+            for a, b in ((u, v), (v, u)):
+                if (a, b) not in seen:
+                    seen.add((a, b))
+                    new_src.append(index[a])
+                    new_dst.append(index[b])
+                    weights.append(data['weight'])
+                    kinds.append(EDGE_KINDS.index(info.type))
+                    colors.append(color_names.index(info.color))
+                    distances.append(info.distance)
+    all_src = np.concatenate((renumber[src[kept]], np.array(new_src, dtype=np.int64)))
+    order = np.argsort(all_src, kind="stable")
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(all_src, minlength=len(nodes)), out=indptr[1:])
+    return CitySnapshot(ids, pos, types, indptr,
+                        np.concatenate((renumber[s.indices[kept]], new_dst)).astype(np.int32)[order],
+                        np.concatenate((s.weights[kept], np.array(weights, dtype=np.float64)))[order],
+                        np.concatenate((s.kinds[kept], np.array(kinds, dtype=np.uint8)))[order],
+                        np.concatenate((s.colors[kept], np.array(colors, dtype=np.uint8)))[order],
+                        np.concatenate((s.distances[kept], np.array(distances, dtype=np.float64)))[order],
+                        color_names)
+
+
+def save_snapshot(s: CitySnapshot, dirname: str, fingerprint: str) -> None:
+    """
+    Writes the snapshot in the directory dirname as one .npy file per array plus a header.json.
+    The directory is written aside and swapped into place, so readers never see a half written snapshot nor a
+    missing one, see replace_dir.
+    Args:
+        s: CitySnapshot to be saved
+        dirname: directory where the snapshot is stored
+        fingerprint: fingerprint of the sources the snapshot was built from, see sources_fingerprint
+    """
+    tmp = dirname + ".tmp" + str(os.getpid())
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for name in ARRAYS:
+        np.save(os.path.join(tmp, name + ".npy"), getattr(s, name))
+    header = {'version': SNAPSHOT_VERSION, 'fingerprint': fingerprint, 'num_nodes': len(s.ids),
+              'num_edges': len(s.indices) // 2, 'node_types': list(NODE_TYPES), 'edge_kinds': list(EDGE_KINDS),
+              'colors': s.color_names}
+    with open(os.path.join(tmp, "header.json"), "w") as f:
+        json.dump(header, f)
+    replace_dir(tmp, dirname)
+
+
+def read_header(dirname: str) -> Dict:
+    """
+    Reads the header of the snapshot in dirname.
+    Args:
+        dirname: directory where the snapshot is stored
+    Returns:
+    Dictionary with the header, empty if there is no snapshot.
+    """
+    path = os.path.join(dirname, "header.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_snapshot_fresh(dirname: str, sources: List[str]) -> bool:
+    """
+    Checks that the snapshot in dirname exists, has the current version and was built from the current sources.
+    Args:
+        dirname: directory where the snapshot is stored
+        sources: list of source files of the CityGraph
+    Returns:
+    True if the snapshot can be used as is, False if it has to be rebuilt.
+    """
+    header = read_header(dirname)
+    return header.get('version') == SNAPSHOT_VERSION and header.get('fingerprint') == sources_fingerprint(sources)
+
+
+def open_snapshot(dirname: str) -> CitySnapshot:
+    """
+    Opens the snapshot in dirname. Arrays are memory-mapped read only, so several processes opening the same
+    snapshot share its pages instead of holding a copy each.
+    Args:
+        dirname: directory where the snapshot is stored
+    Returns:
+    CitySnapshot backed by the files in dirname.
+    """
+    header = read_header(dirname)
+    if header.get('version') != SNAPSHOT_VERSION:
+        raise ValueError("Snapshot in " + dirname + " is missing or has an unsupported version.")
+    arrays = [np.load(os.path.join(dirname, name + ".npy"), mmap_mode='r') for name in ARRAYS]
+    return CitySnapshot(*arrays, color_names=header['colors'], fingerprint=header['fingerprint'])
@@ -0,0 +1,181 @@
+import math
+import numpy as np
+from dataclasses import dataclass
+from typing import List, Tuple, Dict, Optional, Union #type: ignore
+from typing_extensions import TypeAlias
+
+NodeID: TypeAlias = Union[int, str]
+
+Coord: TypeAlias = Tuple[float, float]  # (longitude, latitude)
+
+EARTH_RADIUS_M = 6371008.8
+
+
+@dataclass
+class SpatialIndex:
+    ids: List[NodeID]
+    xy: np.ndarray  # (n, 2) projected coordinates in meters
+    lat0: float  # latitude of the projection, in radians
+    cell: float  # side of the grid cells in meters
+    cells: Dict[Tuple[int, int], np.ndarray]  # positions in ids of the nodes in each cell
+    bounds: Tuple[int, int, int, int]  # min and max cell coordinates: (min x, min y, max x, max y)
+
+
+def project(lat0: float, coords: np.ndarray) -> np.ndarray:
+    """
+    Projects (longitude, latitude) coordinates into meters with an equirectangular projection centered at lat0,
+    precise enough at city scale.
+    Args:
+        lat0: latitude of the projection, in radians
+        coords: array of shape (n, 2) with (longitude, latitude) coordinates
+    Returns:
+    Array of shape (n, 2) with (x, y) coordinates in meters.
+    """
+    rad = np.radians(np.asarray(coords, dtype=np.float64).reshape(-1, 2))
+    return np.column_stack((rad[:, 0] * math.cos(lat0), rad[:, 1])) * EARTH_RADIUS_M
+
+
+def build_spatial_index(ids: List[NodeID], pos: np.ndarray) -> SpatialIndex:
+    """
+    Builds a grid over the projected coordinates of the given nodes, with about two nodes per cell.
+    Args:
+        ids: list of nodes
+        pos: array of shape (n, 2) with the (longitude, latitude) of each node
+    Returns:
+    SpatialIndex of the nodes.
+    """
+    pos = np.asarray(pos, dtype=np.float64).reshape(-1, 2)
+    lat0 = math.radians(float(pos[:, 1].mean())) if len(pos) else 0.0
+    xy = project(lat0, pos)
+    if len(xy):
+        extent = xy.max(axis=0) - xy.min(axis=0)
+        cell = max(math.sqrt(max(extent[0], 1.0) * max(extent[1], 1.0) * 2 / len(xy)), 1.0)
+    else:
+        cell = 1.0
+    keys = np.floor(xy / cell).astype(np.int64)
+    order = np.lexsort((keys[:, 1], keys[:, 0]))
+    sorted_keys = keys[order]
+    cells: Dict[Tuple[int, int], np.ndarray] = {}
+    if len(order):
+        starts = np.flatnonzero(np.any(np.diff(sorted_keys, axis=0) != 0, axis=1)) + 1
+        for chunk, key in zip(np.split(order, starts), sorted_keys[np.concatenate(([0], starts))]):
+            cells[(int(key[0]), int(key[1]))] = chunk
+        bounds = (int(keys[:, 0].min()), int(keys[:, 1].min()), int(keys[:, 0].max()), int(keys[:, 1].max()))
+    else:
+        bounds = (0, 0, -1, -1)
+    return SpatialIndex(list(ids), xy, lat0, cell, cells, bounds)
+
+
+def ring(cx: int, cy: int, r: int,
+         bounds: Optional[Tuple[int, int, int, int]] = None) -> List[Tuple[int, int]]:
+    """
+    Cells at distance exactly r (in cells, Chebyshev distance) from the cell (cx, cy).
+    Args:
+        cx: x coordinate of the center cell
+        cy: y coordinate of the center cell
+        r: radius of the ring
+        bounds: only the cells within these (min x, min y, max x, max y) cell coordinates are given, None for all
+    Returns:
+    List of cell coordinates.
+    """
+    x0, y0, x1, y1 = bounds if bounds is not None else (cx - r, cy - r, cx + r, cy + r)
+    if r == 0:
+        return [(cx, cy)] if x0 <= cx <= x1 and y0 <= cy <= y1 else []
+    # Rows at the top and bottom of the ring, then its columns at the left and right without their corners.
+    xs = range(max(cx - r, x0), min(cx + r, x1) + 1)
+    ys = range(max(cy - r + 1, y0), min(cy + r - 1, y1) + 1)
+    cells = [(x, y) for y in (cy - r, cy + r) if y0 <= y <= y1 for x in xs]
+    cells += [(x, y) for x in (cx - r, cx + r) if x0 <= x <= x1 for y in ys]
+    return cells
+
+
+def search(idx: SpatialIndex, point: np.ndarray, k: int, max_dist: Optional[float]) -> List[Tuple[int, float]]:
+    """
+    Finds the k nodes closest to a projected point, visiting rings of cells around it until no unvisited
+    node can be closer than the ones found.
+    Args:
+        idx: SpatialIndex
+        point: projected (x, y) coordinates in meters
+        k: number of nodes wanted
+        max_dist: maximum distance in meters, None for no limit
+    Returns:
+    List of (position in idx.ids, distance in meters) sorted by distance, with at most k elements.
+    """
+    cx, cy = int(math.floor(point[0] / idx.cell)), int(math.floor(point[1] / idx.cell))
+    # Rings closer than the first one reaching the grid are empty, and only the part of each ring within the grid is
+    # visited, so that points far away from the grid (e.g. a location in another city) cost as much as the ones near
+    # its border instead of visiting millions of empty cells.
+    first = max(idx.bounds[0] - cx, cx - idx.bounds[2], idx.bounds[1] - cy, cy - idx.bounds[3], 0)
+    # Number of rings needed to cover the whole grid from (cx, cy).
+    last = max(cx - idx.bounds[0], idx.bounds[2] - cx, cy - idx.bounds[1], idx.bounds[3] - cy, 0)
+    if max_dist is not None:
+        last = min(last, int(math.ceil(max_dist / idx.cell)) + 1)
+    found_pos: List[np.ndarray] = []
+    found_dist: List[np.ndarray] = []
+    best = np.empty(0)
+    for r in range(first, last + 1):
+        chunks = [idx.cells[c] for c in ring(cx, cy, r, idx.bounds) if c in idx.cells]
+        if chunks:
+            candidates = np.concatenate(chunks)
+            found_pos.append(candidates)
+            found_dist.append(np.hypot(*(idx.xy[candidates] - point).T))
+            best = np.sort(np.concatenate(found_dist))[:k]
+        # Nodes outside the visited rings are at least r cells away.
+        if len(best) == k and best[-1] <= r * idx.cell:
+            break
+        if max_dist is not None and r * idx.cell > max_dist:
+            break
+    if not found_pos:
+        return []
+    positions = np.concatenate(found_pos)
+    dists = np.concatenate(found_dist)
+    order = np.argsort(dists, kind="stable")[:k]
+    return [(int(positions[i]), float(dists[i])) for i in order if max_dist is None or dists[i] <= max_dist]
+
+
+def k_nearest(idx: SpatialIndex, coord: Coord, k: int = 1,
+              max_dist: Optional[float] = None) -> List[Tuple[NodeID, float]]:
+    """
+    Returns the k nodes closest to the given coordinates.
+    Args:
+        idx: SpatialIndex
+        coord: (longitude, latitude) coordinates
+        k: number of candidates wanted
+        max_dist: maximum distance in meters, None for no limit
+    Returns:
+    List of (node, distance in meters) sorted by distance. It has less than k elements if there aren't
+    k nodes within max_dist.
+    """
+    point = project(idx.lat0, np.array([coord]))[0]
+    return [(idx.ids[i], d) for i, d in search(idx, point, k, max_dist)]
+
+
+def nearest_nodes(idx: SpatialIndex, coords: List[Coord],
+                  max_dist: Optional[float] = None) -> List[Optional[NodeID]]:
+    """
+    Snaps many coordinates at once to their nearest node.
+    Args:
+        idx: SpatialIndex
+        coords: list of (longitude, latitude) coordinates
+        max_dist: maximum distance in meters, None for no limit
+    Returns:
+    List with the nearest node to each coordinate, None where there is no node within max_dist.
+    """
+    points = project(idx.lat0, np.array(coords, dtype=np.float64))
+    result: List[Optional[NodeID]] = []
+    for point in points:
+        found = search(idx, point, 1, max_dist)
+        result.append(idx.ids[found[0][0]] if found else None)
+    return result
+
+
+def nearest_node(idx: SpatialIndex, coord: Coord) -> NodeID:
+    """
+    Snaps the given coordinates to their nearest node.
+    Args:
+        idx: SpatialIndex
+        coord: (longitude, latitude) coordinates
+    Returns:
+    Nearest node to coord.
+    """
+    return nearest_nodes(idx, [coord])[0]
@@ -0,0 +1,160 @@
+import os
+import asyncio
+import dataclasses
+import pytest
+
+import city
+import render
+import metrics
+import sessions
+import benchmark
+import fake_telegram as ft
+import bot
+
+# Positions around Plaça de Catalunya, inside the synthetic street graph.
+POSITIONS = [ft.Location(2.170 + 0.001 * i, 41.387 - 0.001 * i) for i in range(8)]
+
+
+@pytest.fixture(scope="module")
+def loaded_bot(tmp_path_factory):
+    """
+    Bot with its data loaded from a synthetic street graph, and maps drawn without fetching any tile.
+    """
+    directory = tmp_path_factory.mktemp("bot")
+    cwd, tiles = os.getcwd(), city.tiles
+    os.chdir(directory)
+    try:
+        city.save_osmnx_graph(benchmark.synthetic_osmnx_graph(30), "street_graph")
+        city.tiles = render.TileCache("tiles", None)
+        bot.load_restaurants()
+        bot.load_city()
+        bot.snap_restaurants()
+        yield bot
+    finally:
+        os.chdir(cwd)
+        city.tiles = tiles
+
+
+@pytest.fixture
+def tg(loaded_bot, monkeypatch):
+    """
+    Stand-in of the Telegram API with empty sessions, an empty route cache and fresh concurrency limits.
+    """
+    monkeypatch.setattr(bot, "session_store", sessions.MemorySessionStore(100, 0))
+    monkeypatch.setattr(bot, "routes", bot.cache.RouteCache(capacity=256, max_bytes=64 * 2 ** 20, ttl=3600))
+    monkeypatch.setattr(bot, "limiters", limiters(bot.COMMAND_LIMITS))
+    return ft.bot_telegram(bot)
+
+
+def limiters(limits):
+    return {command: bot.Limiter(asyncio.Semaphore(running), running + waiting)
+            for command, (running, waiting) in limits.items()}
+
+
+def run(coroutine):
+    """
+    Runs a coroutine in a new event loop in which the data of the bot counts as loaded.
+    """
+    async def main():
+        loop = asyncio.get_running_loop()
+        for name in ("restaurants", "city"):
+            bot.loading[name] = loop.create_future()
+            bot.loading[name].set_result(None)
+        return await coroutine
+    return asyncio.run(main())
+
+
+def texts(answers):
+    return [a.text for a in answers if a.text is not None]
+
+
+def test_find_lists_restaurants(tg):
+    answers = run(tg.send(1, "/find pizza"))
+    lines = texts(answers)[0].splitlines()
+    assert 0 < len(lines) <= 10 and lines[0].startswith("1. ")
+
+
+def test_find_ranks_by_time_with_location(tg):
+    async def scenario():
+        await tg.send(1, location=POSITIONS[0])
+        return await tg.send(1, "/find pizza")
+    lines = texts(run(scenario()))[0].splitlines()
+    assert all(line.endswith(" min)") for line in lines[:3])
+
+
+def test_error_replies(tg):
+    async def scenario():
+        return [texts(await tg.send(1, "/find")), texts(await tg.send(1, "/info 1")),
+                texts(await tg.send(1, "/guide 1")), texts(await tg.send(1, "/find pizza")),
+                texts(await tg.send(1, "/guide 1")), texts(await tg.send(1, "/info 99"))]
+    empty, info, guide, _, no_location, invalid = run(scenario())
+    assert empty[0].startswith("Empty query!")
+    assert info[0].startswith("Please search for restaurants")
+    assert guide[0].startswith("Please share your location")
+    assert no_location[0].startswith("Please share your location")
+    assert invalid[0].startswith("Invalid index.")
+
+
+def test_concurrent_find_and_guide(tg):
+    async def user(chat_id):
+        await tg.send(chat_id, location=POSITIONS[chat_id % len(POSITIONS)])
+        await tg.send(chat_id, "/find pizza")
+        guide, find = await asyncio.gather(tg.send(chat_id, "/guide 1"), tg.send(chat_id, "/find sushi"))
+        return guide, find
+
+    async def scenario():
+        return await asyncio.gather(*(user(chat_id) for chat_id in range(1, 9)))
+    for guide, find in run(scenario()):
+        assert any(a.photo is not None and a.photo.startswith(b"\x89PNG") for a in guide)
+        assert texts(guide)[-1].startswith("Estimated time of arrival is ")
+        assert texts(find)[0].startswith("1. ")
+
+
+def test_limits_reject_beyond_capacity(tg, monkeypatch):
+    monkeypatch.setattr(bot, "limiters", limiters({"find": (8, 64), "guide": (1, 1)}))
+    rejected = metrics.registry.counters.get("guide.rejected", 0)
+    tg.bot.latency = 0.2
+
+    async def scenario():
+        for chat_id in range(1, 6):
+            await tg.send(chat_id, location=POSITIONS[0])
+            await tg.send(chat_id, "/find pizza")
+        return await asyncio.gather(*(tg.send(chat_id, "/guide 1") for chat_id in range(1, 6)))
+    results = run(scenario())
+    retry = [answers for answers in results if texts(answers)[-1].endswith("Please retry in a few seconds.")]
+    assert len(retry) == 3
+    assert sum(any(a.photo is not None for a in answers) for answers in results) == 2
+    assert metrics.registry.counters.get("guide.rejected", 0) - rejected == 3
+    assert all(limiter.pending == 0 for limiter in bot.limiters.values())
+
+
+def test_route_of_an_outdated_snapshot_is_not_cached(tg, monkeypatch):
+    src, destination = (POSITIONS[0].longitude, POSITIONS[0].latitude), bot.snapshot.ids[0].item()
+
+    def updated_meanwhile(*args):
+        # The metro is updated while the route is being computed.
+        monkeypatch.setattr(bot, "snapshot", dataclasses.replace(bot.snapshot, fingerprint="updated"))
+        return bot.cache.Route([destination], 0, b"")
+    monkeypatch.setattr(bot, "route", updated_meanwhile)
+
+    async def scenario():
+        first = await bot.get_route(src, destination)
+        monkeypatch.setattr(bot, "route", lambda *args: bot.cache.Route([destination], 1, b""))
+        return first, await bot.get_route(src, destination)
+    first, second = run(scenario())
+    assert (first.minutes, second.minutes) == (0, 1)
+    assert [key[0] for key in bot.routes.routes] == ["updated"]
+
+
+def test_failed_route_is_reported(tg, monkeypatch):
+    async def broken(*args):
+        raise RuntimeError("routing failed")
+    monkeypatch.setattr(bot, "get_route", broken)
+    errors = metrics.registry.counters.get("guide.errors", 0)
+
+    async def scenario():
+        await tg.send(1, location=POSITIONS[0])
+        await tg.send(1, "/find pizza")
+        return await tg.send(1, "/guide 1")
+    assert texts(run(scenario())) == ["We are experiencing technical difficulties. Please retry."]
+    assert metrics.registry.counters.get("guide.errors", 0) - errors == 1
@@ -0,0 +1,59 @@
+import os
+import random
+import pytest
+import networkx
+
+import city
+import routing
+import contraction
+import benchmark
+from snapshot import snapshot_from_city_graph, save_snapshot, open_snapshot
+
+
+@pytest.fixture(scope="module")
+def snapshot():
+    return snapshot_from_city_graph(city.build_city_graph(benchmark.synthetic_osmnx_graph(20), city.get_metro_graph()))
+
+
+@pytest.fixture(scope="module")
+def hierarchy(snapshot):
+    return contraction.build_hierarchy(snapshot)
+
+
+def path_time(r: routing.Router, path) -> float:
+    total = 0.0
+    for a, b in zip(path, path[1:]):
+        u, v = r.index[a], r.index[b]
+        total += min(r.weights[k] for k in range(r.indptr[u], r.indptr[u + 1]) if r.indices[k] == v)
+    return total
+
+
+def test_hierarchy_matches_astar(snapshot, hierarchy):
+    r = routing.build_router(snapshot)
+    rnd = random.Random(0)
+    for _ in range(200):
+        a, b = rnd.choice(r.ids), rnd.choice(r.ids)
+        try:
+            expected = routing.shortest_path(r, a, b)
+        except networkx.NetworkXNoPath:
+            with pytest.raises(networkx.NetworkXNoPath):
+                contraction.shortest_path(hierarchy, a, b)
+            continue
+        path = contraction.shortest_path(hierarchy, a, b)
+        assert path[0] == a and path[-1] == b
+        # Ties between paths of the same time may be broken differently.
+        assert path_time(r, path) == pytest.approx(path_time(r, expected))
+
+
+def test_saved_hierarchy_matches(snapshot, hierarchy, tmp_path):
+    dirname = str(tmp_path / "city_graph")
+    save_snapshot(snapshot, dirname, "fingerprint")
+    assert city.load_city_hierarchy(open_snapshot(dirname), dirname) is None
+    assert city.rebuild_city_hierarchy(dirname) == "fingerprint"
+    assert contraction.is_hierarchy_fresh(dirname)
+    saved = city.load_city_hierarchy(open_snapshot(dirname), dirname)
+    assert (saved.indptr == hierarchy.indptr).all() and (saved.indices == hierarchy.indices).all()
+    # A new version of the snapshot doesn't inherit the hierarchy of the previous one.
+    save_snapshot(snapshot, dirname, "other")
+    assert not contraction.is_hierarchy_fresh(dirname)
+    assert len(os.listdir(tmp_path)) == 3
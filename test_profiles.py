@@ -0,0 +1,89 @@
+import pytest
+import numpy as np
+import networkx
+
+import city
+import routing
+import profiles
+import benchmark
+from snapshot import snapshot_from_city_graph, EDGE_KINDS, NODE_TYPES
+
+
+@pytest.fixture(scope="module")
+def metro():
+    """
+    Snapshot of the metro alone, so that paths can't leave the trains to walk along the streets.
+    """
+    return snapshot_from_city_graph(city.get_metro_graph())
+
+
+@pytest.fixture(scope="module")
+def streets():
+    return snapshot_from_city_graph(city.build_city_graph(benchmark.synthetic_osmnx_graph(20), city.get_metro_graph()))
+
+
+def edge_ends(s):
+    src = np.repeat(np.arange(len(s.ids)), np.diff(np.asarray(s.indptr)))
+    return src, np.asarray(s.indices)
+
+
+def test_step_free_keeps_trains_through_inaccessible_stations(metro):
+    factors = city.build_city_profiles(metro)["step-free"]
+    inaccessible = {station.id for station in city.read_stations() if not station.accessibility}
+    src, dst = edge_ends(metro)
+    kinds = np.asarray(metro.kinds)
+    ids = metro.ids.tolist()
+    touching = np.array([ids[u] in inaccessible or ids[v] in inaccessible for u, v in zip(src, dst)])
+    assert touching.any()
+    assert np.all(factors[touching & (kinds == EDGE_KINDS.index("Tram"))] == 1)
+    assert np.all(np.isinf(factors[touching & (kinds == EDGE_KINDS.index("Acces"))]))
+    assert np.all(np.isinf(factors[touching & (kinds == EDGE_KINDS.index("Link"))]))
+
+
+def test_step_free_rides_through_inaccessible_stations(metro):
+    router = profiles.profile_routers(metro, routing.build_router(metro), city.build_city_profiles(metro))["step-free"]
+    stations = city.read_stations()
+    accessible = {}
+    for access in city.read_accesses():
+        if access.accessibility:
+            accessible.setdefault(access.station_name, []).append(access.id)
+    ridden = 0
+    for a, b, c in zip(stations, stations[1:], stations[2:]):
+        if a.line == b.line == c.line and not b.accessibility and a.accessibility and c.accessibility \
+                and a.name in accessible and c.name in accessible:
+            path = routing.shortest_path(router, accessible[a.name][0], accessible[c.name][0])
+            assert b.id in path
+            ridden += 1
+    assert ridden >= 5
+
+
+def test_is_mask_and_max_speed(streets):
+    factors = city.build_city_profiles(streets)
+    assert profiles.is_mask(factors["default"]) and profiles.is_mask(factors["step-free"])
+    assert profiles.is_mask(factors["walk-only"]) and not profiles.is_mask(factors["metro-preferred"])
+    fastest = max(city.METHOD_TO_SPEED.values())
+    assert profiles.profile_max_speed(streets, factors["walk-only"], fastest) == city.METHOD_TO_SPEED["walk"]
+    assert profiles.profile_max_speed(streets, factors["step-free"], fastest) == fastest
+
+
+def test_profile_routes(streets):
+    factors = city.build_city_profiles(streets)
+    base = routing.build_router(streets)
+    routers = profiles.profile_routers(streets, base, factors)
+    assert routers["default"] is base
+    types = {node: NODE_TYPES[int(t)] for node, t in zip(streets.ids.tolist(), np.asarray(streets.types).tolist())}
+    street_nodes = [node for node, t in types.items() if t == "Street"]
+    rnd = np.random.default_rng(0)
+    for _ in range(30):
+        a, b = rnd.choice(street_nodes, 2).tolist()
+        try:
+            default = routing.shortest_path(routers["default"], a, b)
+        except networkx.NetworkXNoPath:
+            continue
+        walk = routing.shortest_path(routers["walk-only"], a, b)
+        assert all(types[node] == "Street" for node in walk)
+        # Profiles only remove or slow down edges, so their paths never take less time than the fastest one.
+        for name in ("walk-only", "step-free", "metro-preferred"):
+            path = routing.shortest_path(routers[name], a, b)
+            assert city.time_from_path(city.path_graph(streets, path), path) >= \
+                city.time_from_path(city.path_graph(streets, default), default)
@@ -0,0 +1,27 @@
+import pytest
+
+import restaurants as rest
+
+
+def restaurant(i: int, name: str, street: str, neighbourhood: str) -> rest.Restaurant:
+    return rest.Restaurant(str(i), name, [street, i], [2.17, 41.39], 1.0, "Eixample", neighbourhood, "930000000")
+
+
+RESTAURANTS = [restaurant(0, "Pizzeria Napoli", "Carrer de Mallorca", "la Dreta de l'Eixample"),
+               restaurant(1, "Sushi Bar Kyoto", "Carrer de Verdi", "la Vila de Gràcia"),
+               restaurant(2, "Bar Pinotxo", "La Rambla", "el Raval"),
+               restaurant(3, "Can Pizza", "Carrer de Pujades", "el Poblenou")]
+
+
+@pytest.mark.parametrize("query", ["", " ", "   "])
+@pytest.mark.parametrize("indexed", [False, True])
+def test_blank_query_matches_nothing(query, indexed):
+    index = rest.build_index(RESTAURANTS) if indexed else None
+    assert rest.find(query, RESTAURANTS, index) == []
+
+
+@pytest.mark.parametrize("query", ["Pizz", "Sushi", "Bar", "Gràcia", "Poblenou", "Pizzaria"])
+def test_index_finds_the_same_restaurants(query):
+    scanned = rest.find(query, RESTAURANTS, limit=None)
+    indexed = rest.find(query, RESTAURANTS, rest.build_index(RESTAURANTS), limit=None)
+    assert scanned and sorted(r.id for r in indexed) == sorted(r.id for r in scanned)
@@ -0,0 +1,70 @@
+import time
+import pytest
+
+import sessions
+from sessions import Session, SessionStore, MemorySessionStore, SQLiteSessionStore
+
+
+def test_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore(0)
+
+
+def test_json_round_trip():
+    s = Session((2.17, 41.39), ["1", "2"], "wheelchair", 123.0)
+    assert sessions.from_json(sessions.to_json(s)) == s
+    assert sessions.from_json(sessions.to_json(Session())) == Session()
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemorySessionStore(capacity=2, ttl=0)
+    for chat_id in (1, 2):
+        store.put(chat_id, Session(profile=str(chat_id)))
+    store.get(1)
+    store.put(3, Session(profile="3"))
+    assert store.get(2) == Session()
+    assert store.get(1).profile == "1"
+    assert store.get(3).profile == "3"
+    assert len(store.sessions) == 2
+
+
+def test_memory_store_changes_count_once_stored():
+    store = MemorySessionStore(capacity=10, ttl=0)
+    store.put(1, Session(restaurants=["a"]))
+    s = store.get(1)
+    s.restaurants.append("b")
+    assert store.get(1).restaurants == ["a"]
+
+
+@pytest.mark.parametrize("make", [lambda tmp_path, ttl: MemorySessionStore(10, ttl),
+                                  lambda tmp_path, ttl: SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl)])
+def test_sessions_expire(tmp_path, monkeypatch, make):
+    store = make(tmp_path, 60)
+    store.put(1, Session(position=(2.17, 41.39)))
+    assert store.get(1).position == (2.17, 41.39)
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert store.get(1) == Session()
+
+
+def test_sqlite_store_persists_and_is_shared(tmp_path):
+    filename = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(filename, ttl=0)
+    store.put(1, Session((2.17, 41.39), ["7"], None))
+    store.close()
+    first, second = SQLiteSessionStore(filename, ttl=0), SQLiteSessionStore(filename, ttl=0)
+    assert first.get(1).position == (2.17, 41.39) and first.get(1).restaurants == ["7"]
+    second.put(2, Session(profile="wheelchair"))
+    assert first.get(2).profile == "wheelchair"
+    first.close()
+    second.close()
+
+
+def test_sqlite_store_purges_expired_sessions(tmp_path, monkeypatch):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), ttl=60, purge_every=2)
+    store.put(1, Session())
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    store.put(2, Session())
+    assert [row[0] for row in store.db.execute("SELECT chat_id FROM sessions")] == [2]
+    store.close()
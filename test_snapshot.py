@@ -0,0 +1,80 @@
+import os
+import numpy as np
+
+import city
+import benchmark
+from snapshot import snapshot_from_city_graph, snapshot_to_city_graph, patch_snapshot, save_snapshot, open_snapshot, \
+    metro_subgraph
+
+
+def same_graph(a, b) -> bool:
+    return dict(a.nodes(data=True)) == dict(b.nodes(data=True)) and \
+        {frozenset((u, v)): data for u, v, data in a.edges(data=True)} == \
+        {frozenset((u, v)): data for u, v, data in b.edges(data=True)}
+
+
+def changed_metro(g2):
+    """
+    Metro graph with a station removed (with its accesses) and an access moved.
+    """
+    g2 = g2.copy()
+    station = next(node for node, node_type in g2.nodes(data='type') if node_type == "Station")
+    g2.remove_nodes_from([station] + [node for node in g2[station] if g2.nodes[node]['type'] == "Acces"])
+    access = next(node for node, node_type in g2.nodes(data='type') if node_type == "Acces")
+    lon, lat = g2.nodes[access]['pos']
+    g2.nodes[access]['pos'] = (lon + 0.002, lat - 0.001)
+    return g2
+
+
+def test_patched_snapshot_matches_rebuild():
+    g1, g2 = benchmark.synthetic_osmnx_graph(20), city.get_metro_graph()
+    g = city.build_city_graph(g1, g2)
+    s = snapshot_from_city_graph(g)
+    new_g2 = changed_metro(g2)
+    touched = city.update_city_graph(g, new_g2, city.city_graph_index(g))
+    assert touched
+    patched = patch_snapshot(s, g, touched)
+    rebuilt = snapshot_from_city_graph(city.build_city_graph(benchmark.synthetic_osmnx_graph(20), new_g2))
+    assert same_graph(snapshot_to_city_graph(patched), snapshot_to_city_graph(rebuilt))
+    assert same_graph(snapshot_to_city_graph(patched), g)
+
+
+def test_snapshot_patched_from_metro_subgraph(tmp_path, monkeypatch):
+    g1, g2 = benchmark.synthetic_osmnx_graph(20), city.get_metro_graph()
+    dirname = str(tmp_path / "city_graph")
+    s = snapshot_from_city_graph(city.build_city_graph(g1, g2))
+    save_snapshot(s, dirname, "old")
+    new_g2 = changed_metro(g2)
+    monkeypatch.setattr(city, "get_metro_graph", lambda: new_g2)
+    monkeypatch.setattr(city, "osmnx_sources", lambda osmnx_filename: [])
+    patched = city.update_city_snapshot(open_snapshot(dirname), city.snapshot_index(s), dirname, "street_graph")
+    # Only the edges of the stations and accesses are rebuilt, none between streets.
+    sub = metro_subgraph(s)
+    assert not any(sub.nodes[u]['type'] == sub.nodes[v]['type'] == "Street" for u, v in sub.edges())
+    rebuilt = snapshot_from_city_graph(city.build_city_graph(benchmark.synthetic_osmnx_graph(20), new_g2))
+    assert same_graph(snapshot_to_city_graph(patched), snapshot_to_city_graph(rebuilt))
+
+
+def test_save_snapshot_swaps_versions(tmp_path):
+    g = city.build_city_graph(benchmark.synthetic_osmnx_graph(5), city.get_metro_graph())
+    s = snapshot_from_city_graph(g)
+    dirname = str(tmp_path / "city_graph")
+    save_snapshot(s, dirname, "first")
+    first = open_snapshot(dirname)
+    for fingerprint in ("second", "third"):
+        save_snapshot(s, dirname, fingerprint)
+        assert os.path.islink(dirname)
+    assert open_snapshot(dirname).fingerprint == "third"
+    # The current version and the previous one are kept, older ones are deleted.
+    assert len([f for f in os.listdir(tmp_path) if f.startswith("city_graph.v")]) == 2
+    # Arrays already mapped stay readable.
+    assert np.array_equal(first.indptr, s.indptr) and first.fingerprint == "first"
+
+
+def test_save_snapshot_replaces_plain_directory(tmp_path):
+    s = snapshot_from_city_graph(city.build_city_graph(benchmark.synthetic_osmnx_graph(5), city.get_metro_graph()))
+    dirname = str(tmp_path / "city_graph")
+    os.makedirs(dirname)
+    save_snapshot(s, dirname, "new")
+    assert os.path.islink(dirname) and open_snapshot(dirname).fingerprint == "new"
+    assert len(os.listdir(tmp_path)) == 2
@@ -0,0 +1,38 @@
+import time
+import numpy as np
+
+from spatial import build_spatial_index, project, k_nearest, nearest_node, nearest_nodes
+
+
+def random_index(n: int = 2000, seed: int = 0):
+    rnd = np.random.default_rng(seed)
+    pos = np.column_stack((rnd.uniform(2.10, 2.23, n), rnd.uniform(41.35, 41.45, n)))
+    return build_spatial_index(list(range(n)), pos), pos
+
+
+def brute_force(idx, coord, k):
+    point = project(idx.lat0, np.array([coord]))[0]
+    dists = np.hypot(*(idx.xy - point).T)
+    return [idx.ids[i] for i in np.argsort(dists, kind="stable")[:k]]
+
+
+def test_nearest_matches_brute_force():
+    idx, _ = random_index()
+    rnd = np.random.default_rng(1)
+    for coord in zip(rnd.uniform(2.05, 2.28, 200), rnd.uniform(41.30, 41.50, 200)):
+        assert [node for node, _ in k_nearest(idx, coord, 5)] == brute_force(idx, coord, 5)
+
+
+def test_point_far_outside_the_grid():
+    idx, _ = random_index()
+    for coord in [(-3.70, 40.42), (151.21, -33.87), (2.17, 89.0)]:  # Madrid, Sydney, next to the North Pole
+        start = time.perf_counter()
+        assert nearest_node(idx, coord) == brute_force(idx, coord, 1)[0]
+        assert [node for node, _ in k_nearest(idx, coord, 3)] == brute_force(idx, coord, 3)
+        assert time.perf_counter() - start < 1.0
+        assert nearest_nodes(idx, [coord], max_dist=1000.0) == [None]
+
+
+def test_empty_index():
+    idx = build_spatial_index([], np.empty((0, 2)))
+    assert nearest_nodes(idx, [(2.17, 41.39)]) == [None]
@@ -0,0 +1,126 @@
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Optional, Dict, Tuple
+
+import city
+import metrics
+from snapshot import CitySnapshot, open_snapshot, path_graph
+from routing import Router, build_router
+from spatial import SpatialIndex
+from contraction import Hierarchy
+from cache import Route
+from schedule import TimedRouter, shortest_path_at
+from profiles import DEFAULT_PROFILE, profile_routers, profile_timed_routers
+
+# Pool of worker processes that serve /guide jobs (routing and rendering, which hold the GIL) so that they run in
+# parallel on several cores. Workers don't build a CityGraph of their own: each one opens the compiled snapshot
+# memory-mapped, so the graph is loaded once in the page cache and shared by all of them, and only the nodes and
+# edges of each path are turned into a small CityGraph to time and plot it. Routers and the contraction hierarchy
+# read the arrays of the snapshot through memoryviews instead of copying them into lists, so they stay shared too.
+# What each worker still holds on its own is the node ids and their index, the spatial index of the streets and
+# the weights of the routing profiles: on a graph of 23k nodes, 92 MB of private memory per worker (most of it the
+# interpreter and its libraries), down from 160 MB with lists.
+
+
+@dataclass
+class WorkerState:
+    dirname: str
+    snapshot: CitySnapshot
+    index: SpatialIndex
+    routers: Dict[str, Router]  # by routing profile, see profiles.py
+    hierarchy: Optional[Hierarchy]  # used instead of the router of the default profile
+    timed: Dict[str, TimedRouter]  # by routing profile, used for the routes that depart at a given time of day
+
+
+# State of the current worker process, set by init_worker.
+state: Optional[WorkerState] = None
+
+
+def init_worker(dirname: str) -> None:
+    """
+    Initializer of the worker processes: opens the snapshot in dirname, and builds the spatial index of its streets
+    and its routers for every routing profile. The contraction hierarchy is only opened once the bot asks for it,
+    see route.
+    Args:
+        dirname: directory where the snapshot is stored
+    """
+    global state
+    s = open_snapshot(dirname)
+    factors = city.build_city_profiles(s)
+    state = WorkerState(dirname, s, city.snapshot_index(s), profile_routers(s, build_router(s), factors), None,
+                        profile_timed_routers(s, city.build_city_timed_router(s), factors))
+
+
+def render(g: city.CityGraph, path: city.Path, compress_level: int, scale: float,
+           minutes: Optional[int] = None) -> Route:
+    """
+    Plots the path in memory, without going through the disk.
+    Args:
+        g: CityGraph containing the path
+        path: path to be plotted
+        compress_level: zlib compression level of the map, from 0 to 9
+        scale: factor the map is resized by
+        minutes: estimated time of the path, time_from_path if None
+    Returns:
+    Route with the path, its estimated time in minutes and the rendered map.
+    """
+    buffer = io.BytesIO()
+    city.plot_path(g, path, buffer, compress_level, scale)
+    return Route(path, city.time_from_path(g, path) if minutes is None else minutes, buffer.getvalue())
+
+
+def route(origin: city.NodeID, destination: city.NodeID, compress_level: int, scale: float,
+          fingerprint: str, depart_h: Optional[float] = None, profile: str = DEFAULT_PROFILE,
+          hierarchy: bool = False) -> Tuple[Route, metrics.Samples]:
+    """
+    Finds the path between two nodes and renders it. Runs in a worker process.
+    Args:
+        origin: node closest to the user position
+        destination: node closest to the restaurant
+        compress_level: zlib compression level of the map, from 0 to 9
+        scale: factor the map is resized by
+        fingerprint: fingerprint of the snapshot the bot is using. If it has been updated since the worker opened
+                     it, the worker opens it again.
+        depart_h: time of day of the departure in hours since midnight, see schedule.py. If None, the time of the
+                  route doesn't depend on it.
+        profile: routing profile, see profiles.py
+        hierarchy: whether the bot uses the contraction hierarchy of the snapshot. If the worker hasn't opened it
+                   yet, e.g. because it has been rebuilt since the worker opened the snapshot, the worker opens it.
+    Returns:
+    Tuple with the Route (the path, its estimated time in minutes and the rendered map) and the durations of its
+    stages, to be merged into the metrics of the bot, see metrics.py.
+    """
+    assert state is not None, "route has to run in a process started by start_workers"
+    if state.snapshot.fingerprint != fingerprint:
+        init_worker(state.dirname)
+    if hierarchy and state.hierarchy is None:
+        state.hierarchy = city.load_city_hierarchy(state.snapshot, state.dirname)
+    if depart_h is not None:
+        with metrics.stage("shortest_path_at"):
+            hours, path = shortest_path_at(state.timed[profile], origin, destination, depart_h)
+        r = render(path_graph(state.snapshot, path), path, compress_level, scale, int(hours * 60))
+    else:
+        # The contraction hierarchy is only built for the default profile.
+        path = city.path_between(None, origin, destination, state.routers[profile],
+                                 state.hierarchy if profile == DEFAULT_PROFILE else None)
+        r = render(path_graph(state.snapshot, path), path, compress_level, scale)
+    return r, metrics.drain()
+
+
+def start_workers(dirname: str, processes: int) -> ProcessPoolExecutor:
+    """
+    Starts the worker processes, and waits for them to be ready. Processes are forked, so this has to be called
+    before starting any thread (e.g. before running the bot).
+    Args:
+        dirname: directory where the snapshot is stored
+        processes: number of worker processes
+    Returns:
+    ProcessPoolExecutor whose jobs (e.g. route) run in the workers.
+    """
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("fork"),
+                                   initializer=init_worker, initargs=(dirname,))
+    # The first job starts all the processes, and fails if they couldn't open the snapshot.
+    executor.submit(int).result()
+    return executor